@@ -1,18 +1,71 @@
+import time
 import os
+import atexit
+import bisect
+import functools
+import itertools
+import importlib
 import json
 import csv
 import io
-import yfinance as yf
-from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session, make_response
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-# from openai import OpenAI
+import hashlib
+import math
+import queue
+import random
+import uuid
+import re
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+import click
+from datetime import datetime, timedelta, timezone
+from flask import Flask, Response, stream_with_context, render_template, request, redirect, url_for, jsonify, session, send_file, before_render_template, template_rendered
 from dotenv import load_dotenv
+from peewee import SqliteDatabase, Model, AutoField, CharField, FloatField, BooleanField, IntegerField, TextField, EXCLUDED
+from playhouse.migrate import SqliteMigrator, migrate
+
+try:
+    import fcntl
+except ImportError:  # Windows has no flock; fall back to in-process locking only
+    fcntl = None
+
+_module_started = time.perf_counter()
+
+def _process_age():
+    """Seconds since this process started according to /proc, or None where it is unavailable."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+class _LazyModule:
+    """Stand-in for a heavy module that imports it on first attribute access.
+
+    numpy, pandas and yfinance together take most of a cold start, and pages such
+    as / never touch them.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+np = _LazyModule("numpy")
+pd = _LazyModule("pandas")
+yf = _LazyModule("yfinance")
 
 # Load environment variables
 load_dotenv()
@@ -20,87 +73,1913 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "dev-secret-key-change-in-production")
 
-# Initialize OpenAI client
-from openai import OpenAI
+# OpenAI client, created on first use
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+def get_openai_client():
+    """Return the shared OpenAI client, importing the SDK and creating the client on first call."""
+    global _openai_client
+    if _openai_client is None:
+        with _openai_client_lock:
+            if _openai_client is None:
+                from openai import OpenAI
+                _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _openai_client
+
+# Metrics: each process records into plain in-memory tables and periodically writes a
+# snapshot to METRICS_DIR, so /metrics can add up every gunicorn worker
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+METRICS_RETIRED_FILE = "retired.json"  # totals of exited workers, so counters never go backwards
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRICS = {
+    "stockly_request_duration_seconds": ("histogram", "Time spent handling a request, by route"),
+    "stockly_upstream_duration_seconds": ("histogram", "Time spent in calls to market data, the LLM and the PDF renderer"),
+    "stockly_template_render_seconds": ("histogram", "Time spent rendering a template"),
+    "stockly_cache_requests_total": ("counter", "Cache lookups, by cache and result"),
+    "stockly_fallbacks_total": ("counter", "Times static fallback content was served instead of LLM output"),
+    "stockly_market_data_requests_total": ("counter", "Outbound market data requests, by outcome"),
+}
+
+_metrics_lock = threading.Lock()
+_metric_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+_metric_counters = {}  # (name, labels) -> value
+_metrics_file_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+_metrics_flusher_started = False
+
+def _reset_metrics_after_fork():
+    """Start a forked worker with empty tables and its own snapshot file."""
+    global _metrics_lock, _metrics_file_id, _metrics_flusher_started
+    _metrics_lock = threading.Lock()
+    _metric_histograms.clear()
+    _metric_counters.clear()
+    _metrics_file_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    _metrics_flusher_started = False
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_metrics_after_fork)
+
+def observe(name, seconds, **labels):
+    """Record one duration in a histogram."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    index = bisect.bisect_left(METRICS_BUCKETS, seconds)
+    with _metrics_lock:
+        row = _metric_histograms.get(key)
+        if row is None:
+            row = _metric_histograms[key] = [0] * (len(METRICS_BUCKETS) + 3)
+        row[index] += 1
+        row[-2] += seconds
+        row[-1] += 1
+
+def count(name, amount=1, **labels):
+    """Add to a counter."""
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _metric_counters[key] = _metric_counters.get(key, 0) + amount
+
+@contextmanager
+def timed(name="stockly_upstream_duration_seconds", **labels):
+    """Observe how long the block takes, including when it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+def timed_call(call):
+    """Decorator form of timed() for upstream calls."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(call=call):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _metrics_snapshot():
+    """Copy this process's tables into a JSON-friendly dict."""
+    with _metrics_lock:
+        histograms = [[name, list(labels), list(row)] for (name, labels), row in _metric_histograms.items()]
+        counters = [[name, list(labels), value] for (name, labels), value in _metric_counters.items()]
+    return {"buckets": list(METRICS_BUCKETS), "histograms": histograms, "counters": counters}
+
+def flush_metrics():
+    """Write this process's snapshot to METRICS_DIR, replacing its previous one."""
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"{_metrics_file_id}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(_metrics_snapshot(), f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"Error writing metrics snapshot: {e}")
+
+def _metrics_flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush_metrics()
+
+@app.before_request
+def _start_request_timer():
+    """Note the request start and make sure this worker's snapshots get written."""
+    global _metrics_flusher_started
+    request.environ["stockly.started"] = time.perf_counter()
+    if METRICS_ENABLED and not _metrics_flusher_started:
+        with _metrics_lock:
+            if _metrics_flusher_started:
+                return
+            _metrics_flusher_started = True
+        threading.Thread(target=_metrics_flush_loop, daemon=True).start()
+        atexit.register(flush_metrics)
+
+@app.after_request
+def _record_request_duration(response):
+    started = request.environ.get("stockly.started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        observe("stockly_request_duration_seconds", time.perf_counter() - started,
+                route=route, method=request.method, status=str(response.status_code))
+    return response
+
+@before_render_template.connect_via(app)
+def _start_template_timer(sender, template, context, **extra):
+    context["_render_started"] = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def _record_template_duration(sender, template, context, **extra):
+    started = context.get("_render_started")
+    if started is not None:
+        observe("stockly_template_render_seconds", time.perf_counter() - started, template=template.name or "<string>")
+
+def _read_metrics_snapshot(name):
+    """Load a snapshot file from METRICS_DIR, or None if it is gone, unreadable or uses other buckets."""
+    try:
+        with open(os.path.join(METRICS_DIR, name)) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Error reading metrics snapshot {name}: {e}")
+        return None
+    return snapshot if snapshot.get("buckets") == list(METRICS_BUCKETS) else None
+
+def _merge_metrics(snapshots):
+    """Add up snapshots into (histograms, counters) tables keyed by (name, labels)."""
+    histograms = {}
+    counters = {}
+    for snapshot in snapshots:
+        for name, labels, row in snapshot["histograms"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            merged = histograms.get(key)
+            if merged is None:
+                histograms[key] = list(row)
+            else:
+                for i, value in enumerate(row):
+                    merged[i] += value
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+    return histograms, counters
+
+def _pid_alive(name):
+    """Whether the worker that wrote a "<pid>-<id>.json" snapshot is still running; unknown names count as alive."""
+    pid = name.split("-", 1)[0]
+    if not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # exists but belongs to another user
+    return True
+
+def _retire_dead_snapshots(names):
+    """Fold the snapshots of exited workers into METRICS_RETIRED_FILE and delete them.
+
+    Returns the snapshot names still present. Skipped without fcntl, where neither the
+    liveness check nor the file lock is available.
+    """
+    dead = [name for name in names if name != METRICS_RETIRED_FILE and not _pid_alive(name)]
+    if fcntl is None or not dead:
+        return names
+    try:
+        with open(os.path.join(METRICS_DIR, ".lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Another worker may have retired some of them while we waited for the lock
+                dead = [name for name in dead if os.path.exists(os.path.join(METRICS_DIR, name))]
+                if dead:
+                    snapshots = [_read_metrics_snapshot(name) for name in [METRICS_RETIRED_FILE] + dead]
+                    histograms, counters = _merge_metrics(snapshot for snapshot in snapshots if snapshot)
+                    retired = {
+                        "buckets": list(METRICS_BUCKETS),
+                        "histograms": [[name, list(labels), row] for (name, labels), row in histograms.items()],
+                        "counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+                    }
+                    path = os.path.join(METRICS_DIR, METRICS_RETIRED_FILE)
+                    with open(f"{path}.tmp", 'w') as f:
+                        json.dump(retired, f)
+                    os.replace(f"{path}.tmp", path)
+                    for name in dead:
+                        os.remove(os.path.join(METRICS_DIR, name))
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    except OSError as e:
+        print(f"Error retiring metrics snapshots: {e}")
+    return os.listdir(METRICS_DIR) if os.path.isdir(METRICS_DIR) else []
+
+def collect_metrics():
+    """Merge the snapshots of every worker, with this process's live tables in place of its file."""
+    own_file = f"{_metrics_file_id}.json"
+    try:
+        names = [name for name in os.listdir(METRICS_DIR) if name.endswith(".json") and name != own_file]
+    except FileNotFoundError:
+        names = []
+    names = [name for name in _retire_dead_snapshots(names) if name.endswith(".json") and name != own_file]
+    snapshots = [_metrics_snapshot()] + [_read_metrics_snapshot(name) for name in names]
+    return _merge_metrics(snapshot for snapshot in snapshots if snapshot)
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+def render_metrics():
+    """Render the merged metrics in the Prometheus text exposition format."""
+    histograms, counters = collect_metrics()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "histogram":
+            for (metric, labels), row in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(METRICS_BUCKETS, row):
+                    cumulative += bucket
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', repr(bound)))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {row[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {row[-2]!r}")
+                lines.append(f"{name}_count{_format_labels(labels)} {row[-1]}")
+        else:
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
 
-# Portfolio data storage (in-memory for now)
+# Legacy JSON data files, imported once into the SQLite database
 PORTFOLIO_FILE = "portfolio_data.json"
 NOTIFICATIONS_FILE = "notifications_data.json"
 NOTIFICATION_PREFERENCES_FILE = "notification_preferences.json"
 
-def load_portfolio_data():
-    """Load portfolio data from JSON file or return empty dict."""
+NOTIFICATION_RETENTION_DAYS = float(os.getenv("NOTIFICATION_RETENTION_DAYS", 30))
+NOTIFICATIONS_PAGE_SIZE = 20
+MAX_NOTIFICATIONS_PAGE_SIZE = 100
+
+# SQLite storage: WAL lets readers run alongside the single writer across gunicorn workers
+DATABASE_FILE = os.getenv("DATABASE_FILE", "stockly.db")
+db = SqliteDatabase(DATABASE_FILE, pragmas={
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'cache_size': -8000  # 8 MB
+})
+
+DEFAULT_NOTIFICATION_PREFERENCES = {
+    "price_change_threshold": 5.0,  # 5% price change
+    "big_news_enabled": True,
+    "earnings_alerts": True,
+    "watchlist_stocks": [],
+    "email_notifications": False,
+    "push_notifications": True
+}
+
+# Per-user partitions: every visitor gets a session user id that scopes portfolios, lots,
+# notifications and preferences. Quotes and price history stay shared.
+USER_PARTITIONING = os.getenv("USER_PARTITIONING", "0") == "1"
+DEFAULT_USER_ID = "default"  # partition of data from before partitioning, and of every request when it is off
+_current_user = ContextVar("current_user", default=DEFAULT_USER_ID)
+_partition_locks = {}
+_partition_locks_guard = threading.Lock()
+
+def current_user_id():
+    """Return the user id of the partition the current request or job works in."""
+    return _current_user.get()
+
+@contextmanager
+def user_partition(user_id):
+    """Run a block (e.g. in a background thread) inside one user's partition."""
+    token = _current_user.set(user_id)
+    try:
+        yield
+    finally:
+        _current_user.reset(token)
+
+@contextmanager
+def partition_lock(user_id=None):
+    """Serialize in-process work on one partition without blocking other users."""
+    user_id = user_id or current_user_id()
+    with _partition_locks_guard:
+        lock = _partition_locks.setdefault(user_id, threading.Lock())
+    with lock:
+        yield
+
+def _partition_key(name, user_id=None):
+    """Namespace a key-value row name by user. The default partition keeps bare names."""
+    user_id = user_id or current_user_id()
+    return name if user_id == DEFAULT_USER_ID else f"{user_id}:{name}"
+
+class BaseModel(Model):
+    class Meta:
+        database = db
+
+class Holding(BaseModel):
+    """Aggregate position per ticker, kept up to date incrementally as lots are recorded."""
+    user_id = CharField(default=DEFAULT_USER_ID)
+    ticker = CharField()
+    shares = FloatField()
+    purchase_price = FloatField()  # weighted average cost of the shares still held
+    date_added = CharField()
+    cost_basis = FloatField(default=0)  # FIFO cost of the open lots
+    lot_count = IntegerField(default=0)  # number of open lots
+
+    class Meta:
+        table_name = 'holdings'
+        indexes = ((('user_id', 'ticker'), True),)
+
+class Lot(BaseModel):
+    """One purchase in the lot ledger; sales consume open lots first in, first out."""
+    id = AutoField()
+    user_id = CharField(default=DEFAULT_USER_ID)
+    ticker = CharField()
+    date = CharField()
+    quantity = FloatField()
+    price = FloatField()
+    remaining = FloatField()
+
+    class Meta:
+        table_name = 'lots'
+        indexes = ((('user_id', 'ticker', 'date'), False),)
+
+class Notification(BaseModel):
+    id = AutoField()
+    user_id = CharField(default=DEFAULT_USER_ID)
+    type = CharField(default="info")
+    ticker = CharField(null=True)
+    title = CharField(default="")
+    message = TextField(default="")
+    timestamp = CharField(index=True)
+    read = BooleanField(default=False, index=True)
+    priority = CharField(default="medium")
+
+    class Meta:
+        table_name = 'notifications'
+        indexes = ((('user_id', 'id'), False),)
+
+    def to_dict(self):
+        return {
+            "id": f"notif_{self.id}",
+            "type": self.type,
+            "ticker": self.ticker,
+            "title": self.title,
+            "message": self.message,
+            "timestamp": self.timestamp,
+            "read": self.read,
+            "priority": self.priority
+        }
+
+class Preference(BaseModel):
+    key = CharField(primary_key=True)  # partition key, see _partition_key()
+    value = TextField()  # JSON-encoded
+
+    class Meta:
+        table_name = 'preferences'
+
+class Counter(BaseModel):
+    """Incrementally maintained counts, so hot paths never run COUNT(*) queries."""
+    name = CharField(primary_key=True)  # partition key for per-user counters, see _partition_key()
+    value = IntegerField(default=0)
+
+    class Meta:
+        table_name = 'counters'
+
+class AlertReference(BaseModel):
+    """Last price each ticker was alerted at (or first seen at), per user."""
+    ticker = CharField(primary_key=True)  # partition key, see _partition_key()
+    price = FloatField()
+    updated_at = CharField()
+
+    class Meta:
+        table_name = 'alert_references'
+
+class AlertLog(BaseModel):
+    """Keys of alerts already sent, so each move is only announced once per user."""
+    dedup_key = CharField(primary_key=True)  # partition key, see _partition_key()
+    created_at = CharField(index=True)
+
+    class Meta:
+        table_name = 'alert_log'
+
+class RecommendationCache(BaseModel):
+    """Model recommendations keyed by a normalized investor profile."""
+    key = CharField(primary_key=True)
+    picks = TextField()  # JSON list of picks without dollar amounts
+    created_at = FloatField()
+    last_used = FloatField(index=True)
+
+    class Meta:
+        table_name = 'recommendation_cache'
+
+class InsightCache(BaseModel):
+    """AI insights keyed by a hash of the valuation snapshot they describe."""
+    snapshot_hash = CharField(primary_key=True)
+    insights = TextField()
+    created_at = FloatField(index=True)
+
+    class Meta:
+        table_name = 'insight_cache'
+
+class Job(BaseModel):
+    """Background job state, shared so any worker can answer status polls."""
+    id = CharField(primary_key=True)
+    user_id = CharField(default=DEFAULT_USER_ID)
+    kind = CharField()
+    dedup_key = CharField(index=True)
+    status = CharField(default="queued")  # queued, running, done, failed, timeout
+    result = TextField(null=True)  # JSON result, or file metadata for file results
+    error = TextField(null=True)
+    created_at = FloatField(index=True)
+    updated_at = FloatField()
+
+    class Meta:
+        table_name = 'jobs'
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "error": self.error,
+            "created_at": datetime.fromtimestamp(self.created_at).isoformat(),
+            "updated_at": datetime.fromtimestamp(self.updated_at).isoformat(),
+            "status_url": url_for("job_status", job_id=self.id),
+            "result_url": url_for("job_result", job_id=self.id)
+        }
+
+class StorageMeta(BaseModel):
+    key = CharField(primary_key=True)
+    value = TextField()
+
+    class Meta:
+        table_name = 'storage_meta'
+
+def _read_legacy_json(path):
+    """Read a legacy JSON data file, returning None if it is missing or unreadable."""
     try:
-        if os.path.exists(PORTFOLIO_FILE):
-            with open(PORTFOLIO_FILE, 'r') as f:
+        if os.path.exists(path):
+            with open(path, 'r') as f:
                 return json.load(f)
+    except Exception as e:
+        print(f"Error reading {path}: {e}")
+    return None
+
+def init_storage():
+    """Create the database tables and import the legacy JSON files exactly once."""
+    # Databases created before partitioning: existing rows join the default partition. This runs
+    # before create_tables() so the partition indexes are only built once the columns exist.
+    with db.atomic():
+        for model in (Holding, Lot, Notification, Job):
+            table = model._meta.table_name
+            if db.table_exists(table) and 'user_id' not in {column.name for column in db.get_columns(table)}:
+                db.execute_sql(f'ALTER TABLE "{table}" ADD COLUMN "user_id" VARCHAR(255) NOT NULL DEFAULT \'{DEFAULT_USER_ID}\'')
+                if model is Holding:
+                    for index in db.get_indexes(table):
+                        if index.unique and index.columns == ['ticker']:
+                            db.execute_sql(f'DROP INDEX "{index.name}"')
+    
+    db.create_tables([Holding, Lot, Notification, Preference, Counter, AlertReference, AlertLog,
+                      RecommendationCache, InsightCache, Job, StorageMeta], safe=True)
+    
+    # Databases created before the lot ledger need the aggregate columns
+    holding_columns = {column.name for column in db.get_columns('holdings')}
+    if 'cost_basis' not in holding_columns:
+        migrator = SqliteMigrator(db)
+        migrate(
+            migrator.add_column('holdings', 'cost_basis', Holding.cost_basis),
+            migrator.add_column('holdings', 'lot_count', Holding.lot_count)
+        )
+    
+    # IMMEDIATE takes the write lock up front so only one worker performs the import
+    with db.atomic('IMMEDIATE'):
+        if not StorageMeta.get_or_none(StorageMeta.key == "json_imported"):
+            portfolio_data = _read_legacy_json(PORTFOLIO_FILE)
+            if portfolio_data:
+                _replace_holdings(portfolio_data)
+            
+            notifications_data = _read_legacy_json(NOTIFICATIONS_FILE)
+            if notifications_data:
+                _replace_notifications(notifications_data)
+            
+            preferences = _read_legacy_json(NOTIFICATION_PREFERENCES_FILE)
+            if preferences:
+                _store_preferences(preferences)
+            
+            StorageMeta.create(key="json_imported", value=datetime.now().isoformat())
+        
+        # Holdings from before the lot ledger become one lot each
+        if not StorageMeta.get_or_none(StorageMeta.key == "lots_backfilled"):
+            missing = Holding.select().where((Holding.user_id == DEFAULT_USER_ID) & (Holding.lot_count == 0))
+            _insert_opening_lots([(row.ticker, row.shares, row.purchase_price, row.date_added) for row in missing])
+            StorageMeta.create(key="lots_backfilled", value=datetime.now().isoformat())
+        
+        # Databases created before the counters existed need one full count
+        if not Counter.get_or_none(Counter.name == "total_notifications"):
+            legacy = Notification.user_id == DEFAULT_USER_ID
+            _set_counter("total_notifications", Notification.select().where(legacy).count())
+            _set_counter("unread_notifications", Notification.select().where(legacy & (Notification.read == False)).count())
+
+@app.before_request
+def _open_db_connection():
+    db.connect(reuse_if_open=True)
+
+@app.before_request
+def _enter_user_partition():
+    """Scope the request to the visitor's partition, assigning a user id on first visit.
+
+    The first session ever seen claims the default partition, so a single-user install
+    that turns partitioning on keeps the portfolio it already had.
+    """
+    user_id = DEFAULT_USER_ID
+    if USER_PARTITIONING:
+        user_id = session.get("user_id")
+        if not user_id:
+            user_id = DEFAULT_USER_ID if _claim_default_partition() else uuid.uuid4().hex
+            session["user_id"] = user_id
+            session.permanent = True
+    _current_user.set(user_id)
+
+def _claim_default_partition():
+    """Atomically hand the default partition to one session across all workers. Returns True for the winner."""
+    try:
+        Counter.insert(name="default_partition_claimed", value=0).on_conflict_ignore().execute()
+        return Counter.update(value=1).where(
+            (Counter.name == "default_partition_claimed") & (Counter.value == 0)
+        ).execute() == 1
+    except Exception as e:
+        print(f"Error claiming default partition: {e}")
+        return False
+
+@app.teardown_request
+def _close_db_connection(exc):
+    if not db.is_closed():
+        db.close()
+
+def load_portfolio_data():
+    """Load portfolio data as a ticker -> holding dict."""
+    try:
+        return {
+            row.ticker: {
+                "shares": row.shares,
+                "purchase_price": row.purchase_price,
+                "date_added": row.date_added
+            }
+            for row in Holding.select().where(Holding.user_id == current_user_id()).order_by(Holding.id)
+        }
     except Exception as e:
         print(f"Error loading portfolio data: {e}")
     return {}
 
+def load_holding(ticker):
+    """Load a single holding, or None if it is not in the portfolio."""
+    row = Holding.get_or_none((Holding.user_id == current_user_id()) & (Holding.ticker == ticker))
+    if row is None:
+        return None
+    return {"shares": row.shares, "purchase_price": row.purchase_price, "date_added": row.date_added,
+            "cost_basis": row.cost_basis, "lot_count": row.lot_count}
+
+def _upsert_positions(changes):
+    """Add (ticker, shares, cost, lots, date_added) deltas to the aggregate positions.
+
+    New tickers are inserted; existing ones are updated in place without reading their lots.
+    Caller manages the transaction.
+    """
+    user_id = current_user_id()
+    rows = [
+        {
+            "user_id": user_id,
+            "ticker": ticker,
+            "shares": shares,
+            "purchase_price": cost / shares,
+            "date_added": date_added,
+            "cost_basis": cost,
+            "lot_count": lots
+        }
+        for ticker, shares, cost, lots, date_added in changes
+    ]
+    for offset in range(0, len(rows), 500):
+        Holding.insert_many(rows[offset:offset + 500]).on_conflict(
+            conflict_target=[Holding.user_id, Holding.ticker],
+            update={
+                Holding.shares: Holding.shares + EXCLUDED.shares,
+                Holding.cost_basis: Holding.cost_basis + EXCLUDED.cost_basis,
+                Holding.lot_count: Holding.lot_count + EXCLUDED.lot_count,
+                Holding.purchase_price: (Holding.cost_basis + EXCLUDED.cost_basis) / (Holding.shares + EXCLUDED.shares)
+            }
+        ).execute()
+
+def _insert_opening_lots(holdings):
+    """Record one lot per (ticker, shares, price, date) holding. Caller manages the transaction."""
+    now = datetime.now().isoformat()
+    user_id = current_user_id()
+    lots = [
+        {"user_id": user_id, "ticker": ticker, "date": date_added or now, "quantity": shares, "price": price, "remaining": shares}
+        for ticker, shares, price, date_added in holdings
+    ]
+    for offset in range(0, len(lots), 500):
+        Lot.insert_many(lots[offset:offset + 500]).execute()
+    Holding.delete().where((Holding.user_id == user_id) & Holding.ticker.in_([lot["ticker"] for lot in lots])).execute()
+    _upsert_positions([(lot["ticker"], lot["quantity"], lot["quantity"] * lot["price"], 1, lot["date"]) for lot in lots])
+
+def add_lots(lots):
+    """Append (ticker, quantity, price, date) purchases to the ledger and update the positions.
+
+    Caller manages the transaction.
+    """
+    now = datetime.now().isoformat()
+    user_id = current_user_id()
+    rows = [
+        {"user_id": user_id, "ticker": ticker, "date": date or now, "quantity": quantity, "price": price, "remaining": quantity}
+        for ticker, quantity, price, date in lots
+    ]
+    for offset in range(0, len(rows), 500):
+        Lot.insert_many(rows[offset:offset + 500]).execute()
+    
+    changes = {}
+    for row in rows:
+        shares, cost, count, date_added = changes.get(row["ticker"], (0.0, 0.0, 0, row["date"]))
+        changes[row["ticker"]] = (shares + row["quantity"], cost + row["quantity"] * row["price"],
+                                  count + 1, min(date_added, row["date"]))
+    _upsert_positions([(ticker, *change) for ticker, change in changes.items()])
+    bump_data_version("portfolio")
+
+def add_lot(ticker, quantity, price, date=None):
+    """Record a purchase of a ticker as a new lot."""
+    try:
+        with db.atomic():
+            add_lots([(ticker, quantity, price, date)])
+    except Exception as e:
+        print(f"Error adding lot for {ticker}: {e}")
+
+def sell_shares(ticker, quantity):
+    """Sell shares of a ticker, consuming its open lots first in, first out.
+
+    Only the lots consumed are read. Returns the FIFO cost of the shares sold; raises
+    ValueError when the position is smaller than the quantity.
+    """
+    user_id = current_user_id()
+    with db.atomic():
+        position = Holding.get_or_none((Holding.user_id == user_id) & (Holding.ticker == ticker))
+        if position is None or quantity > position.shares + 1e-9:
+            raise ValueError(f"Cannot sell {quantity} shares of {ticker}")
+        
+        to_sell = quantity
+        sold_cost = 0.0
+        closed = 0
+        open_lots = (Lot.select()
+                     .where((Lot.user_id == user_id) & (Lot.ticker == ticker) & (Lot.remaining > 0))
+                     .order_by(Lot.date, Lot.id))
+        for lot in open_lots.iterator():
+            if to_sell <= 1e-9:
+                break
+            used = min(lot.remaining, to_sell)
+            to_sell -= used
+            sold_cost += used * lot.price
+            remaining = lot.remaining - used
+            if remaining <= 1e-9:
+                remaining = 0.0
+                closed += 1
+            Lot.update(remaining=remaining).where(Lot.id == lot.id).execute()
+        
+        shares = position.shares - quantity
+        if shares <= 1e-9:
+            Holding.delete().where(Holding.id == position.id).execute()
+        else:
+            cost_basis = position.cost_basis - sold_cost
+            Holding.update(shares=shares, cost_basis=cost_basis, purchase_price=cost_basis / shares,
+                           lot_count=position.lot_count - closed).where(Holding.id == position.id).execute()
+        bump_data_version("portfolio")
+    return sold_cost
+
+def load_lots(ticker):
+    """Load every lot recorded for a ticker, oldest first."""
+    return [
+        {"id": lot.id, "date": lot.date, "quantity": lot.quantity, "price": lot.price, "remaining": lot.remaining}
+        for lot in (Lot.select()
+                    .where((Lot.user_id == current_user_id()) & (Lot.ticker == ticker))
+                    .order_by(Lot.date, Lot.id))
+    ]
+
+def save_holding(ticker, shares, purchase_price, date_added=None):
+    """Set a holding to a single lot with the given shares and price, replacing its ledger."""
+    try:
+        with db.atomic():
+            Lot.delete().where((Lot.user_id == current_user_id()) & (Lot.ticker == ticker)).execute()
+            _insert_opening_lots([(ticker, shares, purchase_price, date_added)])
+            bump_data_version("portfolio")
+    except Exception as e:
+        print(f"Error saving holding {ticker}: {e}")
+
+def remove_holding(ticker):
+    """Delete a single holding and its lots."""
+    try:
+        with db.atomic():
+            user_id = current_user_id()
+            Lot.delete().where((Lot.user_id == user_id) & (Lot.ticker == ticker)).execute()
+            if Holding.delete().where((Holding.user_id == user_id) & (Holding.ticker == ticker)).execute():
+                bump_data_version("portfolio")
+    except Exception as e:
+        print(f"Error deleting holding {ticker}: {e}")
+
+def _replace_holdings(data):
+    """Replace every holding with the given ticker -> holding dict. Caller manages the transaction."""
+    Holding.delete().where(Holding.user_id == current_user_id()).execute()
+    Lot.delete().where(Lot.user_id == current_user_id()).execute()
+    _insert_opening_lots([
+        (ticker, holding["shares"], holding["purchase_price"], holding.get("date_added"))
+        for ticker, holding in data.items()
+    ])
+    bump_data_version("portfolio")
+
 def save_portfolio_data(data):
-    """Save portfolio data to JSON file."""
+    """Replace the whole portfolio with the given ticker -> holding dict."""
     try:
-        with open(PORTFOLIO_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
+        with db.atomic():
+            _replace_holdings(data)
     except Exception as e:
         print(f"Error saving portfolio data: {e}")
 
-def load_notifications_data():
-    """Load notifications data from JSON file or return empty list."""
+# Bulk import: parse, validate and price a whole upload at once, then write it in one transaction
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", 50000))
+IMPORT_COLUMN_ALIASES = {
+    "symbol": "ticker",
+    "quantity": "shares",
+    "qty": "shares",
+    "price": "purchase_price",
+    "cost": "purchase_price",
+    "average_price": "purchase_price",
+    "avg_price": "purchase_price",
+    "cost_per_share": "purchase_price",
+    "purchase_date": "date_added",
+    "date": "date_added"
+}
+TICKER_PATTERN = r"^[A-Z][A-Z0-9.\-]{0,9}$"
+
+def parse_holdings_upload(stream, filename="", content_type=""):
+    """Parse a CSV or JSON holdings upload into a DataFrame with normalized column names.
+
+    JSON may be a list of row objects or a ticker -> holding object like portfolio_data.json.
+    """
+    is_json = filename.lower().endswith(".json") or "json" in (content_type or "")
+    if is_json:
+        data = json.load(stream)
+        if isinstance(data, dict):
+            data = [{"ticker": ticker, **holding} for ticker, holding in data.items()]
+        df = pd.DataFrame.from_records(data)
+    else:
+        df = pd.read_csv(stream, dtype=str, skipinitialspace=True)
+    
+    df.columns = [str(column).strip().lower().replace(" ", "_") for column in df.columns]
+    df = df.rename(columns=IMPORT_COLUMN_ALIASES)
+    return df.loc[:, ~df.columns.duplicated()]
+
+def validate_holdings_frame(df):
+    """Validate an upload in vectorized passes.
+
+    Returns (valid, errors): a DataFrame of the valid rows and a list of per-row error dicts.
+    Row numbers count data rows from 1. Raises MarketDataUnavailable when tickers cannot
+    be checked because the upstream is failing, so real positions are never rejected
+    as unknown.
+    """
+    for column in ("ticker", "shares", "purchase_price"):
+        if column not in df.columns:
+            raise ValueError(f"Missing required column: {column}")
+    if len(df) > IMPORT_MAX_ROWS:
+        raise ValueError(f"Too many rows: {len(df)} (limit {IMPORT_MAX_ROWS})")
+    
+    frame = pd.DataFrame({
+        "row": np.arange(1, len(df) + 1),
+        "ticker": df["ticker"].fillna("").astype(str).str.strip().str.upper(),
+        "shares": pd.to_numeric(df["shares"], errors="coerce"),
+        "purchase_price": pd.to_numeric(df["purchase_price"], errors="coerce")
+    })
+    if "date_added" in df.columns:
+        dates = pd.to_datetime(df["date_added"], errors="coerce")
+        frame["date_added"] = dates.dt.strftime("%Y-%m-%dT%H:%M:%S").where(dates.notna(), None)
+    else:
+        frame["date_added"] = None
+    
+    checks = [
+        (~frame["ticker"].str.match(TICKER_PATTERN), "Invalid ticker symbol"),
+        (frame["shares"].isna(), "Shares must be a number"),
+        (frame["shares"].notna() & ~(frame["shares"] > 0), "Shares must be greater than 0"),
+        (frame["purchase_price"].isna(), "Purchase price must be a number"),
+        (frame["purchase_price"].notna() & ~(frame["purchase_price"] > 0), "Purchase price must be greater than 0")
+    ]
+    
+    # Every well-formed ticker is checked against one batched price lookup
+    well_formed = frame["ticker"][~checks[0][0]].unique().tolist()
+    prices = get_stock_prices(well_formed) if well_formed else {}
+    known = [ticker for ticker in well_formed if prices.get(ticker)]
+    unpriced = [ticker for ticker in well_formed if not prices.get(ticker)]
+    if unpriced:
+        known += _confirm_tickers(unpriced)
+    checks.append((~checks[0][0] & ~frame["ticker"].isin(known), "Unknown ticker or no price available"))
+    
+    errors = []
+    invalid = np.zeros(len(frame), dtype=bool)
+    for mask, message in checks:
+        mask = mask.to_numpy()
+        for row, ticker in zip(frame["row"][mask].tolist(), frame["ticker"][mask].tolist()):
+            errors.append({"row": row, "ticker": ticker, "error": message})
+        invalid |= mask
+    errors.sort(key=lambda error: error["row"])
+    
+    return frame[~invalid], errors
+
+def _confirm_tickers(tickers):
+    """Ask the provider directly about tickers the quote cache had no price for.
+
+    Returns the ones that do have a price. Any chunk that fails, or is turned away by the
+    rate limiter or circuit breaker, raises MarketDataUnavailable instead of making its
+    tickers look unknown.
+    """
+    provider = get_market_data_provider()
+    found = []
+    for start in range(0, len(tickers), QUOTE_BATCH_SIZE):
+        chunk = tickers[start:start + QUOTE_BATCH_SIZE]
+        try:
+            quotes = provider.get_quotes(chunk)
+        except Exception as e:
+            raise MarketDataUnavailable(f"Market data is unavailable, so tickers could not be checked: {e}") from e
+        found += [ticker for ticker in chunk if quotes.get(ticker)]
+    return found
+
+def import_holdings(valid, replace=False):
+    """Record each validated row as a lot in a single transaction.
+
+    With replace=True the existing portfolio and its lots are removed first.
+    """
+    lots = list(zip(valid["ticker"].tolist(), valid["shares"].tolist(),
+                    valid["purchase_price"].tolist(), valid["date_added"].tolist()))
+    with db.atomic():
+        if replace:
+            Holding.delete().where(Holding.user_id == current_user_id()).execute()
+            Lot.delete().where(Lot.user_id == current_user_id()).execute()
+        add_lots(lots)
+    return len(lots)
+
+def bump_data_version(name):
+    """Record that a user's resource changed, for ETag and Last-Modified headers. Caller manages the transaction."""
+    _add_to_counter(_partition_key(f"{name}_version"), 1)
+    _set_counter(_partition_key(f"{name}_modified"), int(time.time()))
+
+def get_data_version(name):
+    """Return (version, last modified epoch seconds) for a user's resource in a single query."""
+    version_key, modified_key = _partition_key(f"{name}_version"), _partition_key(f"{name}_modified")
+    counters = dict(
+        Counter.select(Counter.name, Counter.value)
+        .where(Counter.name.in_([version_key, modified_key]))
+        .tuples()
+    )
+    return counters.get(version_key, 0), counters.get(modified_key, 0)
+
+def get_counter(name):
+    """Read a maintained counter."""
+    return Counter.select(Counter.value).where(Counter.name == name).scalar() or 0
+
+def _add_to_counter(name, delta):
+    """Adjust a maintained counter. Caller manages the transaction."""
+    Counter.insert(name=name, value=delta).on_conflict(
+        conflict_target=[Counter.name],
+        update={Counter.value: Counter.value + delta}
+    ).execute()
+
+def _set_counter(name, value):
+    """Overwrite a maintained counter. Caller manages the transaction."""
+    Counter.insert(name=name, value=value).on_conflict_replace().execute()
+
+def load_notifications_page(cursor=None, limit=NOTIFICATIONS_PAGE_SIZE):
+    """Load one page of notifications, newest first, starting after cursor.
+
+    Returns (notifications, next_cursor); next_cursor is None on the last page.
+    """
     try:
-        if os.path.exists(NOTIFICATIONS_FILE):
-            with open(NOTIFICATIONS_FILE, 'r') as f:
-                return json.load(f)
+        query = (Notification.select()
+                 .where(Notification.user_id == current_user_id())
+                 .order_by(Notification.id.desc())
+                 .limit(limit + 1))
+        row_id = _parse_notification_id(cursor) if cursor else None
+        if row_id is not None:
+            query = query.where(Notification.id < row_id)
+        notifications = [row.to_dict() for row in query]
+        next_cursor = None
+        if len(notifications) > limit:
+            notifications = notifications[:limit]
+            next_cursor = notifications[-1]["id"]
+        return notifications, next_cursor
     except Exception as e:
         print(f"Error loading notifications data: {e}")
-    return []
+    return [], None
+
+def load_notifications_data():
+    """Load the most recent page of notifications, newest first."""
+    notifications, _ = load_notifications_page()
+    return notifications
+
+def get_unread_notification_count():
+    """Return the number of unread notifications."""
+    return get_counter(_partition_key("unread_notifications"))
+
+def get_total_notification_count():
+    """Return the number of stored notifications."""
+    return get_counter(_partition_key("total_notifications"))
+
+def _notification_row(notification):
+    """Map a notification dict onto Notification columns."""
+    return {
+        "user_id": current_user_id(),
+        "type": notification.get("type", "info"),
+        "ticker": notification.get("ticker"),
+        "title": notification.get("title", ""),
+        "message": notification.get("message", ""),
+        "timestamp": notification.get("timestamp") or datetime.now().isoformat(),
+        "read": bool(notification.get("read", False)),
+        "priority": notification.get("priority", "medium")
+    }
+
+def _replace_notifications(data):
+    """Replace every notification with the given newest-first list. Caller manages the transaction."""
+    Notification.delete().where(Notification.user_id == current_user_id()).execute()
+    # Insert oldest first so that ids keep increasing with recency
+    rows = [_notification_row(notification) for notification in reversed(data)]
+    for offset in range(0, len(rows), 500):
+        Notification.insert_many(rows[offset:offset + 500]).execute()
+    _set_counter(_partition_key("total_notifications"), len(rows))
+    _set_counter(_partition_key("unread_notifications"), sum(1 for row in rows if not row["read"]))
+    bump_data_version("notifications")
 
 def save_notifications_data(data):
-    """Save notifications data to JSON file."""
+    """Replace all notifications with the given newest-first list."""
     try:
-        with open(NOTIFICATIONS_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
+        with db.atomic():
+            _replace_notifications(data)
     except Exception as e:
         print(f"Error saving notifications data: {e}")
 
+def mark_notification_as_read(notification_id):
+    """Mark a single notification as read, keeping the unread counter in step."""
+    row_id = _parse_notification_id(notification_id)
+    if row_id is None:
+        return False
+    with db.atomic():
+        updated = (Notification.update(read=True)
+                   .where((Notification.id == row_id) & (Notification.user_id == current_user_id()) &
+                          (Notification.read == False))
+                   .execute())
+        if updated:
+            _add_to_counter(_partition_key("unread_notifications"), -updated)
+            bump_data_version("notifications")
+    return True
+
+def prune_notifications():
+    """Delete the current user's notifications older than the retention window."""
+    cutoff = (datetime.now() - timedelta(days=NOTIFICATION_RETENTION_DAYS)).isoformat()
+    expired = (Notification.user_id == current_user_id()) & (Notification.timestamp < cutoff)
+    with db.atomic():
+        expired_unread = Notification.select().where(expired & (Notification.read == False)).count()
+        deleted = Notification.delete().where(expired).execute()
+        if deleted:
+            _add_to_counter(_partition_key("total_notifications"), -deleted)
+            _add_to_counter(_partition_key("unread_notifications"), -expired_unread)
+            bump_data_version("notifications")
+    return deleted
+
+def _parse_notification_id(notification_id):
+    """Turn a public notification id such as 'notif_12' into its row id, or None."""
+    try:
+        return int(str(notification_id).replace("notif_", "", 1))
+    except ValueError:
+        return None
+
 def load_notification_preferences():
-    """Load notification preferences from JSON file or return default."""
+    """Load notification preferences, filling in defaults for unset keys."""
+    preferences = dict(DEFAULT_NOTIFICATION_PREFERENCES)
     try:
-        if os.path.exists(NOTIFICATION_PREFERENCES_FILE):
-            with open(NOTIFICATION_PREFERENCES_FILE, 'r') as f:
-                return json.load(f)
+        prefix = _partition_key("")
+        query = Preference.select()
+        query = query.where(Preference.key.startswith(prefix)) if prefix else query.where(~Preference.key.contains(":"))
+        for row in query:
+            preferences[row.key[len(prefix):]] = json.loads(row.value)
     except Exception as e:
         print(f"Error loading notification preferences: {e}")
-    return {
-        "price_change_threshold": 5.0,  # 5% price change
-        "big_news_enabled": True,
-        "earnings_alerts": True,
-        "watchlist_stocks": [],
-        "email_notifications": False,
-        "push_notifications": True
-    }
+    return preferences
+
+def _store_preferences(data):
+    """Upsert each preference key. Caller manages the transaction."""
+    rows = [{"key": _partition_key(key), "value": json.dumps(value)} for key, value in data.items()]
+    if rows:
+        Preference.insert_many(rows).on_conflict(
+            conflict_target=[Preference.key],
+            preserve=[Preference.value]
+        ).execute()
 
 def save_notification_preferences(data):
-    """Save notification preferences to JSON file."""
+    """Save notification preferences."""
     try:
-        with open(NOTIFICATION_PREFERENCES_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
+        with db.atomic():
+            _store_preferences(data)
     except Exception as e:
         print(f"Error saving notification preferences: {e}")
 
+# Market data providers: every quote and daily close comes through one provider, chosen with
+# MARKET_DATA_PROVIDER ("yfinance", "local", "record" or "replay")
+MARKET_DATA_PROVIDER = os.getenv("MARKET_DATA_PROVIDER", "yfinance")
+MARKET_DATA_PATH = os.getenv("MARKET_DATA_PATH", "market_data")  # file or directory read by the local provider
+MARKET_DATA_RECORDING = os.getenv("MARKET_DATA_RECORDING", "market_data_recording.jsonl")
+MARKET_DATA_FILE_TYPES = (".csv", ".parquet")
+# Outbound limits for network providers, per worker
+MARKET_DATA_RATE_LIMIT = float(os.getenv("MARKET_DATA_RATE_LIMIT", 2))  # requests per second, 0 disables
+MARKET_DATA_BURST = int(os.getenv("MARKET_DATA_BURST", 5))
+MARKET_DATA_RATE_WAIT = float(os.getenv("MARKET_DATA_RATE_WAIT", 2))  # seconds a request may wait for its turn
+MARKET_DATA_RETRIES = int(os.getenv("MARKET_DATA_RETRIES", 2))
+MARKET_DATA_RETRY_DELAY = float(os.getenv("MARKET_DATA_RETRY_DELAY", 0.5))  # seconds, doubled per retry
+MARKET_DATA_FAILURE_THRESHOLD = int(os.getenv("MARKET_DATA_FAILURE_THRESHOLD", 5))
+MARKET_DATA_BACKOFF_BASE = float(os.getenv("MARKET_DATA_BACKOFF_BASE", 5))  # seconds the circuit first stays open
+MARKET_DATA_BACKOFF_MAX = float(os.getenv("MARKET_DATA_BACKOFF_MAX", 300))
+
+class MarketDataUnavailable(Exception):
+    """Raised when the rate limiter or circuit breaker turns a request away."""
+
+class MarketDataProvider:
+    """Source of quotes and daily closes. Both methods take a batch of tickers."""
+    name = "base"
+
+    def get_quotes(self, tickers):
+        """Return a ticker -> latest price mapping, leaving out tickers without a price."""
+        raise NotImplementedError
+
+    def get_history(self, tickers, start_day=None):
+        """Return a ticker -> (day numbers, closes) mapping of daily closes from start_day on, or all of them."""
+        raise NotImplementedError
+
+class YFinanceProvider(MarketDataProvider):
+    """Live data from Yahoo Finance, requested in chunks of QUOTE_BATCH_SIZE tickers.
+
+    Tickers with no data (unknown or delisted symbols) are left out of the result. Only
+    exceptions from yfinance (transport, HTTP and rate-limit errors) are raised, so a bad
+    symbol never counts against the circuit breaker.
+    """
+    name = "yfinance"
+
+    def get_quotes(self, tickers):
+        if len(tickers) == 1:
+            return self._get_quote(tickers[0])
+
+        prices = {}
+        error = None
+        for start in range(0, len(tickers), QUOTE_BATCH_SIZE):
+            chunk = tickers[start:start + QUOTE_BATCH_SIZE]
+            try:
+                with timed(call="yfinance_download"):
+                    data = yf.download(chunk, period="5d", auto_adjust=True, progress=False, threads=True)
+                if data.empty:
+                    continue
+                closes = data['Close']
+                if not hasattr(closes, 'columns'):
+                    closes = closes.to_frame(chunk[0])
+                # Use the most recent bar each ticker actually traded on
+                latest = closes.ffill().iloc[-1]
+                for ticker, price in latest.items():
+                    if price == price:  # skip NaN
+                        prices[ticker] = float(price)
+            except Exception as e:
+                print(f"Error fetching prices for {len(chunk)} tickers: {e}")
+                error = e
+        if error is not None and not prices:
+            raise error
+        return prices
+
+    def _get_quote(self, ticker):
+        stock = yf.Ticker(ticker)
+        with timed(call="yfinance_history"):
+            hist = stock.history(period="1d")
+        if hist.empty:
+            return {}
+        return {ticker: float(hist['Close'].iloc[-1])}
+
+    def get_history(self, tickers, start_day=None):
+        history = {}
+        error = None
+        for offset in range(0, len(tickers), QUOTE_BATCH_SIZE):
+            chunk = tickers[offset:offset + QUOTE_BATCH_SIZE]
+            try:
+                with timed(call="yfinance_history_download"):
+                    if start_day is None:
+                        data = yf.download(chunk, period="max", auto_adjust=True, progress=False, threads=True)
+                    else:
+                        start = str(np.datetime64(int(start_day), 'D'))
+                        data = yf.download(chunk, start=start, auto_adjust=True, progress=False, threads=True)
+                if data.empty:
+                    continue
+                closes = data['Close']
+                if not hasattr(closes, 'columns'):
+                    closes = closes.to_frame(chunk[0])
+                index = closes.index
+                if getattr(index, 'tz', None) is not None:
+                    index = index.tz_localize(None)
+                days = index.values.astype('datetime64[D]').astype(np.int64)
+                for ticker in closes.columns:
+                    history[ticker] = (days, closes[ticker].to_numpy(dtype=np.float64))
+            except Exception as e:
+                print(f"Error fetching history for {len(chunk)} tickers: {e}")
+                error = e
+        if error is not None and not history:
+            raise error
+        return history
+
+class LocalFileProvider(MarketDataProvider):
+    """End-of-day closes from local CSV or Parquet files: one file, or every file in a directory.
+
+    Files are either long (date, ticker, close columns; "symbol" works for ticker) or wide
+    (a date column plus one close column per ticker). The latest close is the quote.
+    Files are re-read when one of them changes.
+    """
+    name = "local"
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._series = {}
+
+    def _files(self):
+        if os.path.isdir(self.path):
+            return sorted(os.path.join(self.path, name) for name in os.listdir(self.path)
+                          if name.lower().endswith(MARKET_DATA_FILE_TYPES))
+        if os.path.exists(self.path):
+            return [self.path]
+        raise FileNotFoundError(f"No market data at {self.path}")
+
+    def _read_file(self, path):
+        """Read one file into (tickers, day numbers, closes) arrays."""
+        df = pd.read_parquet(path) if path.lower().endswith(".parquet") else pd.read_csv(path)
+        lowered = {column: str(column).strip().lower() for column in df.columns}
+        if "ticker" in lowered.values() or "symbol" in lowered.values():
+            df = df.rename(columns=lowered).rename(columns={"symbol": "ticker"})
+        else:
+            # Wide layout: the first column (or the one named date) holds dates, the rest are tickers
+            date_column = next((column for column, name in lowered.items() if name == "date"), df.columns[0])
+            df = df.rename(columns={date_column: "date"}).melt(id_vars="date", var_name="ticker", value_name="close")
+        days = pd.to_datetime(df["date"]).values.astype('datetime64[D]').astype(np.int64)
+        tickers = df["ticker"].astype(str).str.strip().str.upper().to_numpy()
+        closes = pd.to_numeric(df["close"], errors="coerce").to_numpy(dtype=np.float64)
+        return tickers, days, closes
+
+    def _load(self):
+        """Return ticker -> (sorted day numbers, closes), re-reading the files if any changed."""
+        files = self._files()
+        signature = [(path, os.stat(path).st_mtime_ns) for path in files]
+        with self._lock:
+            if signature == self._signature:
+                return self._series
+            parts = [self._read_file(path) for path in files]
+            tickers = np.concatenate([part[0] for part in parts]) if parts else np.array([], dtype=object)
+            days = np.concatenate([part[1] for part in parts]) if parts else np.array([], dtype=np.int64)
+            closes = np.concatenate([part[2] for part in parts]) if parts else np.array([], dtype=np.float64)
+            keep = ~np.isnan(closes)
+            tickers, days, closes = tickers[keep], days[keep], closes[keep]
+            
+            # Group by ticker in one sort; later files win when a day appears twice
+            order = np.lexsort((np.arange(len(days)), days, tickers))
+            tickers, days, closes = tickers[order], days[order], closes[order]
+            last_of_day = np.ones(len(days), dtype=bool)
+            last_of_day[:-1] = (tickers[1:] != tickers[:-1]) | (days[1:] != days[:-1])
+            tickers, days, closes = tickers[last_of_day], days[last_of_day], closes[last_of_day]
+            starts = np.flatnonzero(np.r_[True, tickers[1:] != tickers[:-1]]) if len(tickers) else np.array([], dtype=np.int64)
+            ends = np.r_[starts[1:], len(tickers)]
+            self._series = {tickers[start]: (days[start:end], closes[start:end]) for start, end in zip(starts, ends)}
+            self._signature = signature
+            return self._series
+
+    def get_quotes(self, tickers):
+        series = self._load()
+        return {ticker: float(series[ticker][1][-1]) for ticker in tickers if ticker in series}
+
+    def get_history(self, tickers, start_day=None):
+        series = self._load()
+        history = {}
+        for ticker in tickers:
+            if ticker not in series:
+                continue
+            days, closes = series[ticker]
+            start = 0 if start_day is None else int(np.searchsorted(days, start_day))
+            if start < len(days):
+                history[ticker] = (days[start:], closes[start:])
+        return history
+
+class RecordingProvider(MarketDataProvider):
+    """Passes calls through to another provider and appends every response to a JSON lines file."""
+    name = "record"
+
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _record(self, kind, data):
+        try:
+            with self._lock, open(self.path, 'a') as f:
+                f.write(json.dumps({"kind": kind, "recorded_at": time.time(), "data": data}) + "\n")
+        except Exception as e:
+            print(f"Error recording market data: {e}")
+
+    def get_quotes(self, tickers):
+        prices = self.inner.get_quotes(tickers)
+        self._record("quotes", prices)
+        return prices
+
+    def get_history(self, tickers, start_day=None):
+        history = self.inner.get_history(tickers, start_day)
+        self._record("history", {
+            ticker: [np.asarray(days).tolist(), np.asarray(closes).tolist()]
+            for ticker, (days, closes) in history.items()
+        })
+        return history
+
+class ReplayProvider(MarketDataProvider):
+    """Serves a recording made by RecordingProvider without touching the network.
+
+    Quotes are the last recorded price per ticker and history is every recorded
+    close, so a replayed session always sees the same data.
+    """
+    name = "replay"
+
+    def __init__(self, path):
+        self.path = path
+        self.quotes = {}
+        closes_by_day = {}
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry["kind"] == "quotes":
+                    self.quotes.update(entry["data"])
+                elif entry["kind"] == "history":
+                    for ticker, (days, closes) in entry["data"].items():
+                        closes_by_day.setdefault(ticker, {}).update(zip(days, closes))
+        self.series = {}
+        for ticker, by_day in closes_by_day.items():
+            days = np.array(sorted(by_day), dtype=np.int64)
+            self.series[ticker] = (days, np.array([by_day[day] for day in days.tolist()], dtype=np.float64))
+
+    def get_quotes(self, tickers):
+        return {ticker: self.quotes[ticker] for ticker in tickers if ticker in self.quotes}
+
+    def get_history(self, tickers, start_day=None):
+        history = {}
+        for ticker in tickers:
+            if ticker not in self.series:
+                continue
+            days, closes = self.series[ticker]
+            start = 0 if start_day is None else int(np.searchsorted(days, start_day))
+            if start < len(days):
+                history[ticker] = (days[start:], closes[start:])
+        return history
+
+class TokenBucket:
+    """Allows rate requests per second on average, with bursts of up to capacity."""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout):
+        """Take a token, waiting up to timeout seconds for one. Returns False if none became available."""
+        if self.rate <= 0:
+            return True
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+class CircuitBreaker:
+    """Opens after threshold consecutive failures and fails fast while open.
+
+    Each further failure doubles the open period, up to maximum. When it runs out, one
+    trial request is let through; success closes the circuit again.
+    """
+    def __init__(self, threshold, base, maximum):
+        self.threshold = max(1, threshold)
+        self.base = base
+        self.maximum = maximum
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.failures < self.threshold:
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half_open"
+
+    def allow(self):
+        with self._lock:
+            if self.failures < self.threshold:
+                return True
+            if self.trial_running or time.monotonic() < self.open_until:
+                return False
+            self.trial_running = True
+            return True
+
+    def release(self):
+        """Give back a trial slot taken by allow() without making the request."""
+        with self._lock:
+            self.trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.failures >= self.threshold:
+                backoff = min(self.maximum, self.base * 2 ** (self.failures - self.threshold))
+                self.open_until = time.monotonic() + backoff
+
+class ResilientProvider(MarketDataProvider):
+    """Guards a network provider: one rate-limited request per QUOTE_BATCH_SIZE chunk, retried
+    with exponential backoff and jitter, behind a circuit breaker."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.name = inner.name
+        self.bucket = TokenBucket(MARKET_DATA_RATE_LIMIT, MARKET_DATA_BURST)
+        self.breaker = CircuitBreaker(MARKET_DATA_FAILURE_THRESHOLD, MARKET_DATA_BACKOFF_BASE, MARKET_DATA_BACKOFF_MAX)
+
+    def _call(self, method, chunk, *args):
+        for attempt in range(MARKET_DATA_RETRIES + 1):
+            if not self.breaker.allow():
+                count("stockly_market_data_requests_total", outcome="circuit_open")
+                raise MarketDataUnavailable("Market data circuit is open")
+            if not self.bucket.acquire(MARKET_DATA_RATE_WAIT):
+                self.breaker.release()
+                count("stockly_market_data_requests_total", outcome="rate_limited")
+                raise MarketDataUnavailable("Market data rate limit reached")
+            try:
+                result = method(chunk, *args)
+            except Exception:
+                self.breaker.record_failure()
+                count("stockly_market_data_requests_total", outcome="error")
+                if attempt == MARKET_DATA_RETRIES:
+                    raise
+                time.sleep(random.uniform(0, MARKET_DATA_RETRY_DELAY * 2 ** attempt))
+                continue
+            self.breaker.record_success()
+            count("stockly_market_data_requests_total", outcome="ok")
+            return result
+
+    def _chunked(self, method, tickers, *args):
+        """Call method chunk by chunk, keeping what succeeded; raises only if every chunk failed."""
+        results = {}
+        error = None
+        for start in range(0, len(tickers), QUOTE_BATCH_SIZE):
+            try:
+                results.update(self._call(method, tickers[start:start + QUOTE_BATCH_SIZE], *args))
+            except Exception as e:
+                error = e
+        if error is not None and not results:
+            raise error
+        return results
+
+    def get_quotes(self, tickers):
+        return self._chunked(self.inner.get_quotes, list(tickers))
+
+    def get_history(self, tickers, start_day=None):
+        return self._chunked(self.inner.get_history, list(tickers), start_day)
+
+_market_data_provider = None
+_market_data_provider_lock = threading.Lock()
+
+def create_market_data_provider(name=None):
+    """Build the provider named by MARKET_DATA_PROVIDER (or name)."""
+    name = (name or MARKET_DATA_PROVIDER).lower()
+    if name == "yfinance":
+        return ResilientProvider(YFinanceProvider())
+    if name == "local":
+        return LocalFileProvider(MARKET_DATA_PATH)
+    if name == "record":
+        return RecordingProvider(ResilientProvider(YFinanceProvider()), MARKET_DATA_RECORDING)
+    if name == "replay":
+        return ReplayProvider(MARKET_DATA_RECORDING)
+    raise ValueError(f"Unknown market data provider: {name}")
+
+def get_market_data_provider():
+    """Return the shared market data provider, creating it on first use."""
+    global _market_data_provider
+    if _market_data_provider is None:
+        with _market_data_provider_lock:
+            if _market_data_provider is None:
+                _market_data_provider = create_market_data_provider()
+    return _market_data_provider
+
+def set_market_data_provider(provider):
+    """Switch to another provider and drop quotes cached from the previous one."""
+    global _market_data_provider
+    with _market_data_provider_lock:
+        _market_data_provider = provider
+    clear_quote_cache()
+
+# Shared quote cache: ticker -> (price, fetched_at), kept in LRU order
+QUOTE_CACHE_TTL = float(os.getenv("QUOTE_CACHE_TTL", 60))  # seconds
+QUOTE_CACHE_MAX_SIZE = int(os.getenv("QUOTE_CACHE_MAX_SIZE", 2048))
+QUOTE_BATCH_SIZE = int(os.getenv("QUOTE_BATCH_SIZE", 200))  # tickers per bulk download
+QUOTE_STALE_TTL = float(os.getenv("QUOTE_STALE_TTL", 900))  # seconds an expired quote may still be served as stale
+_quote_cache = OrderedDict()
+_quote_cache_lock = threading.Lock()
+# Single-flight registry: ticker -> {"event": Event, "price": float | None}
+_quote_inflight = {}
+# Stale quotes are refreshed one batch at a time in the background, never by the request serving them
+_quote_refreshing = set()
+_quote_refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="quote-refresh")
+
+def _get_cached_quote(ticker):
+    """Return a fresh cached price for ticker, or None. Caller must hold the cache lock."""
+    entry = _quote_cache.get(ticker)
+    if entry is None:
+        return None
+    price, fetched_at = entry
+    if time.monotonic() - fetched_at > QUOTE_CACHE_TTL:
+        return None
+    _quote_cache.move_to_end(ticker)
+    return price
+
+def _get_stale_quote(ticker):
+    """Return an expired cached price that is still within QUOTE_STALE_TTL, or None. Caller must hold the cache lock."""
+    entry = _quote_cache.get(ticker)
+    if entry is None or time.monotonic() - entry[1] > QUOTE_STALE_TTL:
+        return None
+    _quote_cache.move_to_end(ticker)
+    return entry[0]
+
+def _store_quote(ticker, price):
+    """Store a price in the quote cache, evicting least recently used entries. Caller must hold the cache lock."""
+    _quote_cache[ticker] = (price, time.monotonic())
+    _quote_cache.move_to_end(ticker)
+    while len(_quote_cache) > QUOTE_CACHE_MAX_SIZE:
+        _quote_cache.popitem(last=False)
+
+def clear_quote_cache():
+    """Drop every cached quote."""
+    with _quote_cache_lock:
+        _quote_cache.clear()
+
+def _fetch_stock_prices(tickers):
+    """Fetch current prices for many tickers from the market data provider (no caching)."""
+    try:
+        return get_market_data_provider().get_quotes(tickers)
+    except Exception as e:
+        print(f"Error fetching prices for {len(tickers)} tickers: {e}")
+    return {}
+
+def _refresh_stale_quotes(tickers):
+    """Background refresh of quotes that were served stale."""
+    fetched = {}
+    try:
+        fetched = _fetch_stock_prices(tickers)
+    finally:
+        with _quote_cache_lock:
+            for ticker, price in fetched.items():
+                _store_quote(ticker, price)
+            _quote_refreshing.difference_update(tickers)
+
+def get_stock_prices(tickers, stale=None):
+    """Fetch current prices for a set of tickers, returning a ticker -> price mapping.
+
+    Fresh quotes are served from the shared cache. Expired quotes younger than
+    QUOTE_STALE_TTL are served as they are while one background refresh fetches
+    them; pass a set as stale to collect those tickers. The remaining tickers are
+    fetched in one bulk request, sharing in-flight fetches with concurrent callers.
+    Tickers without a price are left out of the result.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    prices = {}
+    owned = {}
+    waiting = {}
+    served_stale = []
+    refresh = []
+
+    misses = 0
+    with _quote_cache_lock:
+        for ticker in tickers:
+            price = _get_cached_quote(ticker)
+            if price is not None:
+                prices[ticker] = price
+                continue
+            price = _get_stale_quote(ticker)
+            if price is not None:
+                prices[ticker] = price
+                served_stale.append(ticker)
+                if ticker not in _quote_refreshing and ticker not in _quote_inflight:
+                    _quote_refreshing.add(ticker)
+                    refresh.append(ticker)
+                continue
+            misses += 1
+            flight = _quote_inflight.get(ticker)
+            if flight is None:
+                flight = {"event": threading.Event(), "price": None}
+                _quote_inflight[ticker] = flight
+                owned[ticker] = flight
+            else:
+                waiting[ticker] = flight
+    count("stockly_cache_requests_total", len(tickers) - misses - len(served_stale), cache="quote", result="hit")
+    count("stockly_cache_requests_total", len(served_stale), cache="quote", result="stale")
+    count("stockly_cache_requests_total", misses, cache="quote", result="miss")
+    if refresh:
+        _quote_refresh_executor.submit(_refresh_stale_quotes, refresh)
+    if stale is not None:
+        stale.update(served_stale)
+
+    if owned:
+        fetched = {}
+        try:
+            fetched = _fetch_stock_prices(list(owned))
+        finally:
+            with _quote_cache_lock:
+                for ticker, flight in owned.items():
+                    price = fetched.get(ticker)
+                    if price is not None:
+                        _store_quote(ticker, price)
+                        prices[ticker] = price
+                    flight["price"] = price
+                    del _quote_inflight[ticker]
+            for flight in owned.values():
+                flight["event"].set()
+
+    # Other requests are already fetching these tickers; share their results
+    for ticker, flight in waiting.items():
+        flight["event"].wait()
+        if flight["price"] is not None:
+            prices[ticker] = flight["price"]
+
+    return prices
+
 def get_stock_price(ticker):
-    """Fetch current stock price using yfinance."""
+    """Fetch current stock price for a single ticker."""
+    return get_stock_prices([ticker]).get(ticker)
+
+# On-disk price history store: per-ticker append-only columns of daily closes.
+# <TICKER>.dates holds int32 days since 1970-01-01, <TICKER>.close holds float64 closes.
+PRICE_HISTORY_DIR = os.getenv("PRICE_HISTORY_DIR", "price_history")
+PRICE_HISTORY_REFRESH_INTERVAL = float(os.getenv("PRICE_HISTORY_REFRESH_INTERVAL", 3600))  # seconds
+PRICE_HISTORY_RETRY_INTERVAL = float(os.getenv("PRICE_HISTORY_RETRY_INTERVAL", 60))  # seconds after a failed download
+HISTORY_DATE_DTYPE = '<i4'
+HISTORY_CLOSE_DTYPE = '<f8'
+HISTORY_RANGES = {
+    "5d": 5, "1mo": 31, "3mo": 92, "6mo": 183,
+    "1y": 366, "2y": 731, "5y": 1827, "10y": 3653,
+    "ytd": None, "max": None
+}
+_history_next_refresh = {}  # ticker -> monotonic time its next refresh is due
+_history_thread_locks = {}
+_history_thread_locks_guard = threading.Lock()
+
+def _history_path(ticker, column):
+    """Return the file path of one column of a ticker's stored history."""
+    safe_ticker = re.sub(r'[^A-Z0-9.^=-]', '_', ticker.upper())
+    return os.path.join(PRICE_HISTORY_DIR, f"{safe_ticker}.{column}")
+
+@contextmanager
+def _history_lock(ticker):
+    """Serialize writers of a ticker's history across threads and worker processes."""
+    with _history_thread_locks_guard:
+        lock = _history_thread_locks.setdefault(ticker, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(PRICE_HISTORY_DIR, exist_ok=True)
+        with open(_history_path(ticker, "lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _read_history_column(path, dtype):
+    """Memory-map a stored history column, returning an empty array if it is missing."""
+    dtype = np.dtype(dtype)
+    if not os.path.exists(path) or os.path.getsize(path) < dtype.itemsize:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(os.path.getsize(path) // dtype.itemsize,))
+
+def load_price_history(ticker):
+    """Load a ticker's stored daily closes as (day numbers, closes) arrays."""
+    dates = _read_history_column(_history_path(ticker, "dates"), HISTORY_DATE_DTYPE)
+    closes = _read_history_column(_history_path(ticker, "close"), HISTORY_CLOSE_DTYPE)
+    # A writer interrupted between the two appends can leave one column longer
+    count = min(len(dates), len(closes))
+    return dates[:count], closes[:count]
+
+def _append_price_history(ticker, dates, closes):
+    """Append bars newer than the last stored date to a ticker's history. Caller must hold the ticker lock."""
+    stored_dates, _ = load_price_history(ticker)
+    if len(stored_dates):
+        newer = dates > stored_dates[-1]
+        dates, closes = dates[newer], closes[newer]
+    if not len(dates):
+        return 0
+    os.makedirs(PRICE_HISTORY_DIR, exist_ok=True)
+    with open(_history_path(ticker, "close"), 'ab') as f:
+        f.write(closes.astype(HISTORY_CLOSE_DTYPE).tobytes())
+    with open(_history_path(ticker, "dates"), 'ab') as f:
+        f.write(dates.astype(HISTORY_DATE_DTYPE).tobytes())
+    return len(dates)
+
+def _download_price_history(tickers, start_day=None):
+    """Download completed daily closes for tickers, starting at start_day or from the beginning.
+
+    Returns a ticker -> (day numbers, closes) mapping, or None if the download failed.
+    Today's still-forming bar is dropped so that only final closes are ever stored.
+    """
     try:
-        stock = yf.Ticker(ticker)
-        hist = stock.history(period="1d")
-        if not hist.empty:
-            return float(hist['Close'].iloc[-1])
+        downloads = get_market_data_provider().get_history(tickers, start_day)
     except Exception as e:
-        print(f"Error fetching price for {ticker}: {e}")
-    return None
+        print(f"Error fetching history for {len(tickers)} tickers: {e}")
+        return None
+    
+    history = {}
+    today = _today_day_number()
+    for ticker, (days, closes) in downloads.items():
+        days = np.asarray(days, dtype=np.int64)
+        closes = np.asarray(closes, dtype=np.float64)
+        mask = (days < today) & ~np.isnan(closes)
+        if mask.any():
+            history[ticker] = (days[mask], closes[mask])
+    return history
+
+def _today_day_number():
+    """Return today's date as days since 1970-01-01."""
+    return int(np.datetime64(datetime.now().date(), 'D').astype(np.int64))
+
+def refresh_price_history(tickers, force=False):
+    """Bring the stored history of tickers up to date, fetching only missing bars.
+
+    Tickers refreshed within PRICE_HISTORY_REFRESH_INTERVAL are skipped unless force is set.
+    A failed download, or a new ticker that came back without data, is retried after
+    PRICE_HISTORY_RETRY_INTERVAL instead.
+    """
+    now = time.monotonic()
+    due = [
+        ticker for ticker in dict.fromkeys(tickers)
+        if force or now >= _history_next_refresh.get(ticker, float('-inf'))
+    ]
+    if not due:
+        return
+
+    today = _today_day_number()
+    missing = []
+    start_day = None
+    for ticker in due:
+        dates, _ = load_price_history(ticker)
+        if not len(dates):
+            missing.append(ticker)
+        elif dates[-1] < today - 1:
+            last_day = int(dates[-1])
+            start_day = last_day if start_day is None else min(start_day, last_day)
+
+    downloads = {}
+    failed = set()
+    if missing:
+        fetched = _download_price_history(missing)
+        if fetched is None:
+            failed.update(missing)
+        else:
+            downloads.update(fetched)
+            failed.update(ticker for ticker in missing if ticker not in fetched)
+    if start_day is not None:
+        stale = [ticker for ticker in due if ticker not in missing]
+        fetched = _download_price_history(stale, start_day + 1)
+        if fetched is None:
+            failed.update(stale)
+        else:
+            downloads.update(fetched)
+
+    for ticker, (dates, closes) in downloads.items():
+        with _history_lock(ticker):
+            _append_price_history(ticker, dates, closes)
+    for ticker in due:
+        interval = PRICE_HISTORY_RETRY_INTERVAL if ticker in failed else PRICE_HISTORY_REFRESH_INTERVAL
+        _history_next_refresh[ticker] = now + interval
+
+def _range_start_index(dates, period):
+    """Return the index of the first stored date that falls inside a history range."""
+    days = HISTORY_RANGES[period]
+    if period == "ytd":
+        start_day = int(np.datetime64(f"{datetime.now().year}-01-01", 'D').astype(np.int64))
+    elif days is not None:
+        start_day = int(dates[-1]) - days
+    else:
+        return 0
+    return int(np.searchsorted(dates, start_day))
+
+def get_price_history(ticker, period="1mo"):
+    """Return stored (day numbers, closes) for a ticker over a range such as 1mo, 1y or max."""
+    refresh_price_history([ticker])
+    dates, closes = load_price_history(ticker)
+    if not len(dates):
+        return dates, closes
+    
+    start = _range_start_index(dates, period)
+    return np.array(dates[start:]), np.array(closes[start:])
+
+def serialize_price_history(dates, closes):
+    """Convert stored history arrays into the [{date, price}] JSON shape used by the charts."""
+    date_strings = dates.astype('datetime64[D]').astype(str).tolist()
+    return [{'date': date, 'price': price} for date, price in zip(date_strings, closes.tolist())]
+
+# Precomputed portfolio value series, stored next to the price history columns
+PORTFOLIO_VALUE_SERIES = "portfolio_value"
+MAX_CHART_POINTS = int(os.getenv("MAX_CHART_POINTS", 500))
+
+def _portfolio_series_name():
+    """Return the current user's value series name; the default partition keeps the original files."""
+    user_id = current_user_id()
+    return PORTFOLIO_VALUE_SERIES if user_id == DEFAULT_USER_ID else f"{PORTFOLIO_VALUE_SERIES}-{user_id}"
+
+def _portfolio_series_path(suffix):
+    """Return the file path of one part of the current user's stored portfolio value series."""
+    if current_user_id() == DEFAULT_USER_ID:
+        return os.path.join(PRICE_HISTORY_DIR, f"{PORTFOLIO_VALUE_SERIES}.{suffix}")
+    return os.path.join(PRICE_HISTORY_DIR, "portfolios", f"{current_user_id()}.{suffix}")
+
+def _lot_day(date):
+    """Day number of a lot date ("YYYY-MM-DD" or an ISO timestamp); unparseable dates count as always held."""
+    try:
+        return int(np.datetime64(str(date)[:10], 'D').astype(np.int64))
+    except ValueError:
+        return 0
+
+def _position_schedules(holdings):
+    """Map each holding to (purchase day numbers, shares held from each day on).
+
+    Shares still open in each lot count from the lot's purchase date, so a position
+    adds nothing to the days before it was bought. Holdings without lots fall back to
+    their date_added.
+    """
+    lots = {}
+    query = (Lot.select(Lot.ticker, Lot.date, Lot.remaining)
+             .where((Lot.user_id == current_user_id()) & (Lot.remaining > 0))
+             .order_by(Lot.ticker, Lot.date, Lot.id).tuples())
+    for ticker, date, remaining in query:
+        if ticker in holdings:
+            lots.setdefault(ticker, []).append((_lot_day(date), remaining))
+    schedules = {}
+    for ticker, data in holdings.items():
+        purchases = sorted(lots.get(ticker) or [(_lot_day(data.get('date_added') or ''), float(data['shares']))])
+        days = np.array([day for day, _ in purchases], dtype=np.int64)
+        schedules[ticker] = (days, np.cumsum([shares for _, shares in purchases]))
+    return schedules
+
+def _holdings_signature(schedules):
+    """Hash the purchase schedules that the portfolio value series depends on."""
+    positions = sorted((ticker, days.tolist(), shares.tolist()) for ticker, (days, shares) in schedules.items())
+    return hashlib.sha1(json.dumps(positions).encode()).hexdigest()
+
+def load_portfolio_value_series():
+    """Load the stored portfolio value series as (day numbers, values) arrays."""
+    dates = _read_history_column(_portfolio_series_path("dates"), HISTORY_DATE_DTYPE)
+    values = _read_history_column(_portfolio_series_path("value"), HISTORY_CLOSE_DTYPE)
+    count = min(len(dates), len(values))
+    return dates[:count], values[:count]
+
+def _compute_portfolio_values(schedules, after_day=None):
+    """Join purchase schedules against stored closes to value the portfolio on each trading day.
+
+    Only days after after_day are computed, up to the latest stored close of any
+    holding. A holding is carried at its last known close on days it has no close for,
+    and counts only from its purchase dates. Returns (days, values, settled day): values
+    up to the settled day, the last day every holding has a close for, never change.
+    """
+    histories = {ticker: load_price_history(ticker) for ticker in schedules}
+    histories = {ticker: history for ticker, history in histories.items() if len(history[0])}
+    if not histories:
+        return np.empty(0, dtype=HISTORY_DATE_DTYPE), np.empty(0, dtype=HISTORY_CLOSE_DTYPE), None
+    
+    settled_day = min(int(dates[-1]) for dates, _ in histories.values())
+    days = np.unique(np.concatenate([dates for dates, _ in histories.values()]))
+    if after_day is not None:
+        days = days[days > after_day]
+    
+    values = np.zeros(len(days), dtype=np.float64)
+    for ticker, (dates, closes) in histories.items():
+        purchase_days, shares = schedules[ticker]
+        held = np.searchsorted(purchase_days, days, side='right') - 1
+        positions = np.searchsorted(dates, days, side='right') - 1
+        priced = (held >= 0) & (positions >= 0)
+        values += np.where(priced, shares[np.maximum(held, 0)] * closes[np.maximum(positions, 0)], 0.0)
+    return days, values, settled_day
+
+def _write_portfolio_series(days, values):
+    """Replace the stored series files; readers holding the old maps keep seeing the old ones."""
+    for suffix, array, dtype in (("value", values, HISTORY_CLOSE_DTYPE), ("dates", days, HISTORY_DATE_DTYPE)):
+        path = _portfolio_series_path(suffix)
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(np.asarray(array).astype(dtype).tobytes())
+        os.replace(f"{path}.tmp", path)
+
+def update_portfolio_value_series(holdings):
+    """Bring the stored portfolio value series up to the latest stored close.
+
+    Days up to the settled day are kept and only later days are recomputed; the series is
+    rebuilt from scratch when the open lots change.
+    """
+    refresh_price_history(holdings.keys())
+    schedules = _position_schedules(holdings)
+    signature = _holdings_signature(schedules)
+    meta_path = _portfolio_series_path("json")
+    
+    with _history_lock(_portfolio_series_name()):
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        stored_dates, stored_values = load_portfolio_value_series()
+        if meta.get("signature") == signature and len(stored_dates):
+            # Series written before settled days were tracked only ever held settled days
+            after_day = meta.get("settled_day", int(stored_dates[-1]))
+            keep = int(np.searchsorted(stored_dates, after_day, side='right'))
+        else:
+            after_day = None
+            keep = 0
+        
+        days, values, settled_day = _compute_portfolio_values(schedules, after_day)
+        unchanged = (meta.get("signature") == signature and np.array_equal(stored_dates[keep:], days)
+                     and np.array_equal(stored_values[keep:], values))
+        if not unchanged:
+            _write_portfolio_series(np.concatenate([stored_dates[:keep], days]),
+                                    np.concatenate([stored_values[:keep], values]))
+        if settled_day is None:
+            settled_day = after_day
+        if meta != {"signature": signature, "settled_day": settled_day}:
+            with open(meta_path, 'w') as f:
+                json.dump({"signature": signature, "settled_day": settled_day}, f)
+
+def downsample_series(dates, values, max_points=MAX_CHART_POINTS):
+    """Thin a series to at most max_points evenly spaced points, keeping both endpoints."""
+    if len(dates) <= max_points:
+        return dates, values
+    keep = np.unique(np.linspace(0, len(dates) - 1, max_points).round().astype(np.int64))
+    return dates[keep], values[keep]
+
+def get_portfolio_value_series(holdings, period="1y", max_points=MAX_CHART_POINTS):
+    """Return the portfolio's daily value over a range, downsampled for charting."""
+    update_portfolio_value_series(holdings)
+    dates, values = load_portfolio_value_series()
+    if not len(dates):
+        return dates, values
+    
+    start = _range_start_index(dates, period)
+    return downsample_series(np.array(dates[start:]), np.array(values[start:]), max_points)
 
 def generate_sample_notifications():
     """Generate sample notifications for demonstration purposes."""
@@ -148,99 +2027,567 @@ def generate_sample_notifications():
     ]
     return sample_notifications
 
-def check_price_alerts():
-    """Check for price alerts based on user preferences (placeholder function)."""
-    preferences = load_notification_preferences()
-    portfolio_data = load_portfolio_data()
-    notifications = load_notifications_data()
-    
-    # This is a placeholder - in a real implementation, you'd compare current prices
-    # with previous prices and check against thresholds
-    print("Checking price alerts... (placeholder function)")
-    
-    # For demo purposes, we'll just return the existing notifications
-    return notifications
+_notifications_pruned_at = {}  # user id -> monotonic time of the last prune
 
 def add_notification(notification_data):
-    """Add a new notification to the system."""
-    notifications = load_notifications_data()
-    notification_data["id"] = f"notif_{len(notifications) + 1}"
+    """Add a new notification for the current user."""
     notification_data["timestamp"] = datetime.now().isoformat()
     notification_data["read"] = False
-    notifications.insert(0, notification_data)  # Add to beginning
-    
-    # Keep only last 50 notifications
-    if len(notifications) > 50:
-        notifications = notifications[:50]
+    with db.atomic():
+        row = Notification.create(**_notification_row(notification_data))
+        _add_to_counter(_partition_key("total_notifications"), 1)
+        _add_to_counter(_partition_key("unread_notifications"), 1)
+        bump_data_version("notifications")
+    notification_data["id"] = f"notif_{row.id}"
     
-    save_notifications_data(notifications)
+    # Apply the retention window at most once an hour per user and worker
+    user_id = current_user_id()
+    if time.monotonic() - _notifications_pruned_at.get(user_id, 0.0) > 3600:
+        _notifications_pruned_at[user_id] = time.monotonic()
+        prune_notifications()
     return notification_data
 
+# Risk analytics: every statistic is computed at once over an aligned (days x holdings) returns
+# matrix built from the local price history store
+RISK_BENCHMARK = os.getenv("RISK_BENCHMARK", "SPY")
+RISK_FREE_RATE = float(os.getenv("RISK_FREE_RATE", 0.04))  # annual
+RISK_DEFAULT_RANGE = os.getenv("RISK_DEFAULT_RANGE", "1y")
+RISK_MIN_OBSERVATIONS = 20  # daily returns needed before a holding's statistics are reported
+TRADING_DAYS_PER_YEAR = 252
+RISK_CACHE_MAX_ENTRIES = int(os.getenv("RISK_CACHE_MAX_ENTRIES", 4))  # aligned returns matrices kept per worker
+# (tickers, period, today, history versions) -> (days, returns, last closes), kept in LRU order
+_returns_matrix_cache = OrderedDict()
+_returns_matrix_cache_lock = threading.Lock()
+
+def _history_version(ticker):
+    """Identify the stored state of a ticker's history without opening it.
+
+    The columns are append-only, so their sizes change on every append by any worker.
+    """
+    version = []
+    for column in ("dates", "close"):
+        try:
+            stat = os.stat(_history_path(ticker, column))
+            version += [stat.st_size, stat.st_mtime_ns]
+        except FileNotFoundError:
+            version += [0, 0]
+    return tuple(version)
+
+def build_returns_matrix(tickers, period=RISK_DEFAULT_RANGE):
+    """Cached _build_returns_matrix(), reused until an append changes one of the histories.
+
+    The cached arrays are read-only; copy them before modifying.
+    """
+    tickers = tuple(tickers)
+    key = (tickers, period, _today_day_number(), tuple(_history_version(ticker) for ticker in tickers))
+    with _returns_matrix_cache_lock:
+        cached = _returns_matrix_cache.get(key)
+        if cached is not None:
+            _returns_matrix_cache.move_to_end(key)
+    count("stockly_cache_requests_total", cache="returns_matrix", result="hit" if cached is not None else "miss")
+    if cached is not None:
+        return cached
+    
+    matrix = _build_returns_matrix(tickers, period)
+    for array in matrix:
+        array.flags.writeable = False
+    if RISK_CACHE_MAX_ENTRIES > 0:
+        with _returns_matrix_cache_lock:
+            _returns_matrix_cache[key] = matrix
+            while len(_returns_matrix_cache) > RISK_CACHE_MAX_ENTRIES:
+                _returns_matrix_cache.popitem(last=False)
+    return matrix
+
+def _build_returns_matrix(tickers, period):
+    """Align stored closes on one trading calendar.
+
+    Returns (day numbers, daily returns, last closes). Returns has one column per ticker
+    and one row per day after the first. A return is NaN where either of its two closes
+    is missing, so holdings with shorter histories or different trading calendars never
+    get invented values. Last closes holds each ticker's latest stored close (NaN if none).
+    """
+    series = [load_price_history(ticker) for ticker in tickers]
+    last_closes = np.array([closes[-1] if len(closes) else np.nan for _, closes in series], dtype=np.float64)
+    stored = [dates for dates, _ in series if len(dates)]
+    if not stored:
+        return np.array([], dtype=np.int64), np.empty((0, len(tickers))), last_closes
+    
+    calendar = np.unique(np.concatenate(stored))
+    calendar = calendar[_range_start_index(calendar, period):]
+    prices = np.full((len(calendar), len(tickers)), np.nan)
+    for column, (dates, closes) in enumerate(series):
+        start = int(np.searchsorted(dates, calendar[0]))
+        rows = np.searchsorted(calendar, dates[start:])
+        prices[rows, column] = closes[start:]
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = prices[1:] / prices[:-1] - 1.0
+    returns[~np.isfinite(returns)] = np.nan
+    return calendar[1:], returns, last_closes
+
+def _masked_moments(returns):
+    """Per-column observation counts, means and sample variances of a returns matrix with NaNs."""
+    valid = ~np.isnan(returns)
+    values = np.where(valid, returns, 0.0)
+    observations = valid.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = values.sum(axis=0) / observations
+        variance = (np.where(valid, returns - mean, 0.0) ** 2).sum(axis=0) / (observations - 1)
+    return observations, mean, variance
+
+def correlation_matrix(returns):
+    """Pairwise-complete correlation matrix of the return columns, as matrix products.
+
+    Each pair uses only the days on which both holdings have a return.
+    """
+    if len(returns) > 1 and not np.isnan(returns).any():
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.clip(np.atleast_2d(np.corrcoef(returns, rowvar=False)), -1.0, 1.0)
+    valid = (~np.isnan(returns)).astype(np.float64)
+    values = np.where(valid > 0, returns, 0.0)
+    pairs = valid.T @ valid  # days both columns have a return
+    sums = values.T @ valid  # [i, j]: sum of column i over the days shared with j
+    squares = (values * values).T @ valid
+    products = values.T @ values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = products - sums * sums.T / pairs
+        variance_i = squares - sums * sums / pairs
+        correlation = covariance / np.sqrt(variance_i * variance_i.T)
+    correlation[pairs < 2] = np.nan
+    np.fill_diagonal(correlation, np.where(np.diag(pairs) >= 2, 1.0, np.nan))
+    return np.clip(correlation, -1.0, 1.0)
+
+def _betas(returns, benchmark_returns):
+    """Beta of every column against the benchmark, using the days both have a return."""
+    valid = ~np.isnan(returns) & ~np.isnan(benchmark_returns)[:, None]
+    observations = valid.sum(axis=0)
+    x = np.where(valid, returns, 0.0)
+    b = np.where(valid, benchmark_returns[:, None], 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_mean = x.sum(axis=0) / observations
+        b_mean = b.sum(axis=0) / observations
+        covariance = (np.where(valid, x - x_mean, 0.0) * np.where(valid, b - b_mean, 0.0)).sum(axis=0)
+        benchmark_variance = (np.where(valid, b - b_mean, 0.0) ** 2).sum(axis=0)
+        return np.where(observations >= RISK_MIN_OBSERVATIONS, covariance / benchmark_variance, np.nan)
+
+def _max_drawdowns(returns):
+    """Deepest peak-to-trough fall of each column's cumulative return, as a negative fraction."""
+    growth = np.cumprod(1.0 + np.nan_to_num(returns), axis=0)
+    peaks = np.maximum.accumulate(growth, axis=0)
+    return (growth / peaks - 1.0).min(axis=0) if len(growth) else np.full(returns.shape[1], np.nan)
+
+def _annualized_stats(returns):
+    """Annualized return, volatility and Sharpe ratio of every column."""
+    observations, mean, variance = _masked_moments(returns)
+    annual_return = mean * TRADING_DAYS_PER_YEAR
+    volatility = np.sqrt(variance * TRADING_DAYS_PER_YEAR)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = (annual_return - RISK_FREE_RATE) / volatility
+    enough = observations >= RISK_MIN_OBSERVATIONS
+    return (observations, np.where(enough, annual_return, np.nan),
+            np.where(enough, volatility, np.nan), np.where(enough, sharpe, np.nan))
+
+def _finite(value, digits=4):
+    value = float(value)
+    return round(value, digits) if math.isfinite(value) else None
+
+def compute_portfolio_risk(shares_by_ticker, period=RISK_DEFAULT_RANGE, benchmark=RISK_BENCHMARK,
+                           include_correlation=True, refresh=True):
+    """Risk statistics for holdings (ticker -> shares) from stored daily closes.
+
+    Holdings are weighted by their value at the last stored close. Portfolio returns
+    are the weighted returns of the holdings that traded each day. With refresh=False
+    only the closes already stored are used, so no downloads are made.
+    """
+    tickers = list(shares_by_ticker)
+    benchmark = benchmark.upper()
+    if refresh:
+        refresh_price_history(tickers + [benchmark])
+    days, returns, last_closes = build_returns_matrix(tickers + [benchmark], period)
+    benchmark_returns = returns[:, -1]
+    returns = returns[:, :-1]
+    
+    shares = np.fromiter((shares_by_ticker[t] for t in tickers), dtype=np.float64, count=len(tickers))
+    values = np.nan_to_num(shares * last_closes[:-1])
+    weights = values / values.sum() if values.sum() > 0 else np.zeros(len(tickers))
+    
+    valid = ~np.isnan(returns)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        portfolio_returns = (np.where(valid, returns, 0.0) @ weights) / (valid @ weights)
+    portfolio_returns[~np.isfinite(portfolio_returns)] = np.nan
+    
+    combined = np.column_stack([returns, portfolio_returns, benchmark_returns]) if len(days) else np.empty((0, len(tickers) + 2))
+    observations, annual_return, volatility, sharpe = _annualized_stats(combined)
+    betas = _betas(combined, benchmark_returns)
+    drawdowns = _max_drawdowns(combined)
+    
+    enough = observations[:len(tickers)] >= RISK_MIN_OBSERVATIONS
+    holdings = [
+        {
+            "ticker": ticker,
+            "weight": _finite(weights[i]),
+            "observations": int(observations[i]),
+            "annual_return": _finite(annual_return[i]),
+            "volatility": _finite(volatility[i]),
+            "beta": _finite(betas[i]),
+            "sharpe": _finite(sharpe[i]),
+            "max_drawdown": _finite(drawdowns[i]) if enough[i] else None
+        }
+        for i, ticker in enumerate(tickers)
+    ]
+    p, b = len(tickers), len(tickers) + 1
+    result = {
+        "range": period,
+        "start": str(np.datetime64(int(days[0]), 'D')) if len(days) else None,
+        "end": str(np.datetime64(int(days[-1]), 'D')) if len(days) else None,
+        "benchmark": benchmark,
+        "risk_free_rate": RISK_FREE_RATE,
+        "portfolio": {
+            "observations": int(observations[p]),
+            "annual_return": _finite(annual_return[p]),
+            "volatility": _finite(volatility[p]),
+            "beta": _finite(betas[p]),
+            "sharpe": _finite(sharpe[p]),
+            "max_drawdown": _finite(drawdowns[p]) if observations[p] >= RISK_MIN_OBSERVATIONS else None
+        },
+        "benchmark_stats": {
+            "observations": int(observations[b]),
+            "annual_return": _finite(annual_return[b]),
+            "volatility": _finite(volatility[b]),
+            "max_drawdown": _finite(drawdowns[b]) if observations[b] >= RISK_MIN_OBSERVATIONS else None
+        },
+        "holdings": holdings,
+        "insufficient_history": [ticker for ticker, ok in zip(tickers, enough) if not ok]
+    }
+    
+    correlation = correlation_matrix(returns) if len(days) else np.full((len(tickers), len(tickers)), np.nan)
+    off_diagonal = correlation.copy()
+    np.fill_diagonal(off_diagonal, np.nan)
+    diversification = {"average_correlation": None, "most_correlated": None}
+    if np.isfinite(off_diagonal).any():
+        diversification["average_correlation"] = _finite(np.nanmean(off_diagonal))
+        i, j = np.unravel_index(np.nanargmax(off_diagonal), off_diagonal.shape)
+        diversification["most_correlated"] = {"tickers": [tickers[i], tickers[j]], "correlation": _finite(off_diagonal[i, j])}
+    result["diversification"] = diversification
+    if include_correlation:
+        rounded = np.round(correlation, 4)
+        missing = np.isnan(rounded)
+        result["correlation"] = {
+            "tickers": tickers,
+            "matrix": np.where(missing, None, rounded).tolist() if missing.any() else rounded.tolist()
+        }
+    return result
+
+def summarize_risk(risk):
+    """A few lines describing portfolio risk, for the insights prompt.
+
+    Returns None when the portfolio, or more than half of its holdings, lack enough stored history.
+    """
+    portfolio = risk["portfolio"]
+    if portfolio["volatility"] is None or len(risk["insufficient_history"]) * 2 > len(risk["holdings"]):
+        return None
+    
+    def pct(value):
+        return f"{value * 100:.1f}%" if value is not None else "n/a"
+    
+    def ratio(value):
+        return f"{value:.2f}" if value is not None else "n/a"
+    
+    lines = [
+        f"- Period: {risk['start']} to {risk['end']}",
+        f"- Annualized volatility: {pct(portfolio['volatility'])} (benchmark {risk['benchmark']}: {pct(risk['benchmark_stats']['volatility'])})",
+        f"- Beta vs {risk['benchmark']}: {ratio(portfolio['beta'])}",
+        f"- Sharpe ratio: {ratio(portfolio['sharpe'])}",
+        f"- Max drawdown: {pct(portfolio['max_drawdown'])}"
+    ]
+    ranked = sorted((h for h in risk["holdings"] if h["volatility"] is not None), key=lambda h: h["volatility"], reverse=True)
+    if ranked:
+        lines.append("- Most volatile holdings: " + ", ".join(f"{h['ticker']} ({pct(h['volatility'])})" for h in ranked[:3]))
+    diversification = risk["diversification"]
+    if diversification["average_correlation"] is not None:
+        pair = diversification["most_correlated"]
+        lines.append(f"- Average correlation between holdings: {diversification['average_correlation']:.2f}; "
+                     f"most correlated: {pair['tickers'][0]} and {pair['tickers'][1]} ({pair['correlation']:.2f})")
+    return "\n".join(lines)
+
+# Price alert engine: compares one batch of quotes against stored reference prices
+ALERT_CHECK_INTERVAL = int(os.getenv("ALERT_CHECK_INTERVAL", 300))  # seconds, 0 disables the scheduler
+_alert_scheduler_started = False
+_alert_scheduler_lock = threading.Lock()
+
+def evaluate_price_alert_rules(current_prices, reference_prices, thresholds):
+    """Evaluate every threshold rule at once.
+
+    Takes aligned arrays of current prices, reference prices and percentage
+    thresholds (one entry per rule) and returns (triggered mask, percent change).
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_pct = np.where(reference_prices > 0, (current_prices - reference_prices) / reference_prices * 100, 0.0)
+    triggered = (thresholds > 0) & (np.abs(change_pct) >= thresholds)
+    return triggered, change_pct
+
+def _alert_partitions():
+    """Return {user_id: (tickers, threshold)} for every user with holdings or a watchlist, in two queries."""
+    tickers_by_user = {}
+    for user_id, ticker in Holding.select(Holding.user_id, Holding.ticker).order_by(Holding.id).tuples():
+        tickers_by_user.setdefault(user_id, []).append(ticker)
+    
+    settings = {}
+    rows = Preference.select().where(Preference.key.endswith("price_change_threshold") |
+                                     Preference.key.endswith("watchlist_stocks"))
+    for row in rows:
+        user_id, _, name = row.key.rpartition(":")
+        settings.setdefault(user_id or DEFAULT_USER_ID, {})[name] = json.loads(row.value)
+    
+    partitions = {}
+    for user_id in set(tickers_by_user) | set(settings):
+        preferences = {**DEFAULT_NOTIFICATION_PREFERENCES, **settings.get(user_id, {})}
+        threshold = float(preferences.get("price_change_threshold") or 0)
+        tickers = list(dict.fromkeys(tickers_by_user.get(user_id, []) + list(preferences.get("watchlist_stocks") or [])))
+        if tickers and threshold > 0:
+            partitions[user_id] = (tickers, threshold)
+    return partitions
+
+def check_price_alerts(force=False):
+    """Run one price alert cycle for every user's portfolio and watchlist tickers.
+
+    Cycles are claimed through the database so that only one worker runs them
+    per ALERT_CHECK_INTERVAL; force skips that check. Quotes for all users are
+    fetched in one batch. Returns the notifications that were created.
+    """
+    now = int(time.time())
+    with db.atomic('IMMEDIATE'):
+        if not force and now - get_counter("price_alerts_last_run") < ALERT_CHECK_INTERVAL:
+            return []
+        _set_counter("price_alerts_last_run", now)
+    
+    partitions = _alert_partitions()
+    if not partitions:
+        return []
+    prices = get_stock_prices(list(dict.fromkeys(t for tickers, _ in partitions.values() for t in tickers)))
+    
+    created = []
+    for user_id, (tickers, threshold) in partitions.items():
+        with user_partition(user_id):
+            created.extend(_check_partition_alerts(tickers, threshold, prices))
+    return created
+
+def _check_partition_alerts(tickers, threshold, prices):
+    """Evaluate the current user's alert rules against already fetched prices."""
+    tickers = [ticker for ticker in tickers if prices.get(ticker)]
+    if not tickers:
+        return []
+    
+    # Reference prices and sent-alert keys are namespaced by user
+    keys = [_partition_key(ticker) for ticker in tickers]
+    references = {row.ticker: row.price for row in AlertReference.select().where(AlertReference.ticker.in_(keys))}
+    current = np.fromiter((prices[t] for t in tickers), dtype=np.float64, count=len(tickers))
+    reference = np.fromiter((references.get(key, 0.0) for key in keys), dtype=np.float64, count=len(tickers))
+    thresholds = np.full(len(tickers), threshold)
+    triggered, change_pct = evaluate_price_alert_rules(current, reference, thresholds)
+    
+    timestamp = datetime.now().isoformat()
+    alerts = []
+    for index in np.flatnonzero(triggered).tolist():
+        ticker = tickers[index]
+        direction = "up" if change_pct[index] > 0 else "down"
+        dedup_key = _partition_key(f"{ticker}:{direction}:{timestamp[:10]}")
+        alerts.append((dedup_key, ticker, direction, float(change_pct[index]), float(current[index]), index))
+    
+    with db.atomic():
+        sent = {row.dedup_key for row in AlertLog.select().where(AlertLog.dedup_key.in_([a[0] for a in alerts]))} if alerts else set()
+        alerts = [alert for alert in alerts if alert[0] not in sent]
+        if alerts:
+            AlertLog.insert_many([{"dedup_key": alert[0], "created_at": timestamp} for alert in alerts]).execute()
+        
+        # Tickers seen for the first time get a reference price; others move only when the
+        # user is actually notified, so a suppressed move is still measured from the last alert
+        rebase = reference <= 0
+        rebase[[alert[5] for alert in alerts]] = True
+        rebased_rows = [
+            {"ticker": key, "price": price, "updated_at": timestamp}
+            for key, price in zip(np.asarray(keys)[rebase].tolist(), current[rebase].tolist())
+        ]
+        for offset in range(0, len(rebased_rows), 500):
+            AlertReference.insert_many(rebased_rows[offset:offset + 500]).on_conflict(
+                conflict_target=[AlertReference.ticker],
+                preserve=[AlertReference.price, AlertReference.updated_at]
+            ).execute()
+    
+    created = []
+    for _, ticker, direction, pct, price, _ in alerts:
+        created.append(add_notification({
+            "type": "price_change",
+            "ticker": ticker,
+            "title": f"Price Alert: {ticker}",
+            "message": f"{ticker} {'rose' if direction == 'up' else 'dropped'} {abs(pct):.1f}%, now at ${price:,.2f}",
+            "priority": "high" if abs(pct) >= 2 * threshold else "medium"
+        }))
+    return created
+
+def _run_alert_scheduler():
+    """Background loop that runs price alert cycles every ALERT_CHECK_INTERVAL seconds."""
+    while True:
+        try:
+            with db.connection_context():
+                check_price_alerts()
+        except Exception as e:
+            print(f"Error checking price alerts: {e}")
+        time.sleep(ALERT_CHECK_INTERVAL)
+
+@app.before_request
+def start_alert_scheduler():
+    """Start this worker's alert scheduler thread on its first request."""
+    global _alert_scheduler_started
+    if _alert_scheduler_started or ALERT_CHECK_INTERVAL <= 0:
+        return
+    with _alert_scheduler_lock:
+        if not _alert_scheduler_started:
+            threading.Thread(target=_run_alert_scheduler, name="price-alerts", daemon=True).start()
+            _alert_scheduler_started = True
+
+@app.cli.command("check-alerts")
+def check_alerts_command():
+    """Run one price alert cycle now (for cron or a scheduler dyno)."""
+    created = check_price_alerts(force=True)
+    print(f"Created {len(created)} price alert notification(s)")
+
+# Server-Sent Events: one producer thread per worker fans price and badge updates out to every client
+STREAM_INTERVAL = float(os.getenv("STREAM_INTERVAL", 5))  # seconds between producer checks
+STREAM_KEEPALIVE = float(os.getenv("STREAM_KEEPALIVE", 15))  # seconds; also how soon a closed tab frees its thread
+# Each open stream holds a worker thread, so keep this below gunicorn's --threads
+STREAM_MAX_SUBSCRIBERS = int(os.getenv("STREAM_MAX_SUBSCRIBERS", 8))
+STREAM_QUEUE_SIZE = 100
+_stream_subscribers = {}  # subscriber queue -> user id
+_stream_state = {}  # user id -> {"prices": {...}, "unread_count": int | None}
+_stream_lock = threading.Lock()
+_stream_producer_running = False
+
+def _broadcast(event, data, user_id):
+    """Queue an event for every subscriber of one user, dropping clients that have fallen too far behind."""
+    with _stream_lock:
+        for subscriber, subscriber_user in list(_stream_subscribers.items()):
+            if subscriber_user != user_id:
+                continue
+            try:
+                subscriber.put_nowait((event, data))
+            except queue.Full:
+                _stream_subscribers.pop(subscriber, None)
+                # Make room for the sentinel that tells the slow client's generator to stop
+                subscriber.get_nowait()
+                subscriber.put_nowait((None, None))
+
+def _stream_producer():
+    """Poll each subscribed user's holdings and badge count against the shared quote cache, broadcasting only what changed."""
+    global _stream_producer_running
+    while True:
+        with _stream_lock:
+            if not _stream_subscribers:
+                _stream_producer_running = False
+                return
+            users = set(_stream_subscribers.values())
+            for user_id in set(_stream_state) - users:
+                del _stream_state[user_id]
+        try:
+            partitions = {}
+            with db.connection_context():
+                for user_id in users:
+                    with user_partition(user_id):
+                        partitions[user_id] = (list(load_portfolio_data().keys()), get_unread_notification_count())
+            prices = get_stock_prices(list(dict.fromkeys(t for tickers, _ in partitions.values() for t in tickers)))
+            
+            for user_id, (tickers, unread_count) in partitions.items():
+                with _stream_lock:
+                    state = _stream_state.setdefault(user_id, {"prices": {}, "unread_count": None})
+                    known_prices = state["prices"]
+                    changed = {ticker: prices[ticker] for ticker in tickers
+                               if ticker in prices and known_prices.get(ticker) != prices[ticker]}
+                    known_prices.update(changed)
+                    unread_changed = unread_count != state["unread_count"]
+                    state["unread_count"] = unread_count
+                
+                if changed:
+                    _broadcast("prices", changed, user_id)
+                if unread_changed:
+                    _broadcast("notifications", {"unread_count": unread_count}, user_id)
+        except Exception as e:
+            print(f"Error in stream producer: {e}")
+        time.sleep(STREAM_INTERVAL)
+
+def _subscribe():
+    """Register a client queue for the current user, seeded with the latest known state, and make sure the producer runs.
+
+    Returns None when this worker already serves STREAM_MAX_SUBSCRIBERS streams.
+    """
+    global _stream_producer_running
+    user_id = current_user_id()
+    subscriber = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    with _stream_lock:
+        if len(_stream_subscribers) >= STREAM_MAX_SUBSCRIBERS:
+            return None
+        state = _stream_state.get(user_id)
+        if state and state["prices"]:
+            subscriber.put_nowait(("prices", dict(state["prices"])))
+        if state and state["unread_count"] is not None:
+            subscriber.put_nowait(("notifications", {"unread_count": state["unread_count"]}))
+        _stream_subscribers[subscriber] = user_id
+        if not _stream_producer_running:
+            _stream_producer_running = True
+            threading.Thread(target=_stream_producer, name="stream-producer", daemon=True).start()
+    return subscriber
+
+def _unsubscribe(subscriber):
+    with _stream_lock:
+        _stream_subscribers.pop(subscriber, None)
+
 def get_portfolio_performance_data():
     """Get current portfolio performance data for AI analysis."""
     portfolio_data = load_portfolio_data()
     if not portfolio_data:
         return None
+    return build_performance_data(portfolio_data)
+
+def build_performance_data(portfolio_data, prices=None):
+    """Build performance data for a portfolio dict, optionally against given prices."""
+    valuation = value_portfolio(portfolio_data, prices)
     
-    performance_data = {
+    return {
         "timestamp": datetime.now().isoformat(),
-        "stocks": [],
-        "total_value": 0,
-        "total_cost": 0,
-        "total_gain_loss": 0,
-        "total_gain_loss_pct": 0
+        "stocks": list(iter_valuation_rows(valuation)),
+        "total_value": valuation["total_value"],
+        "total_cost": valuation["total_cost"],
+        "total_gain_loss": valuation["total_gain_loss"],
+        "total_gain_loss_pct": valuation["total_gain_loss_pct"],
+        "stale_tickers": valuation["stale_tickers"]
     }
-    
-    total_value = 0
-    total_cost = 0
-    
-    for ticker, data in portfolio_data.items():
-        current_price = get_stock_price(ticker)
-        if current_price:
-            shares = data['shares']
-            cost_per_share = data['purchase_price']
-            
-            current_value = shares * current_price
-            cost_basis = shares * cost_per_share
-            gain_loss = current_value - cost_basis
-            gain_loss_pct = ((current_value - cost_basis) / cost_basis * 100) if cost_basis > 0 else 0
-            
-            total_value += current_value
-            total_cost += cost_basis
-            
-            performance_data["stocks"].append({
-                "ticker": ticker,
-                "shares": shares,
-                "current_price": current_price,
-                "purchase_price": cost_per_share,
-                "current_value": current_value,
-                "cost_basis": cost_basis,
-                "gain_loss": gain_loss,
-                "gain_loss_pct": gain_loss_pct
-            })
-    
-    performance_data["total_value"] = total_value
-    performance_data["total_cost"] = total_cost
-    performance_data["total_gain_loss"] = total_value - total_cost
-    performance_data["total_gain_loss_pct"] = ((total_value - total_cost) / total_cost * 100) if total_cost > 0 else 0
-    
-    return performance_data
 
-def generate_performance_insights(performance_data):
-    """Generate AI-powered performance insights using OpenAI."""
+INSIGHTS_SYSTEM_PROMPT = "You are a friendly financial advisor who explains complex investment concepts in simple, beginner-friendly terms. Always be encouraging and educational."
+
+def build_insights_prompt(performance_data):
+    """Build the user prompt for AI performance insights."""
+    # Prepare the data for AI analysis
+    stocks_summary = []
+    for stock in performance_data["stocks"]:
+        stocks_summary.append({
+            "ticker": stock["ticker"],
+            "current_price": f"${stock['current_price']:.2f}",
+            "purchase_price": f"${stock['purchase_price']:.2f}",
+            "gain_loss_pct": f"{stock['gain_loss_pct']:.1f}%",
+            "gain_loss": f"${stock['gain_loss']:.2f}"
+        })
+    
+    risk_section = ""
     try:
-        # Prepare the data for AI analysis
-        stocks_summary = []
-        for stock in performance_data["stocks"]:
-            stocks_summary.append({
-                "ticker": stock["ticker"],
-                "current_price": f"${stock['current_price']:.2f}",
-                "purchase_price": f"${stock['purchase_price']:.2f}",
-                "gain_loss_pct": f"{stock['gain_loss_pct']:.1f}%",
-                "gain_loss": f"${stock['gain_loss']:.2f}"
-            })
-        
-        prompt = f"""
+        # Stored closes only: the prompt must not wait on history downloads
+        risk = compute_portfolio_risk({stock["ticker"]: stock["shares"] for stock in performance_data["stocks"]},
+                                      include_correlation=False, refresh=False)
+        risk_summary = summarize_risk(risk)
+        if risk_summary:
+            risk_section = f"\nRISK PROFILE (from daily closes):\n{risk_summary}\n"
+    except Exception as e:
+        print(f"Error computing risk summary: {e}")
+    
+    return f"""
 You are a financial advisor providing simple, beginner-friendly explanations of portfolio performance. 
 
 PORTFOLIO PERFORMANCE DATA:
@@ -251,11 +2598,11 @@ PORTFOLIO PERFORMANCE DATA:
 
 INDIVIDUAL STOCKS:
 {json.dumps(stocks_summary, indent=2)}
-
+{risk_section}
 INSTRUCTIONS:
 1. Explain in simple, beginner-friendly terms why this portfolio has changed in value
 2. Focus on the main drivers of performance (which stocks helped/hurt most)
-3. Provide context about market conditions if relevant
+3. Provide context about market conditions if relevant, and what the risk profile (if given) means for the investor
 4. Keep explanations under 200 words
 5. Use encouraging, educational tone
 6. Avoid financial jargon - explain terms when needed
@@ -267,26 +2614,129 @@ Provide a clear explanation in 2-3 paragraphs covering:
 - Key stock movements and their impact
 - Simple takeaway or lesson for the investor
         """
-        
-        # Call the OpenAI API
-        response = client.chat.completions.create(
+
+# Insights memoized by valuation snapshot
+INSIGHTS_CACHE_TTL = float(os.getenv("INSIGHTS_CACHE_TTL", 6 * 3600))  # seconds
+INSIGHTS_PRICE_TOLERANCE = float(os.getenv("INSIGHTS_PRICE_TOLERANCE", 0.005))  # 0.5% price moves reuse insights
+
+def insights_snapshot_hash(performance_data):
+    """Hash the holdings and prices behind performance data.
+
+    Prices are bucketed on a log scale so moves smaller than INSIGHTS_PRICE_TOLERANCE
+    usually land in the same bucket and reuse the stored insights.
+    """
+    step = math.log1p(INSIGHTS_PRICE_TOLERANCE)
+    snapshot = sorted(
+        (stock["ticker"], stock["shares"], stock["purchase_price"],
+         round(math.log(stock["current_price"]) / step) if stock["current_price"] > 0 else 0)
+        for stock in performance_data["stocks"]
+    )
+    return hashlib.sha1(json.dumps(snapshot).encode()).hexdigest()
+
+def load_cached_insights(snapshot_hash):
+    """Return stored insights for a snapshot if they are still fresh, else None."""
+    try:
+        row = InsightCache.get_or_none(InsightCache.snapshot_hash == snapshot_hash)
+        if row is not None and time.time() - row.created_at <= INSIGHTS_CACHE_TTL:
+            count("stockly_cache_requests_total", cache="insights", result="hit")
+            return row.insights
+    except Exception as e:
+        print(f"Error reading insights cache: {e}")
+    count("stockly_cache_requests_total", cache="insights", result="miss")
+    return None
+
+def store_cached_insights(snapshot_hash, insights):
+    """Store insights for a snapshot and drop expired entries."""
+    now = time.time()
+    try:
+        with db.atomic():
+            InsightCache.insert(snapshot_hash=snapshot_hash, insights=insights, created_at=now).on_conflict_replace().execute()
+            InsightCache.delete().where(InsightCache.created_at < now - INSIGHTS_CACHE_TTL).execute()
+    except Exception as e:
+        print(f"Error writing insights cache: {e}")
+
+def request_performance_insights(performance_data):
+    """Request AI-powered performance insights from OpenAI. Raises on API errors."""
+    # Call the OpenAI API
+    with timed(call="openai_chat"):
+        response = get_openai_client().chat.completions.create(
             model="gpt-4",
             messages=[
-                {"role": "system", "content": "You are a friendly financial advisor who explains complex investment concepts in simple, beginner-friendly terms. Always be encouraging and educational."},
-                {"role": "user", "content": prompt}
+                {"role": "system", "content": INSIGHTS_SYSTEM_PROMPT},
+                {"role": "user", "content": build_insights_prompt(performance_data)}
             ],
             temperature=0.7,
             max_tokens=500
         )
-        
-        return response.choices[0].message.content.strip()
-        
+    
+    return response.choices[0].message.content.strip()
+
+def generate_performance_insights(performance_data):
+    """Generate AI-powered performance insights, reusing stored text for an unchanged snapshot."""
+    snapshot_hash = insights_snapshot_hash(performance_data)
+    insights = load_cached_insights(snapshot_hash)
+    if insights is not None:
+        return insights
+    
+    try:
+        insights = request_performance_insights(performance_data)
     except Exception as e:
         print(f"Error generating AI insights: {e}")
         return get_fallback_insights(performance_data)
+    
+    store_cached_insights(snapshot_hash, insights)
+    return insights
+
+def stream_performance_insights(performance_data):
+    """Yield AI performance insights piece by piece as the model produces them.
+
+    Stored insights for the same snapshot are sent at once. Falls back to the
+    static insights if the API fails before sending any text.
+    """
+    snapshot_hash = insights_snapshot_hash(performance_data)
+    insights = load_cached_insights(snapshot_hash)
+    if insights is not None:
+        yield insights
+        return
+    
+    pieces = []
+    try:
+        # Measures the time until the stream opens; the tokens arrive as the client reads them
+        with timed(call="openai_chat_stream"):
+            stream = get_openai_client().chat.completions.create(
+                model="gpt-4",
+                messages=[
+                    {"role": "system", "content": INSIGHTS_SYSTEM_PROMPT},
+                    {"role": "user", "content": build_insights_prompt(performance_data)}
+                ],
+                temperature=0.7,
+                max_tokens=500,
+                stream=True
+            )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                # Drop the model's leading whitespace, as request_performance_insights() strips it
+                if not pieces:
+                    text = text.lstrip()
+                    if not text:
+                        continue
+                pieces.append(text)
+                yield text
+    except Exception as e:
+        print(f"Error streaming AI insights: {e}")
+        if not pieces:
+            yield get_fallback_insights(performance_data)
+        return
+    
+    if pieces:
+        store_cached_insights(snapshot_hash, "".join(pieces).strip())
 
 def get_fallback_insights(performance_data):
     """Fallback insights when OpenAI API is unavailable."""
+    count("stockly_fallbacks_total", kind="insights")
     total_gain_loss_pct = performance_data['total_gain_loss_pct']
     
     if total_gain_loss_pct > 2:
@@ -313,52 +2763,185 @@ Remember, short-term fluctuations are normal in investing. Focus on your long-te
     
     return insights
 
-def generate_pdf_report(portfolio_data, performance_data, recommendations=None):
-    """Generate a PDF report of the portfolio."""
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
+# PDF report engine: styles are built once per process and reused by every report
+PDF_TABLE_CHUNK_ROWS = int(os.getenv("PDF_TABLE_CHUNK_ROWS", 40))  # holdings rows per table chunk
+PDF_INCLUDE_CHARTS = os.getenv("PDF_INCLUDE_CHARTS", "1") == "1"
+PDF_CHART_MAX_SLICES = 8  # largest holdings shown individually in the allocation chart
+PDF_CHART_COLORS = ['#4f8cff', '#28a745', '#ffc107', '#dc3545', '#6f42c1', '#17a2b8', '#fd7e14', '#20c997', '#adb5bd']
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", os.cpu_count() or 1))
+_pdf_styles = None
+
+def get_pdf_styles():
+    """Return the shared paragraph and table styles, building them on first use."""
+    global _pdf_styles
+    if _pdf_styles is not None:
+        return _pdf_styles
+    
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import TableStyle
     
-    # Get styles
     styles = getSampleStyleSheet()
+    header_rows = [
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4f8cff')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]
+    _pdf_styles = {
+        "title": ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=24,
+            spaceAfter=30,
+            alignment=TA_CENTER,
+            textColor=colors.HexColor('#4f8cff')
+        ),
+        "heading": ParagraphStyle(
+            'CustomHeading',
+            parent=styles['Heading2'],
+            fontSize=16,
+            spaceAfter=12,
+            textColor=colors.HexColor('#4f8cff')
+        ),
+        "normal": ParagraphStyle(
+            'CustomNormal',
+            parent=styles['Normal'],
+            fontSize=12,
+            spaceAfter=6
+        ),
+        "disclaimer": ParagraphStyle(
+            'Disclaimer',
+            parent=styles['Normal'],
+            fontSize=10,
+            textColor=colors.grey,
+            alignment=TA_CENTER
+        ),
+        "summary_table": TableStyle(header_rows + [
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTSIZE', (0, 0), (-1, 0), 12)
+        ]),
+        "holdings_table": TableStyle(header_rows + [
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
+            ('FONTSIZE', (0, 1), (-1, -1), 9)
+        ])
+    }
+    return _pdf_styles
+
+HOLDINGS_TABLE_HEADER = ['Ticker', 'Shares', 'Current Price', 'Purchase Price', 'Current Value', 'Gain/Loss', 'Return %']
+HOLDINGS_TABLE_WIDTHS = [0.8, 0.6, 1, 1, 1, 1, 0.8]  # inches
+
+def _holdings_tables(stocks, table_style):
+    """Yield the holdings as a series of small tables, each repeating the header row.
+
+    Many small tables lay out and split across pages far faster than one huge table.
+    """
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Table
     
-    # Create custom styles
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        spaceAfter=30,
-        alignment=TA_CENTER,
-        textColor=colors.HexColor('#4f8cff')
-    )
+    for start in range(0, len(stocks), PDF_TABLE_CHUNK_ROWS):
+        rows = [HOLDINGS_TABLE_HEADER]
+        for stock in stocks[start:start + PDF_TABLE_CHUNK_ROWS]:
+            rows.append([
+                stock['ticker'],
+                str(stock['shares']),
+                f"${stock['current_price']:.2f}",
+                f"${stock['purchase_price']:.2f}",
+                f"${stock['current_value']:.2f}",
+                f"${stock['gain_loss']:.2f}",
+                f"{stock['gain_loss_pct']:.2f}%"
+            ])
+        table = Table(rows, colWidths=[width * inch for width in HOLDINGS_TABLE_WIDTHS], repeatRows=1)
+        table.setStyle(table_style)
+        yield table
+
+def _allocation_chart(stocks):
+    """Draw a pie chart of the largest holdings by current value, grouping the rest as Other."""
+    from reportlab.graphics.charts.piecharts import Pie
+    from reportlab.graphics.shapes import Drawing
+    from reportlab.lib import colors
+    from reportlab.lib.units import inch
     
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=16,
-        spaceAfter=12,
-        textColor=colors.HexColor('#4f8cff')
-    )
+    ranked = sorted(stocks, key=lambda stock: stock['current_value'], reverse=True)
+    slices = ranked[:PDF_CHART_MAX_SLICES]
+    values = [stock['current_value'] for stock in slices]
+    labels = [stock['ticker'] for stock in slices]
+    other = sum(stock['current_value'] for stock in ranked[PDF_CHART_MAX_SLICES:])
+    if other > 0:
+        values.append(other)
+        labels.append('Other')
+    if sum(values) <= 0:
+        return None
+    
+    drawing = Drawing(6*inch, 2.6*inch)
+    pie = Pie()
+    pie.x, pie.y = 0.5*inch, 0.2*inch
+    pie.width = pie.height = 2.2*inch
+    pie.data = values
+    pie.labels = labels
+    pie.sideLabels = True
+    pie.slices.strokeColor = colors.white
+    for i in range(len(values)):
+        pie.slices[i].fillColor = colors.HexColor(PDF_CHART_COLORS[i % len(PDF_CHART_COLORS)])
+    drawing.add(pie)
+    return drawing
+
+def _returns_chart(stocks):
+    """Draw a bar chart of the return % of the largest holdings."""
+    from reportlab.graphics.charts.barcharts import VerticalBarChart
+    from reportlab.graphics.shapes import Drawing
+    from reportlab.lib import colors
+    from reportlab.lib.units import inch
+    
+    ranked = sorted(stocks, key=lambda stock: stock['current_value'], reverse=True)[:PDF_CHART_MAX_SLICES]
+    if not ranked:
+        return None
+    
+    drawing = Drawing(6*inch, 2.4*inch)
+    chart = VerticalBarChart()
+    chart.x, chart.y = 0.5*inch, 0.4*inch
+    chart.width, chart.height = 5*inch, 1.8*inch
+    chart.data = [[stock['gain_loss_pct'] for stock in ranked]]
+    chart.categoryAxis.categoryNames = [stock['ticker'] for stock in ranked]
+    chart.valueAxis.labelTextFormat = '%d%%'
+    chart.bars[0].fillColor = colors.HexColor('#4f8cff')
+    drawing.add(chart)
+    return drawing
+
+@timed_call("pdf_render")
+def generate_pdf_report(portfolio_data, performance_data, recommendations=None, output=None, include_charts=None):
+    """Generate a PDF report of the portfolio.
+
+    Writes to `output` (a path or file object) when given and returns it; otherwise
+    returns a BytesIO positioned at the start.
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
     
-    normal_style = ParagraphStyle(
-        'CustomNormal',
-        parent=styles['Normal'],
-        fontSize=12,
-        spaceAfter=6
-    )
+    buffer = output if output is not None else io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
+    styles = get_pdf_styles()
+    if include_charts is None:
+        include_charts = PDF_INCLUDE_CHARTS
     
     # Build the story
     story = []
     
     # Title
-    story.append(Paragraph("Stockly Portfolio Report", title_style))
+    story.append(Paragraph("Stockly Portfolio Report", styles["title"]))
     story.append(Spacer(1, 12))
     
     # Date
-    story.append(Paragraph(f"Generated on: {datetime.now().strftime('%B %d, %Y at %I:%M %p')}", normal_style))
+    story.append(Paragraph(f"Generated on: {datetime.now().strftime('%B %d, %Y at %I:%M %p')}", styles["normal"]))
     story.append(Spacer(1, 20))
     
     # Portfolio Summary
-    story.append(Paragraph("Portfolio Summary", heading_style))
+    story.append(Paragraph("Portfolio Summary", styles["heading"]))
     
     if performance_data:
         summary_data = [
@@ -370,94 +2953,156 @@ def generate_pdf_report(portfolio_data, performance_data, recommendations=None):
         ]
         
         summary_table = Table(summary_data, colWidths=[3*inch, 2*inch])
-        summary_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4f8cff')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
+        summary_table.setStyle(styles["summary_table"])
         
         story.append(summary_table)
         story.append(Spacer(1, 20))
     
+    # Charts
+    if include_charts and performance_data and performance_data['stocks']:
+        for title, chart in (("Allocation", _allocation_chart(performance_data['stocks'])),
+                             ("Return by Holding", _returns_chart(performance_data['stocks']))):
+            if chart is not None:
+                story.append(Paragraph(title, styles["heading"]))
+                story.append(chart)
+                story.append(Spacer(1, 20))
+    
     # Individual Holdings
-    story.append(Paragraph("Individual Holdings", heading_style))
+    story.append(Paragraph("Individual Holdings", styles["heading"]))
     
     if performance_data and performance_data['stocks']:
-        holdings_data = [['Ticker', 'Shares', 'Current Price', 'Purchase Price', 'Current Value', 'Gain/Loss', 'Return %']]
-        
-        for stock in performance_data['stocks']:
-            holdings_data.append([
-                stock['ticker'],
-                str(stock['shares']),
-                f"${stock['current_price']:.2f}",
-                f"${stock['purchase_price']:.2f}",
-                f"${stock['current_value']:.2f}",
-                f"${stock['gain_loss']:.2f}",
-                f"{stock['gain_loss_pct']:.2f}%"
-            ])
-        
-        holdings_table = Table(holdings_data, colWidths=[0.8*inch, 0.6*inch, 1*inch, 1*inch, 1*inch, 1*inch, 0.8*inch])
-        holdings_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4f8cff')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('FONTSIZE', (0, 1), (-1, -1), 9)
-        ]))
-        
-        story.append(holdings_table)
+        story.extend(_holdings_tables(performance_data['stocks'], styles["holdings_table"]))
         story.append(Spacer(1, 20))
     
     # Recommendations Section (if available)
     if recommendations:
-        story.append(Paragraph("Investment Recommendations", heading_style))
+        story.append(Paragraph("Investment Recommendations", styles["heading"]))
         
         for i, rec in enumerate(recommendations[:3], 1):  # Show top 3 recommendations
-            story.append(Paragraph(f"{i}. {rec['ticker']} - {rec['name']}", normal_style))
-            story.append(Paragraph(f"   Allocation: {rec['allocation']}", normal_style))
-            story.append(Paragraph(f"   Reason: {rec['why'][:100]}...", normal_style))
+            story.append(Paragraph(f"{i}. {rec['ticker']} - {rec['name']}", styles["normal"]))
+            story.append(Paragraph(f"   Allocation: {rec['allocation']}", styles["normal"]))
+            story.append(Paragraph(f"   Reason: {rec['why'][:100]}...", styles["normal"]))
             story.append(Spacer(1, 8))
     
     # Disclaimer
     story.append(Spacer(1, 20))
-    disclaimer_style = ParagraphStyle(
-        'Disclaimer',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=colors.grey,
-        alignment=TA_CENTER
-    )
-    story.append(Paragraph("This report is for educational purposes only and should not be considered as financial advice.", disclaimer_style))
+    story.append(Paragraph("This report is for educational purposes only and should not be considered as financial advice.", styles["disclaimer"]))
     
     # Build PDF
     doc.build(story)
-    buffer.seek(0)
+    if output is None:
+        buffer.seek(0)
     return buffer
 
-def generate_csv_report(portfolio_data, performance_data):
-    """Generate a CSV report of the portfolio."""
+def _render_report_file(path, portfolio_data, prices, output_path):
+    """Render one portfolio's report to disk (runs in a batch worker process)."""
+    try:
+        performance_data = build_performance_data(portfolio_data, prices)
+        recommendations = static_recommendations("build_wealth", "medium")
+        generate_pdf_report(portfolio_data, performance_data, recommendations, output=output_path)
+        return path, output_path, None
+    except Exception as e:
+        return path, None, str(e)
+
+def render_reports_batch(portfolio_files, output_dir, workers=None):
+    """Render a PDF report for each portfolio JSON file in parallel worker processes.
+
+    Prices for every ticker across all portfolios are fetched once up front, so workers
+    never touch the network. Returns a list of (input path, output path, error) tuples.
+    """
+    portfolios = {}
+    for path in portfolio_files:
+        with open(path, 'r') as f:
+            portfolios[path] = json.load(f)
+    
+    tickers = sorted({ticker for portfolio in portfolios.values() for ticker in portfolio})
+    prices = get_stock_prices(tickers)
+    os.makedirs(output_dir, exist_ok=True)
+    
+    results = []
+    with ProcessPoolExecutor(max_workers=workers or REPORT_WORKERS) as executor:
+        futures = []
+        for path, portfolio_data in portfolios.items():
+            name = os.path.splitext(os.path.basename(path))[0]
+            output_path = os.path.join(output_dir, f"{name}.pdf")
+            portfolio_prices = {ticker: prices.get(ticker) for ticker in portfolio_data}
+            futures.append(executor.submit(_render_report_file, path, portfolio_data, portfolio_prices, output_path))
+        for future in futures:
+            results.append(future.result())
+    return results
+
+@app.cli.command("render-reports")
+@click.argument("portfolio_files", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--output-dir", default="reports", show_default=True, help="Directory the PDFs are written to.")
+@click.option("--workers", type=int, default=None, help="Worker processes (defaults to REPORT_WORKERS).")
+def render_reports_command(portfolio_files, output_dir, workers):
+    """Render PDF reports for portfolio JSON files (same format as portfolio_data.json)."""
+    started = time.time()
+    results = render_reports_batch(portfolio_files, output_dir, workers)
+    failed = 0
+    for path, output_path, error in results:
+        if error:
+            failed += 1
+            print(f"Error rendering report for {path}: {error}")
+    print(f"Rendered {len(results) - failed} report(s) to {output_dir} in {time.time() - started:.1f}s")
+
+# Streaming exports: holdings are read and valued in batches so memory stays flat
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 500))
+CSV_REPORT_HEADER = ['Ticker', 'Shares', 'Purchase Price', 'Current Price', 'Current Value', 'Cost Basis', 'Gain/Loss', 'Gain/Loss %', 'Date Added']
+
+def iter_valued_holding_batches(batch_size=None):
+    """Yield (rows, valuation) per batch of holdings, reading and pricing one batch at a time.
+
+    Each row is a valuation row plus its date_added. Holdings without a current price are left out.
+    """
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    last_id = 0
+    while True:
+        holdings = list(Holding.select()
+                        .where((Holding.user_id == current_user_id()) & (Holding.id > last_id))
+                        .order_by(Holding.id)
+                        .limit(batch_size))
+        if not holdings:
+            return
+        last_id = holdings[-1].id
+        
+        batch = {row.ticker: {"shares": row.shares, "purchase_price": row.purchase_price,
+                              "date_added": row.date_added} for row in holdings}
+        valuation = value_portfolio(batch)
+        rows = []
+        for row in iter_valuation_rows(valuation):
+            row['date_added'] = batch[row['ticker']]['date_added']
+            rows.append(row)
+        yield rows, valuation
+
+def _export_totals(totals, valuation):
+    """Add a batch's valuation into running export totals."""
+    totals['total_value'] += valuation['total_value']
+    totals['total_cost'] += valuation['total_cost']
+    totals['total_gain_loss'] = totals['total_value'] - totals['total_cost']
+    totals['total_gain_loss_pct'] = (totals['total_gain_loss'] / totals['total_cost'] * 100) if totals['total_cost'] > 0 else 0
+    return totals
+
+def stream_csv_report():
+    """Yield a CSV report of the portfolio chunk by chunk, starting with the header row."""
     output = io.StringIO()
     writer = csv.writer(output)
     
+    def flush():
+        chunk = output.getvalue()
+        output.seek(0)
+        output.truncate()
+        return chunk
+    
     # Write header
-    writer.writerow(['Ticker', 'Shares', 'Purchase Price', 'Current Price', 'Current Value', 'Cost Basis', 'Gain/Loss', 'Gain/Loss %', 'Date Added'])
+    writer.writerow(CSV_REPORT_HEADER)
+    yield flush()
     
     # Write portfolio data
-    if performance_data and performance_data['stocks']:
-        for stock in performance_data['stocks']:
-            # Get original portfolio data for date_added
-            original_data = portfolio_data.get(stock['ticker'], {})
-            date_added = original_data.get('date_added', 'Unknown')
-            
+    totals = {'total_value': 0.0, 'total_cost': 0.0, 'total_gain_loss': 0.0, 'total_gain_loss_pct': 0}
+    for rows, valuation in iter_valued_holding_batches():
+        for stock in rows:
+            date_added = stock['date_added'] or 'Unknown'
             writer.writerow([
                 stock['ticker'],
                 stock['shares'],
@@ -469,70 +3114,108 @@ def generate_csv_report(portfolio_data, performance_data):
                 f"{stock['gain_loss_pct']:.2f}",
                 date_added[:10] if date_added != 'Unknown' else 'Unknown'
             ])
+        _export_totals(totals, valuation)
+        yield flush()
     
     # Add summary row
-    if performance_data:
-        writer.writerow([])  # Empty row
-        writer.writerow(['SUMMARY', '', '', '', '', '', '', '', ''])
-        writer.writerow(['Total Portfolio Value', '', '', '', f"{performance_data['total_value']:.2f}", '', '', '', ''])
-        writer.writerow(['Total Cost Basis', '', '', '', '', f"{performance_data['total_cost']:.2f}", '', '', ''])
-        writer.writerow(['Total Gain/Loss', '', '', '', '', '', f"{performance_data['total_gain_loss']:.2f}", '', ''])
-        writer.writerow(['Total Return %', '', '', '', '', '', '', f"{performance_data['total_gain_loss_pct']:.2f}", ''])
-    
-    output.seek(0)
-    return output.getvalue()
+    writer.writerow([])  # Empty row
+    writer.writerow(['SUMMARY', '', '', '', '', '', '', '', ''])
+    writer.writerow(['Total Portfolio Value', '', '', '', f"{totals['total_value']:.2f}", '', '', '', ''])
+    writer.writerow(['Total Cost Basis', '', '', '', '', f"{totals['total_cost']:.2f}", '', '', ''])
+    writer.writerow(['Total Gain/Loss', '', '', '', '', '', f"{totals['total_gain_loss']:.2f}", '', ''])
+    writer.writerow(['Total Return %', '', '', '', '', '', '', f"{totals['total_gain_loss_pct']:.2f}", ''])
+    yield flush()
 
-def calculate_portfolio_metrics(holdings):
-    """Calculate portfolio metrics."""
-    total_value = 0
-    total_cost = 0
-    stock_values = {}
+def stream_ndjson_report():
+    """Yield the portfolio as JSON lines: one {"type": "holding"} object per holding, then a summary."""
+    totals = {'total_value': 0.0, 'total_cost': 0.0, 'total_gain_loss': 0.0, 'total_gain_loss_pct': 0}
+    for rows, valuation in iter_valued_holding_batches():
+        yield "".join(json.dumps({"type": "holding", **row}) + "\n" for row in rows)
+        _export_totals(totals, valuation)
+    yield json.dumps({"type": "summary", "timestamp": datetime.now().isoformat(), **totals}) + "\n"
+
+def value_portfolio(holdings, prices=None):
+    """Value holdings against current prices in a single vectorized pass.
+
+    Returns a dict with per-holding NumPy arrays (tickers, shares, purchase_price,
+    current_price, current_value, cost_basis, gain_loss, gain_loss_pct, stale) and the
+    portfolio totals. Holdings without a current price are left out; stale marks
+    holdings valued at a last known price because live quotes were unavailable.
+    """
+    stale = set()
+    if prices is None:
+        prices = get_stock_prices(holdings.keys(), stale=stale)
     
-    for ticker, data in holdings.items():
-        current_price = get_stock_price(ticker)
-        if current_price:
-            shares = data['shares']
-            cost_per_share = data['purchase_price']
-            
-            current_value = shares * current_price
-            cost_basis = shares * cost_per_share
-            
-            total_value += current_value
-            total_cost += cost_basis
-            
-            stock_values[ticker] = {
-                'current_price': current_price,
-                'current_value': current_value,
-                'cost_basis': cost_basis,
-                'gain_loss': current_value - cost_basis,
-                'gain_loss_pct': ((current_value - cost_basis) / cost_basis * 100) if cost_basis > 0 else 0,
-                'shares': shares,
-                'purchase_price': cost_per_share
-            }
+    tickers = [ticker for ticker in holdings if prices.get(ticker)]
+    count = len(tickers)
+    shares = np.fromiter((holdings[t]['shares'] for t in tickers), dtype=np.float64, count=count)
+    purchase_price = np.fromiter((holdings[t]['purchase_price'] for t in tickers), dtype=np.float64, count=count)
+    current_price = np.fromiter((prices[t] for t in tickers), dtype=np.float64, count=count)
+    is_stale = np.fromiter((t in stale for t in tickers), dtype=bool, count=count)
+    
+    current_value = shares * current_price
+    cost_basis = shares * purchase_price
+    gain_loss = current_value - cost_basis
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gain_loss_pct = np.where(cost_basis > 0, gain_loss / cost_basis * 100, 0.0)
     
+    total_value = float(current_value.sum())
+    total_cost = float(cost_basis.sum())
     total_gain_loss = total_value - total_cost
-    total_gain_loss_pct = (total_gain_loss / total_cost * 100) if total_cost > 0 else 0
     
     return {
+        'tickers': tickers,
+        'shares': shares,
+        'purchase_price': purchase_price,
+        'current_price': current_price,
+        'current_value': current_value,
+        'cost_basis': cost_basis,
+        'gain_loss': gain_loss,
+        'gain_loss_pct': gain_loss_pct,
+        'stale': is_stale,
+        'stale_tickers': [t for t in tickers if t in stale],
         'total_value': total_value,
         'total_cost': total_cost,
         'total_gain_loss': total_gain_loss,
-        'total_gain_loss_pct': total_gain_loss_pct,
-        'stock_values': stock_values
+        'total_gain_loss_pct': (total_gain_loss / total_cost * 100) if total_cost > 0 else 0
     }
 
-def generate_recommendations(goal: str, risk: str, custom_goal: str | None = None, 
-                             investment_amount: str | None = None, time_horizon: str | None = None):
+VALUATION_ROW_FIELDS = ('shares', 'current_price', 'purchase_price', 'current_value',
+                        'cost_basis', 'gain_loss', 'gain_loss_pct', 'stale')
+
+def iter_valuation_rows(valuation):
+    """Yield one plain dict per holding from a value_portfolio() result."""
+    columns = [valuation[field].tolist() for field in VALUATION_ROW_FIELDS]
+    for ticker, *values in zip(valuation['tickers'], *columns):
+        row = {'ticker': ticker}
+        row.update(zip(VALUATION_ROW_FIELDS, values))
+        yield row
+
+def calculate_portfolio_metrics(holdings):
+    """Calculate portfolio metrics."""
+    valuation = value_portfolio(holdings)
+    
+    return {
+        'total_value': valuation['total_value'],
+        'total_cost': valuation['total_cost'],
+        'total_gain_loss': valuation['total_gain_loss'],
+        'total_gain_loss_pct': valuation['total_gain_loss_pct'],
+        'stale_tickers': valuation['stale_tickers'],
+        'stock_values': {row['ticker']: row for row in iter_valuation_rows(valuation)}
+    }
+
+def request_recommendations(goal: str, risk: str, custom_goal: str | None = None, 
+                            investment_amount: str | None = None, time_horizon: str | None = None):
     """
-    Generate personalized stock/ETF recommendations using OpenAI API.
+    Request personalized stock/ETF recommendations from the OpenAI API, bypassing the cache.
     The prompt is enhanced to provide detailed, actionable, beginner-friendly explanations.
+    Raises on API or parsing errors.
     """
-    try:
-        # Convert investment amount to number for calculations later
-        investment_amount_num = float(investment_amount) if investment_amount else 0
+    # Convert investment amount to number for calculations later
+    investment_amount_num = float(investment_amount) if investment_amount else 0
 
-        # Build the improved prompt
-        prompt = f"""
+    # Build the improved prompt
+    prompt = f"""
 You are a professional financial advisor. Recommend exactly 3 stocks or ETFs for an investor. 
 Use the investor profile below to generate your recommendations.
 
@@ -576,8 +3259,9 @@ INSTRUCTIONS:
 }}
         """
 
-        # Call the OpenAI API
-        response = client.chat.completions.create(
+    # Call the OpenAI API
+    with timed(call="openai_chat"):
+        response = get_openai_client().chat.completions.create(
             model="gpt-4",
             messages=[
                 {"role": "system", "content": "You are a professional financial advisor providing clear, actionable investment advice. Always respond with valid JSON."},
@@ -587,38 +3271,145 @@ INSTRUCTIONS:
             max_tokens=1500
         )
 
-        # Parse JSON response
-        import json
-        result = json.loads(response.choices[0].message.content)
-
-        # Convert to expected template format
-        picks = []
-        for rec in result["recommendations"]:
-            allocation_str = rec.get("allocation", "33%")
-            allocation_percent = float(allocation_str.replace('%', '')) / 100
-            dollar_amount = investment_amount_num * allocation_percent if investment_amount_num > 0 else 0
-
-            picks.append({
-                "ticker": rec["ticker"],
-                "name": rec["name"],
-                "why": rec["why"],
-                "risk_level": rec.get("risk_level", "Medium"),
-                "timeframe": rec.get("timeframe", "Long-term"),
-                "allocation": allocation_str,
-                "dollar_amount": dollar_amount
-            })
-
-        return picks
+    # Parse JSON response
+    import json
+    result = json.loads(response.choices[0].message.content)
 
+    # Convert to expected template format
+    picks = []
+    for rec in result["recommendations"]:
+        allocation_str = rec.get("allocation", "33%")
+        allocation_percent = float(allocation_str.replace('%', '')) / 100
+        dollar_amount = investment_amount_num * allocation_percent if investment_amount_num > 0 else 0
+
+        picks.append({
+            "ticker": rec["ticker"],
+            "name": rec["name"],
+            "why": rec["why"],
+            "risk_level": rec.get("risk_level", "Medium"),
+            "timeframe": rec.get("timeframe", "Long-term"),
+            "allocation": allocation_str,
+            "dollar_amount": dollar_amount
+        })
+
+    return picks
+
+# Persistent recommendation cache
+RECOMMENDATION_CACHE_TTL = float(os.getenv("RECOMMENDATION_CACHE_TTL", 7 * 24 * 3600))  # seconds
+CUSTOM_RECOMMENDATION_CACHE_TTL = float(os.getenv("CUSTOM_RECOMMENDATION_CACHE_TTL", 24 * 3600))  # seconds
+RECOMMENDATION_CACHE_MAX_ENTRIES = int(os.getenv("RECOMMENDATION_CACHE_MAX_ENTRIES", 5000))
+RECOMMENDATION_GOALS = ["build_wealth", "save_for_college", "short_term", "retirement", "emergency_fund"]
+RECOMMENDATION_RISKS = ["low", "medium", "high"]
+RECOMMENDATION_TIME_HORIZONS = [None, "short", "medium", "long", "very_long"]
+RECOMMENDATION_TOUCH_INTERVAL = 3600  # seconds; a cache hit records its use at most this often
+MIN_INVESTMENT_AMOUNT = 100
+MAX_INVESTMENT_AMOUNT = 10_000_000
+
+def _amount_bucket(investment_amount):
+    """Bucket an investment amount into half-decades ($100-$315, $316-$999, $1,000-$3,162, ...)."""
+    try:
+        amount = float(investment_amount) if investment_amount else 0
+    except (TypeError, ValueError):
+        amount = 0
+    if amount <= 0:
+        return "none"
+    return str(int(math.floor(math.log10(amount) * 2)))
+
+def _warm_amounts():
+    """No amount, plus one representative amount for every bucket parse_investment_amount() can produce."""
+    amounts = [None]
+    for bucket in range(int(_amount_bucket(MIN_INVESTMENT_AMOUNT)), int(_amount_bucket(MAX_INVESTMENT_AMOUNT)) + 1):
+        amount = min(max(round(10 ** ((bucket + 0.5) / 2)), MIN_INVESTMENT_AMOUNT), MAX_INVESTMENT_AMOUNT)
+        amounts.append(str(amount))
+    return amounts
+
+RECOMMENDATION_WARM_AMOUNTS = _warm_amounts()
+
+def recommendation_cache_key(goal, risk, custom_goal=None, investment_amount=None, time_horizon=None):
+    """Build the cache key for a profile; free-text goals get their own namespace."""
+    profile = [goal or "build_wealth", risk or "medium", time_horizon or "none", _amount_bucket(investment_amount)]
+    if custom_goal:
+        normalized_goal = " ".join(custom_goal.lower().split())
+        digest = hashlib.sha1(json.dumps(profile + [normalized_goal]).encode()).hexdigest()
+        return f"custom:{digest}"
+    return "profile:" + ":".join(profile)
+
+def _apply_investment_amount(picks, investment_amount):
+    """Set each pick's dollar_amount from its allocation and the exact investment amount."""
+    investment_amount_num = float(investment_amount) if investment_amount else 0
+    for pick in picks:
+        allocation_percent = float(str(pick.get("allocation", "33%")).replace('%', '')) / 100
+        pick["dollar_amount"] = investment_amount_num * allocation_percent if investment_amount_num > 0 else 0
+    return picks
+
+def load_cached_recommendations(key):
+    """Return cached picks for a key if they are still fresh, else None."""
+    ttl = CUSTOM_RECOMMENDATION_CACHE_TTL if key.startswith("custom:") else RECOMMENDATION_CACHE_TTL
+    now = time.time()
+    try:
+        row = RecommendationCache.get_or_none(RecommendationCache.key == key)
+        if row is not None and now - row.created_at <= ttl:
+            # Eviction only needs a coarse LRU order, so most hits stay read-only
+            if now - row.last_used > RECOMMENDATION_TOUCH_INTERVAL:
+                RecommendationCache.update(last_used=now).where(RecommendationCache.key == key).execute()
+            picks = json.loads(row.picks)
+            count("stockly_cache_requests_total", cache="recommendations", result="hit")
+            return picks
+    except Exception as e:
+        print(f"Error reading recommendation cache: {e}")
+    count("stockly_cache_requests_total", cache="recommendations", result="miss")
+    return None
+
+def store_cached_recommendations(key, picks):
+    """Store picks for a key, evicting the least recently used entries beyond the size limit."""
+    now = time.time()
+    stored_picks = [{k: v for k, v in pick.items() if k != "dollar_amount"} for pick in picks]
+    try:
+        with db.atomic():
+            RecommendationCache.insert(
+                key=key, picks=json.dumps(stored_picks), created_at=now, last_used=now
+            ).on_conflict_replace().execute()
+            overflow = RecommendationCache.select().count() - RECOMMENDATION_CACHE_MAX_ENTRIES
+            if overflow > 0:
+                oldest = (RecommendationCache.select(RecommendationCache.key)
+                          .order_by(RecommendationCache.last_used).limit(overflow))
+                RecommendationCache.delete().where(RecommendationCache.key.in_(oldest)).execute()
+    except Exception as e:
+        print(f"Error writing recommendation cache: {e}")
+
+def generate_recommendations(goal: str, risk: str, custom_goal: str | None = None, 
+                             investment_amount: str | None = None, time_horizon: str | None = None):
+    """
+    Generate personalized stock/ETF recommendations, served from the persistent cache when possible.
+    Cached picks are shared by profiles in the same amount bucket; dollar amounts are
+    always recomputed for the exact investment amount.
+    """
+    key = recommendation_cache_key(goal, risk, custom_goal, investment_amount, time_horizon)
+    picks = load_cached_recommendations(key)
+    if picks is not None:
+        return _apply_investment_amount(picks, investment_amount)
+    
+    try:
+        picks = request_recommendations(goal, risk, custom_goal, investment_amount, time_horizon)
     except Exception as e:
         print(f"Error calling OpenAI API: {e}")
         return get_fallback_recommendations(goal, risk, custom_goal, investment_amount, time_horizon)
-
+    
+    store_cached_recommendations(key, picks)
+    return picks
 
 def get_fallback_recommendations(goal: str, risk: str, custom_goal: str | None = None, 
                                investment_amount: str | None = None, time_horizon: str | None = None):
     """
-    Fallback recommendations when OpenAI API is unavailable.
+    Fallback recommendations when OpenAI API is unavailable, counted in stockly_fallbacks_total.
+    """
+    count("stockly_fallbacks_total", kind="recommendations")
+    return static_recommendations(goal, risk, custom_goal, investment_amount, time_horizon)
+
+def static_recommendations(goal: str, risk: str, custom_goal: str | None = None, 
+                           investment_amount: str | None = None, time_horizon: str | None = None):
+    """
+    Predefined recommendations for a goal and risk tolerance, e.g. for reports that never call the LLM.
     """
     investment_amount_num = float(investment_amount) if investment_amount else 0
     
@@ -678,6 +3469,223 @@ def get_fallback_recommendations(goal: str, risk: str, custom_goal: str | None =
     
     return picks
 
+@app.cli.command("warm-recommendations")
+@click.option("--force", is_flag=True, help="Regenerate entries that are still fresh.")
+def warm_recommendations_command(force):
+    """Precompute recommendations for every goal, risk, time horizon and amount bucket combination."""
+    generated = 0
+    profiles = itertools.product(RECOMMENDATION_GOALS, RECOMMENDATION_RISKS,
+                                 RECOMMENDATION_TIME_HORIZONS, RECOMMENDATION_WARM_AMOUNTS)
+    for goal, risk, time_horizon, investment_amount in profiles:
+        key = recommendation_cache_key(goal, risk, investment_amount=investment_amount, time_horizon=time_horizon)
+        if not force and load_cached_recommendations(key) is not None:
+            continue
+        try:
+            picks = request_recommendations(goal, risk, investment_amount=investment_amount, time_horizon=time_horizon)
+        except Exception as e:
+            print(f"Error warming {key}: {e}")
+            continue
+        store_cached_recommendations(key, picks)
+        generated += 1
+    print(f"Generated {generated} recommendation set(s)")
+
+# Background job queue: slow LLM and report work runs on a bounded pool instead of request threads
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", 100))  # queued + running jobs per worker process
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", 120))  # seconds
+JOB_RETENTION = 3600  # seconds finished jobs and their files are kept
+JOB_RESULTS_DIR = os.getenv("JOB_RESULTS_DIR", "job_results")
+_job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+_jobs_pending = 0
+_jobs_pending_lock = threading.Lock()
+
+class JobQueueFull(Exception):
+    pass
+
+def _recommendations_job(params):
+    return generate_recommendations(params.get("goal") or "build_wealth", params.get("risk") or "medium",
+                                    params.get("custom_goal") or None, params.get("investment_amount") or None,
+                                    params.get("time_horizon") or None)
+
+def _insights_job(params):
+    performance_data = get_portfolio_performance_data()
+    if not performance_data:
+        raise ValueError("No portfolio performance data available")
+    return {
+        "success": True,
+        "insights": generate_performance_insights(performance_data),
+        "performance_data": performance_data,
+        "timestamp": datetime.now().isoformat()
+    }
+
+def _pdf_report_job(params):
+    portfolio_data = load_portfolio_data()
+    performance_data = get_portfolio_performance_data()
+    if not performance_data:
+        raise ValueError("No portfolio performance data available")
+    recommendations = static_recommendations("build_wealth", "medium")
+    pdf_buffer = generate_pdf_report(portfolio_data, performance_data, recommendations)
+    return {
+        "file": pdf_buffer.getvalue(),
+        "mimetype": "application/pdf",
+        "filename": f"stockly_portfolio_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    }
+
+JOB_HANDLERS = {
+    "recommendations": _recommendations_job,
+    "insights": _insights_job,
+    "pdf_report": _pdf_report_job
+}
+
+def _finish_job(job_id, **fields):
+    """Record a job's outcome unless it already timed out."""
+    fields["updated_at"] = time.time()
+    Job.update(**fields).where((Job.id == job_id) & (Job.status == "running")).execute()
+
+def _release_job_slot():
+    global _jobs_pending
+    with _jobs_pending_lock:
+        _jobs_pending -= 1
+
+def _run_job(job_id, kind, params, user_id):
+    """Run a job on a pool thread in the submitting user's partition, storing its result or error.
+
+    The pending slot is released on every exit path, but only when the handler returns:
+    threads cannot be interrupted, so a timed-out job keeps its pool thread and its slot
+    until it finishes.
+    """
+    try:
+        with db.connection_context(), user_partition(user_id):
+            Job.update(status="running", updated_at=time.time()).where(Job.id == job_id).execute()
+            # Threads cannot be interrupted, so a job past its deadline is reported as timed out
+            # and whatever it returns afterwards is discarded
+            timer = threading.Timer(JOB_TIMEOUT, _timeout_job, args=(job_id,))
+            timer.daemon = True
+            timer.start()
+            try:
+                result = JOB_HANDLERS[kind](params)
+                if isinstance(result, dict) and "file" in result:
+                    os.makedirs(JOB_RESULTS_DIR, exist_ok=True)
+                    path = os.path.join(JOB_RESULTS_DIR, job_id)
+                    with open(path, 'wb') as f:
+                        f.write(result.pop("file"))
+                    result["path"] = path
+                _finish_job(job_id, status="done", result=json.dumps(result))
+            except Exception as e:
+                print(f"Error running {kind} job {job_id}: {e}")
+                _finish_job(job_id, status="failed", error=str(e))
+            finally:
+                timer.cancel()
+    finally:
+        _release_job_slot()
+
+def _timeout_job(job_id):
+    with db.connection_context():
+        Job.update(status="timeout", error=f"Job exceeded {JOB_TIMEOUT:.0f}s",
+                   updated_at=time.time()).where((Job.id == job_id) & (Job.status == "running")).execute()
+
+def _prune_jobs():
+    """Delete finished jobs older than JOB_RETENTION, along with their result files."""
+    cutoff = time.time() - JOB_RETENTION
+    expired = Job.select().where(Job.created_at < cutoff)
+    for job in expired:
+        if job.result and job.status == "done":
+            path = json.loads(job.result).get("path") if job.result.startswith("{") else None
+            if path and os.path.exists(path):
+                os.remove(path)
+    Job.delete().where(Job.created_at < cutoff).execute()
+
+def submit_job(kind, params=None):
+    """Queue a background job, returning the existing Job if an identical one is still in flight.
+
+    Raises JobQueueFull when this worker already has JOB_QUEUE_LIMIT jobs pending. A job
+    stays pending until its handler returns, even after it is marked as timed out.
+    """
+    global _jobs_pending
+    params = params or {}
+    user_id = current_user_id()
+    dedup_key = hashlib.sha1(json.dumps([user_id, kind, params], sort_keys=True).encode()).hexdigest()
+    now = time.time()
+    
+    with db.atomic('IMMEDIATE'):
+        existing = (Job.select()
+                    .where((Job.dedup_key == dedup_key) &
+                           (Job.status.in_(["queued", "running"])) &
+                           (Job.created_at > now - JOB_TIMEOUT))
+                    .order_by(Job.created_at.desc())
+                    .first())
+        if existing:
+            return existing
+        
+        with _jobs_pending_lock:
+            if _jobs_pending >= JOB_QUEUE_LIMIT:
+                raise JobQueueFull(f"{_jobs_pending} jobs already pending")
+            _jobs_pending += 1
+        try:
+            job = Job.create(id=uuid.uuid4().hex, user_id=user_id, kind=kind, dedup_key=dedup_key,
+                             created_at=now, updated_at=now)
+        except BaseException:
+            _release_job_slot()
+            raise
+    
+    try:
+        _job_executor.submit(_run_job, job.id, kind, params, user_id)
+    except BaseException as e:
+        # _run_job never started, so it will not release the slot
+        _release_job_slot()
+        Job.update(status="failed", error=f"Could not start job: {e}", updated_at=time.time()).where(Job.id == job.id).execute()
+        raise
+    if random.random() < 0.05:
+        _prune_jobs()
+    return job
+
+def _job_accepted(job):
+    """Build the 202 response returned when a job is submitted."""
+    return jsonify(job.to_dict()), 202
+
+def _price_data_tag(tickers):
+    """Hash the quotes that would be served for tickers.
+
+    Every worker serving the same prices produces the same tag, and the tag only
+    changes when a price does. Quotes come from the shared cache, so this is cheap
+    unless they are due for a refresh anyway.
+    """
+    prices = sorted(get_stock_prices(tickers).items())
+    return hashlib.sha1(json.dumps(prices).encode()).hexdigest()[:16]
+
+def conditional_json(validators, build):
+    """Answer If-None-Match with 304 before build() loads any data.
+
+    validators() returns the resource's current (etag, last modified epoch seconds);
+    it is re-read after build() so the response is tagged with the state it was built from.
+    """
+    etag, last_modified = validators()
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = build()
+        if isinstance(response, tuple) or response.status_code != 200:
+            return response
+        etag, last_modified = validators()
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = datetime.fromtimestamp(last_modified, timezone.utc)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def _portfolio_price_validators(prefix):
+    """Validators for resources derived from the holdings and the quote cache.
+
+    No Last-Modified is sent: prices change independently of the holdings, and the
+    ETag already covers both.
+    """
+    def validators():
+        portfolio_version, _ = get_data_version("portfolio")
+        tickers = [ticker for (ticker,) in Holding.select(Holding.ticker)
+                   .where(Holding.user_id == current_user_id()).tuples()]
+        return f"{prefix}-{portfolio_version}-{_price_data_tag(tickers)}", 0
+    return validators
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -701,79 +3709,130 @@ def add_holding():
         purchase_price = float(request.form.get("purchase_price", 0))
         
         if ticker and shares > 0 and purchase_price > 0:
-            portfolio_data = load_portfolio_data()
-            portfolio_data[ticker] = {
-                "shares": shares,
-                "purchase_price": purchase_price,
-                "date_added": datetime.now().isoformat()
-            }
-            save_portfolio_data(portfolio_data)
+            add_lot(ticker, shares, purchase_price, request.form.get("purchase_date") or None)
             return redirect(url_for("portfolio"))
     
     return render_template("add_holding.html")
 
+@app.route("/portfolio/import", methods=["POST"])
+def import_holdings_route():
+    """Bulk import holdings from an uploaded CSV or JSON file, or a JSON request body."""
+    wants_html = request.accept_mimetypes.best_match(["application/json", "text/html"]) == "text/html"
+    replace = request.values.get("mode") == "replace"
+    upload = request.files.get("file")
+    
+    try:
+        if upload and upload.filename:
+            df = parse_holdings_upload(upload.stream, upload.filename, upload.mimetype)
+        elif request.is_json:
+            df = parse_holdings_upload(io.BytesIO(request.get_data()), content_type="application/json")
+        else:
+            raise ValueError("No file uploaded")
+        valid, errors = validate_holdings_frame(df)
+        imported = import_holdings(valid, replace) if len(valid) else 0
+        result = {"imported": imported, "rows": len(df), "errors": errors}
+        status = 200 if imported or not errors else 400
+    except MarketDataUnavailable as e:
+        print(f"Error importing holdings: {e}")
+        message = "Market data is temporarily unavailable, so tickers could not be checked. Nothing was imported; please try again shortly."
+        result = {"imported": 0, "rows": 0, "errors": [{"row": None, "ticker": None, "error": message}], "retryable": True}
+        status = 503
+    except Exception as e:
+        print(f"Error importing holdings: {e}")
+        result = {"imported": 0, "rows": 0, "errors": [{"row": None, "ticker": None, "error": str(e)}]}
+        status = 400
+    
+    headers = {"Retry-After": "30"} if status == 503 else {}
+    if wants_html:
+        return render_template("add_holding.html", import_result=result), status, headers
+    return jsonify(result), status, headers
+
 @app.route("/portfolio/edit/<ticker>", methods=["GET", "POST"])
 def edit_holding(ticker):
     """Edit an existing stock holding."""
-    portfolio_data = load_portfolio_data()
+    holding = load_holding(ticker)
+    
+    if holding is None:
+        return redirect(url_for("portfolio"))
     
     if request.method == "POST":
         shares = float(request.form.get("shares", 0))
         purchase_price = float(request.form.get("purchase_price", 0))
         
         if shares > 0 and purchase_price > 0:
-            portfolio_data[ticker] = {
-                "shares": shares,
-                "purchase_price": purchase_price,
-                "date_added": portfolio_data[ticker].get("date_added", datetime.now().isoformat())
-            }
-            save_portfolio_data(portfolio_data)
+            save_holding(ticker, shares, purchase_price, holding["date_added"])
             return redirect(url_for("portfolio"))
     
-    if ticker not in portfolio_data:
-        return redirect(url_for("portfolio"))
-    
-    holding = portfolio_data[ticker]
     return render_template("edit_holding.html", ticker=ticker, holding=holding)
 
+@app.route("/portfolio/sell/<ticker>", methods=["POST"])
+def sell_holding(ticker):
+    """Sell shares of a holding, closing its oldest lots first."""
+    shares = float(request.form.get("shares", 0))
+    if shares > 0:
+        try:
+            sell_shares(ticker, shares)
+        except ValueError as e:
+            print(f"Error selling {ticker}: {e}")
+    return redirect(url_for("portfolio"))
+
+@app.route("/portfolio/api/lots/<ticker>")
+def portfolio_api_lots(ticker):
+    """API endpoint to get the lot ledger for a holding."""
+    return jsonify(load_lots(ticker.upper()))
+
 @app.route("/portfolio/delete/<ticker>", methods=["POST"])
 def delete_holding(ticker):
     """Delete a stock holding from portfolio."""
-    portfolio_data = load_portfolio_data()
-    if ticker in portfolio_data:
-        del portfolio_data[ticker]
-        save_portfolio_data(portfolio_data)
+    remove_holding(ticker)
     return redirect(url_for("portfolio"))
 
 @app.route("/portfolio/api/prices")
 def portfolio_api_prices():
     """API endpoint to get current prices for all holdings."""
-    portfolio_data = load_portfolio_data()
-    prices = {}
+    def build():
+        portfolio_data = load_portfolio_data()
+        stale = set()
+        response = jsonify(get_stock_prices(portfolio_data.keys(), stale=stale))
+        if stale:
+            response.headers['X-Stale-Tickers'] = ",".join(sorted(stale))
+        return response
     
-    for ticker in portfolio_data.keys():
-        price = get_stock_price(ticker)
-        if price:
-            prices[ticker] = price
-    
-    return jsonify(prices)
+    return conditional_json(_portfolio_price_validators("prices"), build)
 
 @app.route("/portfolio/api/history/<ticker>")
 def portfolio_api_history(ticker):
-    """API endpoint to get historical data for a stock."""
+    """API endpoint to get historical data for a stock from the local price store."""
+    period = request.args.get("range", "1mo")
+    if period not in HISTORY_RANGES:
+        return jsonify({"error": f"Unsupported range: {period}"}), 400
+    
     try:
-        stock = yf.Ticker(ticker)
-        hist = stock.history(period="1mo")  # Last month
-        if not hist.empty:
-            data = []
-            for date, row in hist.iterrows():
-                data.append({
-                    'date': date.strftime('%Y-%m-%d'),
-                    'price': float(row['Close'])
-                })
-            return jsonify(data)
+        dates, closes = get_price_history(ticker.upper(), period)
+        return jsonify(serialize_price_history(dates, closes))
+    except Exception as e:
+        print(f"Error loading history for {ticker}: {e}")
+    
+    return jsonify([])
+
+@app.route("/portfolio/api/value_history")
+def portfolio_api_value_history():
+    """API endpoint to get the portfolio's value over time."""
+    period = request.args.get("range", "1y")
+    if period not in HISTORY_RANGES:
+        return jsonify({"error": f"Unsupported range: {period}"}), 400
+    
+    portfolio_data = load_portfolio_data()
+    if not portfolio_data:
+        return jsonify([])
+    
+    try:
+        max_points = min(int(request.args.get("points", MAX_CHART_POINTS)), MAX_CHART_POINTS)
+        dates, values = get_portfolio_value_series(portfolio_data, period, max(max_points, 2))
+        date_strings = dates.astype('datetime64[D]').astype(str).tolist()
+        return jsonify([{'date': date, 'value': value} for date, value in zip(date_strings, values.tolist())])
     except Exception as e:
-        print(f"Error fetching history for {ticker}: {e}")
+        print(f"Error loading portfolio value history: {e}")
     
     return jsonify([])
 
@@ -786,7 +3845,7 @@ def parse_investment_amount(amount_str):
     try:
         numeric_value = float(amount_str.replace(',', ''))
         # Validate range
-        if 100 <= numeric_value <= 10000000:
+        if MIN_INVESTMENT_AMOUNT <= numeric_value <= MAX_INVESTMENT_AMOUNT:
             return str(int(numeric_value))  # Return as string for consistency
     except (ValueError, TypeError):
         pass
@@ -825,8 +3884,30 @@ def results():
     investment_amount = request.args.get("investment_amount")
     time_horizon = request.args.get("time_horizon")
     
-    picks = generate_recommendations(goal, risk, custom_goal, investment_amount, time_horizon)
+    job_id = request.args.get("job")
+    job = Job.get_or_none((Job.id == job_id) & (Job.user_id == current_user_id())) if job_id else None
+    if job is not None and job.status == "done":
+        # Finished background job: use its picks even if they were fallbacks that never got cached
+        picks = _apply_investment_amount(json.loads(job.result), investment_amount)
+    else:
+        picks = load_cached_recommendations(
+            recommendation_cache_key(goal, risk, custom_goal, investment_amount, time_horizon))
+        if picks is not None:
+            picks = _apply_investment_amount(picks, investment_amount)
+        elif job is None:
+            # Nothing cached: generate in the background and let the page poll for it
+            params = {"goal": goal, "risk": risk, "custom_goal": custom_goal,
+                      "investment_amount": investment_amount, "time_horizon": time_horizon}
+            try:
+                job = submit_job("recommendations", params)
+            except JobQueueFull:
+                picks = get_fallback_recommendations(goal, risk, custom_goal, investment_amount, time_horizon)
+        else:
+            # The job failed or timed out
+            picks = get_fallback_recommendations(goal, risk, custom_goal, investment_amount, time_horizon)
+    
     return render_template("results.html", 
+                         pending_job=job.to_dict() if picks is None else None,
                          picks=picks, 
                          goal=goal, 
                          risk=risk, 
@@ -837,16 +3918,21 @@ def results():
 @app.route("/notifications")
 def notifications():
     """Display notifications page."""
-    notifications_data = load_notifications_data()
+    cursor = request.args.get("cursor")
     preferences = load_notification_preferences()
     
-    # If no notifications exist, generate sample ones
-    if not notifications_data:
-        notifications_data = generate_sample_notifications()
-        save_notifications_data(notifications_data)
+    # If no notifications exist, generate sample ones (once, even with several tabs loading at once)
+    if not cursor and not get_total_notification_count():
+        with partition_lock():
+            if not get_total_notification_count():
+                save_notifications_data(generate_sample_notifications())
     
+    notifications_data, next_cursor = load_notifications_page(cursor)
     return render_template("notifications.html", 
                          notifications=notifications_data,
+                         next_cursor=next_cursor,
+                         unread_count=get_unread_notification_count(),
+                         total_count=get_total_notification_count(),
                          preferences=preferences)
 
 @app.route("/notifications/preferences", methods=["GET", "POST"])
@@ -873,12 +3959,7 @@ def notification_preferences():
 @app.route("/notifications/mark_read/<notification_id>", methods=["POST"])
 def mark_notification_read(notification_id):
     """Mark a notification as read."""
-    notifications_data = load_notifications_data()
-    for notification in notifications_data:
-        if notification["id"] == notification_id:
-            notification["read"] = True
-            break
-    save_notifications_data(notifications_data)
+    mark_notification_as_read(notification_id)
     return jsonify({"success": True})
 
 @app.route("/notifications/clear_all", methods=["POST"])
@@ -889,12 +3970,64 @@ def clear_all_notifications():
 
 @app.route("/notifications/api/check")
 def check_notifications_api():
-    """API endpoint to check for new notifications (placeholder)."""
-    notifications_data = check_price_alerts()
-    unread_count = sum(1 for n in notifications_data if not n.get("read", False))
+    """API endpoint for the notification badge: unread count and the latest notifications."""
+    def build():
+        latest, _ = load_notifications_page(limit=5)
+        return jsonify({
+            "notifications": latest,
+            "unread_count": get_unread_notification_count()
+        })
+    
+    def validators():
+        version, modified = get_data_version("notifications")
+        return f"notifications-{version}", modified
+    
+    return conditional_json(validators, build)
+
+@app.route("/notifications/api/list")
+def list_notifications_api():
+    """API endpoint to page through notifications, newest first."""
+    try:
+        limit = int(request.args.get("limit", NOTIFICATIONS_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    limit = max(1, min(limit, MAX_NOTIFICATIONS_PAGE_SIZE))
+    
+    notifications_data, next_cursor = load_notifications_page(request.args.get("cursor"), limit)
     return jsonify({
-        "notifications": notifications_data[:5],  # Return last 5
-        "unread_count": unread_count
+        "notifications": notifications_data,
+        "next_cursor": next_cursor,
+        "unread_count": get_unread_notification_count()
+    })
+
+@app.route("/stream")
+def stream():
+    """Server-Sent Events stream of price changes and notification badge counts.
+
+    Answers 503 once the worker's stream slots are taken; the page then polls instead.
+    """
+    subscriber = _subscribe()
+    if subscriber is None:
+        return jsonify({"error": "Too many live streams, poll instead"}), 503, {"Retry-After": str(int(STREAM_INTERVAL * 6))}
+    
+    def events():
+        try:
+            yield f"retry: {int(STREAM_INTERVAL * 1000)}\n\n"
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    break
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            _unsubscribe(subscriber)
+    
+    return Response(events(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
     })
 
 @app.route("/insights")
@@ -911,19 +4044,31 @@ def insights():
     # Get performance data
     performance_data = get_portfolio_performance_data()
     
-    # Generate AI insights
+    # Only show stored insights here; fresh ones are fetched by the page after it loads
     insights = None
     if performance_data:
-        insights = generate_performance_insights(performance_data)
+        insights = load_cached_insights(insights_snapshot_hash(performance_data))
     
     return render_template("insights.html", 
                          has_portfolio=True,
                          performance_data=performance_data,
-                         insights=insights)
+                         insights=insights,
+                         insights_pending=bool(performance_data) and insights is None)
 
 @app.route("/insights/generate", methods=["POST"])
 def generate_insights():
-    """Generate new AI insights (AJAX endpoint)."""
+    """Queue generation of new AI insights; poll the returned job for the result (AJAX endpoint)."""
+    if not Holding.select().where(Holding.user_id == current_user_id()).exists():
+        return jsonify({"error": "No portfolio data available"}), 400
+    
+    try:
+        return _job_accepted(submit_job("insights"))
+    except JobQueueFull:
+        return jsonify({"error": "Too many jobs in progress, please try again shortly"}), 503
+
+@app.route("/insights/stream", methods=["POST"])
+def stream_insights():
+    """Stream new AI insights to the browser as plain text while they are generated."""
     portfolio_data = load_portfolio_data()
     
     if not portfolio_data:
@@ -934,79 +4079,130 @@ def generate_insights():
     if not performance_data:
         return jsonify({"error": "Unable to fetch portfolio performance data"}), 500
     
-    insights = generate_performance_insights(performance_data)
-    
-    return jsonify({
-        "success": True,
-        "insights": insights,
-        "performance_data": performance_data,
-        "timestamp": datetime.now().isoformat()
-    })
+    return Response(stream_with_context(stream_performance_insights(performance_data)),
+                    mimetype="text/plain", headers={
+                        "Cache-Control": "no-cache",
+                        "X-Accel-Buffering": "no"
+                    })
 
 @app.route("/insights/api/performance")
 def insights_api_performance():
     """API endpoint to get current portfolio performance data."""
-    portfolio_data = load_portfolio_data()
+    def build():
+        portfolio_data = load_portfolio_data()
+        
+        if not portfolio_data:
+            return jsonify({"error": "No portfolio data available"}), 400
+        
+        performance_data = get_portfolio_performance_data()
+        
+        if not performance_data:
+            return jsonify({"error": "Unable to fetch performance data"}), 500
+        
+        return jsonify(performance_data)
     
+    return conditional_json(_portfolio_price_validators("performance"), build)
+
+@app.route("/insights/api/risk")
+def insights_api_risk():
+    """API endpoint for portfolio risk: volatility, beta, Sharpe ratio, max drawdown and correlations.
+
+    Query parameters: range (default RISK_DEFAULT_RANGE), benchmark (default RISK_BENCHMARK)
+    and correlation=0 to leave out the full correlation matrix.
+    """
+    period = request.args.get("range", RISK_DEFAULT_RANGE)
+    if period not in HISTORY_RANGES:
+        return jsonify({"error": f"Unsupported range: {period}"}), 400
+    benchmark = request.args.get("benchmark", RISK_BENCHMARK).upper().strip()
+    if not re.match(TICKER_PATTERN, benchmark):
+        return jsonify({"error": "Invalid benchmark ticker"}), 400
+
+    portfolio_data = load_portfolio_data()
     if not portfolio_data:
         return jsonify({"error": "No portfolio data available"}), 400
-    
-    performance_data = get_portfolio_performance_data()
-    
-    if not performance_data:
-        return jsonify({"error": "Unable to fetch performance data"}), 500
-    
-    return jsonify(performance_data)
+
+    try:
+        risk = compute_portfolio_risk({ticker: holding["shares"] for ticker, holding in portfolio_data.items()},
+                                      period, benchmark, include_correlation=request.args.get("correlation") != "0")
+    except Exception as e:
+        print(f"Error computing portfolio risk: {e}")
+        return jsonify({"error": "Unable to compute risk analytics"}), 500
+    return jsonify(risk)
 
 @app.route("/export/pdf")
 def export_pdf():
-    """Export portfolio as PDF report."""
-    portfolio_data = load_portfolio_data()
-    
-    if not portfolio_data:
+    """Queue a PDF report of the portfolio; download it from the job's result_url when done."""
+    if not Holding.select().where(Holding.user_id == current_user_id()).exists():
         return jsonify({"error": "No portfolio data available"}), 400
     
-    # Get performance data
-    performance_data = get_portfolio_performance_data()
-    
-    if not performance_data:
-        return jsonify({"error": "Unable to fetch performance data"}), 500
-    
-    # Get sample recommendations for the report
-    recommendations = get_fallback_recommendations("build_wealth", "medium")
-    
-    # Generate PDF
-    pdf_buffer = generate_pdf_report(portfolio_data, performance_data, recommendations)
+    try:
+        return _job_accepted(submit_job("pdf_report"))
+    except JobQueueFull:
+        return jsonify({"error": "Too many jobs in progress, please try again shortly"}), 503
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    """Submit a background job: {"kind": "recommendations" | "insights" | "pdf_report", "params": {...}}."""
+    payload = request.get_json(silent=True) or {}
+    kind = payload.get("kind")
+    if kind not in JOB_HANDLERS:
+        return jsonify({"error": f"Unknown job kind: {kind}"}), 400
     
-    # Create response
-    response = make_response(pdf_buffer.getvalue())
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename=stockly_portfolio_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
+    try:
+        return _job_accepted(submit_job(kind, payload.get("params") or {}))
+    except JobQueueFull:
+        return jsonify({"error": "Too many jobs in progress, please try again shortly"}), 503
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """Report a background job's status."""
+    job = Job.get_or_none((Job.id == job_id) & (Job.user_id == current_user_id()))
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    """Return a finished job's result: JSON, or a file download for report jobs."""
+    job = Job.get_or_none((Job.id == job_id) & (Job.user_id == current_user_id()))
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job.status in ("queued", "running"):
+        return jsonify(job.to_dict()), 202
+    if job.status != "done":
+        return jsonify(job.to_dict()), 500
     
-    return response
+    result = json.loads(job.result)
+    if isinstance(result, dict) and "path" in result:
+        if not os.path.exists(result["path"]):
+            return jsonify({"error": "Job result has expired"}), 410
+        return send_file(os.path.abspath(result["path"]), mimetype=result["mimetype"],
+                         as_attachment=True, download_name=result["filename"])
+    return jsonify(result)
 
 @app.route("/export/csv")
 def export_csv():
-    """Export portfolio as CSV report."""
-    portfolio_data = load_portfolio_data()
+    """Export portfolio as a CSV report, or as JSON lines with ?format=ndjson, streamed as it is valued."""
+    if request.args.get("format") == "ndjson":
+        return export_ndjson()
     
-    if not portfolio_data:
+    if not Holding.select().where(Holding.user_id == current_user_id()).exists():
         return jsonify({"error": "No portfolio data available"}), 400
     
-    # Get performance data
-    performance_data = get_portfolio_performance_data()
-    
-    if not performance_data:
-        return jsonify({"error": "Unable to fetch performance data"}), 500
-    
-    # Generate CSV
-    csv_data = generate_csv_report(portfolio_data, performance_data)
-    
-    # Create response
-    response = make_response(csv_data)
-    response.headers['Content-Type'] = 'text/csv'
+    response = Response(stream_with_context(stream_csv_report()), mimetype='text/csv')
     response.headers['Content-Disposition'] = f'attachment; filename=stockly_portfolio_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route("/export/ndjson")
+def export_ndjson():
+    """Export portfolio as newline-delimited JSON for machine consumers, streamed as it is valued."""
+    if not Holding.select().where(Holding.user_id == current_user_id()).exists():
+        return jsonify({"error": "No portfolio data available"}), 400
     
+    response = Response(stream_with_context(stream_ndjson_report()), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename=stockly_portfolio_data_{datetime.now().strftime("%Y%m%d_%H%M%S")}.ndjson'
+    response.headers['X-Accel-Buffering'] = 'no'
     return response
 
 @app.route("/export/preview")
@@ -1023,6 +4219,68 @@ def export_preview():
                          has_portfolio=True,
                          performance_data=performance_data)
 
+@app.route("/metrics")
+def metrics():
+    """Prometheus scrape endpoint covering every worker that shares METRICS_DIR."""
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# Cold start: heavy dependencies load on first use. PRELOAD_DEPENDENCIES=1 loads them during
+# import instead (for gunicorn --preload, so forked workers share them); "background" loads them
+# in a thread after startup so the first real request does not pay for them.
+PRELOAD_DEPENDENCIES = os.getenv("PRELOAD_DEPENDENCIES", "").lower()
+HEAVY_MODULES = ("numpy", "pandas", "yfinance", "reportlab", "openai")
+
+def preload_dependencies():
+    """Import the heavy dependencies and build the OpenAI client and PDF styles now."""
+    started = time.perf_counter()
+    for module in (np, pd, yf):
+        module._load()
+    get_pdf_styles()
+    get_openai_client()
+    return time.perf_counter() - started
+
+def _background_preload():
+    try:
+        print(f"Preloaded dependencies in {preload_dependencies() * 1000:.0f} ms")
+    except Exception as e:
+        print(f"Error preloading dependencies: {e}")
+
+init_storage()
+
+if PRELOAD_DEPENDENCIES in ("1", "true", "yes"):
+    preload_dependencies()
+elif PRELOAD_DEPENDENCIES == "background":
+    threading.Thread(target=_background_preload, name="preload", daemon=True).start()
+
+# Includes interpreter startup and the imports above when /proc is available
+STARTUP_SECONDS = _process_age()
+if STARTUP_SECONDS is None:
+    STARTUP_SECONDS = time.perf_counter() - _module_started
+
+@app.cli.command("startup-time")
+@click.option("--runs", default=5, show_default=True, help="Fresh interpreter imports to time.")
+@click.option("--preload", is_flag=True, help="Time startup with PRELOAD_DEPENDENCIES=1.")
+def startup_time_command(runs, preload):
+    """Measure cold-start time: import the app in fresh interpreters and report which heavy modules loaded."""
+    import subprocess
+    
+    probe = ("import json, sys, time; started = time.perf_counter(); import app; "
+             "print(json.dumps({'import': time.perf_counter() - started, 'startup': app.STARTUP_SECONDS, "
+             f"'loaded': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))")
+    env = dict(os.environ, PRELOAD_DEPENDENCIES="1" if preload else "", ALERT_CHECK_INTERVAL="0")
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", probe], env=env, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout
+        timings.append(json.loads(output.strip().splitlines()[-1]))
+    
+    import_times = sorted(timing["import"] for timing in timings)
+    print(f"Import time over {runs} run(s): min {import_times[0] * 1000:.0f} ms, "
+          f"median {import_times[len(import_times) // 2] * 1000:.0f} ms")
+    print(f"Heavy modules loaded at startup: {', '.join(timings[-1]['loaded']) or 'none'}")
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
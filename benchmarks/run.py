@@ -0,0 +1,311 @@
+"""Benchmark the Stockly app against local market data and LLM stand-ins.
+
+Each portfolio size runs in its own subprocess with a fresh database, so results
+do not depend on the network, an OpenAI key or earlier runs:
+
+    python benchmarks/run.py --sizes 10,1000,10000 --output bench.json
+
+Prints (or writes) JSON with throughput, p50/p99 latency and peak memory for each
+endpoint and size.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = [
+    "/portfolio",
+    "/portfolio/api/prices",
+    "/insights/generate",
+    "/export/pdf",
+    "/export/csv",
+    "/notifications/api/check",
+    "/insights/api/risk",
+    "/jobs",
+]
+
+# Endpoints that queue a background job, with the method and JSON body to submit it;
+# their latency runs until the result is downloaded. /jobs is benchmarked as a recommendations job.
+JOB_ENDPOINTS = {
+    "/insights/generate": ("POST", None),
+    "/export/pdf": ("GET", None),
+    "/jobs": ("POST", {"kind": "recommendations",
+                       "params": {"goal": "build_wealth", "risk": "medium", "investment_amount": "5000"}}),
+}
+
+SAMPLE_INSIGHTS = (
+    "Your portfolio is broadly diversified and currently ahead of its cost basis. "
+    "Consider trimming the largest positions and keeping a cash reserve for new opportunities."
+)
+
+# Same shape as the JSON the recommendations prompt asks for
+SAMPLE_RECOMMENDATIONS = json.dumps({"recommendations": [
+    {"ticker": "VTI", "name": "Vanguard Total Stock Market ETF", "why": "Broad market exposure",
+     "risk_level": "Medium", "timeframe": "Long-term", "allocation": "50%"},
+    {"ticker": "BND", "name": "Vanguard Total Bond Market ETF", "why": "Stability",
+     "risk_level": "Low", "timeframe": "Medium-term", "allocation": "30%"},
+    {"ticker": "VXUS", "name": "Vanguard Total International Stock ETF", "why": "Diversification",
+     "risk_level": "Medium", "timeframe": "Long-term", "allocation": "20%"},
+]})
+
+# Calendar days of synthetic daily closes served by the stub provider
+STUB_HISTORY_DAYS = 730
+
+def stub_price(ticker):
+    """Deterministic price between 10 and 510 for a ticker."""
+    return 10.0 + (sum(map(ord, ticker)) * 7919 % 50000) / 100.0
+
+def stub_history(np, ticker, first_day, last_day):
+    """Deterministic weekday closes for a ticker: a random walk ending near stub_price()."""
+    days = np.arange(first_day, last_day + 1, dtype=np.int64)
+    days = days[(days + 3) % 7 < 5]  # 1970-01-01 was a Thursday
+    rng = np.random.default_rng(zlib.crc32(ticker.encode()))
+    walk = np.cumprod(1.0 + rng.normal(0.0003, 0.015, len(days)))
+    return days, stub_price(ticker) * walk / walk[-1] if len(days) else walk
+
+class StubCompletions:
+    """Answers chat.completions.create() after a fixed delay, like the OpenAI SDK."""
+    def __init__(self, latency):
+        self.latency = latency
+
+    def create(self, messages=None, stream=False, **kwargs):
+        time.sleep(self.latency)
+        wants_json = any("JSON" in message["content"] for message in messages or [])
+        text = SAMPLE_RECOMMENDATIONS if wants_json else SAMPLE_INSIGHTS
+        if stream:
+            return iter([
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))])
+                for word in text.split()
+            ])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+def install_stubs(app_module, quote_latency, llm_latency):
+    """Swap in a market data provider and an OpenAI client that answer locally after the given latency."""
+    batch_size = app_module.QUOTE_BATCH_SIZE
+
+    class StubMarketDataProvider(app_module.MarketDataProvider):
+        """Deterministic quotes, one latency per QUOTE_BATCH_SIZE chunk like the yfinance provider."""
+        name = "stub"
+
+        def get_quotes(self, tickers):
+            time.sleep(quote_latency * max(1, -(-len(tickers) // batch_size)))
+            return {ticker: stub_price(ticker) for ticker in tickers}
+
+        def get_history(self, tickers, start_day=None):
+            time.sleep(quote_latency * max(1, -(-len(tickers) // batch_size)))
+            today = app_module._today_day_number()
+            first_day = start_day if start_day is not None else today - STUB_HISTORY_DAYS
+            return {ticker: stub_history(app_module.np, ticker, first_day, today) for ticker in tickers}
+
+    app_module.set_market_data_provider(StubMarketDataProvider())
+    app_module._openai_client = SimpleNamespace(chat=SimpleNamespace(completions=StubCompletions(llm_latency)))
+
+def seed_data(app_module, holdings, notifications=50):
+    """Fill the default partition with holdings and a page of notifications."""
+    lots = [
+        (f"T{i:05d}", float(1 + i % 100), round(stub_price(f"T{i:05d}") * 0.9, 2), None)
+        for i in range(holdings)
+    ]
+    with app_module.db.atomic():
+        app_module.add_lots(lots)
+    for i in range(notifications):
+        app_module.add_notification({
+            "type": "price_change",
+            "ticker": lots[i % len(lots)][0],
+            "title": f"Price Alert: {lots[i % len(lots)][0]}",
+            "message": "Benchmark notification",
+            "priority": "medium",
+        })
+
+def reset_caches(app_module):
+    """Drop cached quotes, insights and recommendations so every request does the full work."""
+    app_module.clear_quote_cache()
+    app_module.InsightCache.delete().execute()
+    app_module.RecommendationCache.delete().execute()
+
+def request_once(client, endpoint, job_timeout):
+    """Issue one request, following job endpoints through to the downloaded result. Returns success."""
+    if endpoint not in JOB_ENDPOINTS:
+        response = client.get(endpoint)
+        response.get_data()
+        return response.status_code == 200
+
+    method, payload = JOB_ENDPOINTS[endpoint]
+    response = client.open(endpoint, method=method, json=payload)
+    if response.status_code != 202:
+        return False
+    job = response.get_json()
+    deadline = time.monotonic() + job_timeout
+    while time.monotonic() < deadline:
+        status = client.get(job["status_url"]).get_json()["status"]
+        if status not in ("queued", "running"):
+            result = client.get(job["result_url"])
+            result.get_data()
+            return result.status_code == 200
+        time.sleep(0.002)
+    return False
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+def bench_endpoint(app_module, endpoint, args):
+    """Time repeated requests to one endpoint and measure the peak allocation of a single request."""
+    client = app_module.app.test_client()
+    request_once(client, endpoint, args.job_timeout)  # warm-up: imports, templates, styles
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker(count):
+        nonlocal errors
+        worker_client = app_module.app.test_client()
+        for _ in range(count):
+            if args.cold:
+                reset_caches(app_module)
+            started = time.perf_counter()
+            ok = request_once(worker_client, endpoint, args.job_timeout)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors += 1
+
+    per_worker = [args.requests // args.concurrency + (i < args.requests % args.concurrency)
+                  for i in range(args.concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(worker, per_worker))
+    wall = time.perf_counter() - started
+
+    if args.cold:
+        reset_caches(app_module)
+    tracemalloc.start()
+    request_once(client, endpoint, args.job_timeout)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "endpoint": endpoint,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3),
+        },
+        "peak_alloc_bytes": peak,
+    }
+
+def run_size(args):
+    """Benchmark every endpoint for one portfolio size inside this (fresh) process."""
+    sys.path.insert(0, REPO_DIR)
+    import app as app_module
+
+    install_stubs(app_module, args.quote_latency / 1000, args.llm_latency / 1000)
+    seed_started = time.perf_counter()
+    seed_data(app_module, args.holdings)
+    seed_seconds = time.perf_counter() - seed_started
+
+    results = [bench_endpoint(app_module, endpoint, args) for endpoint in args.endpoints]
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        max_rss *= 1024  # Linux reports kilobytes
+    return {
+        "holdings": args.holdings,
+        "seed_seconds": round(seed_seconds, 3),
+        "max_rss_bytes": max_rss,
+        "endpoints": results,
+    }
+
+def spawn_size(holdings, args):
+    """Run one size in a subprocess with its own working directory and database."""
+    with tempfile.TemporaryDirectory(prefix="stockly-bench-") as workdir:
+        env = dict(os.environ,
+                   OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "benchmark"),
+                   DATABASE_FILE=os.path.join(workdir, "stockly.db"),
+                   USER_PARTITIONING="0",
+                   ALERT_CHECK_INTERVAL="0")
+        command = [sys.executable, os.path.abspath(__file__), "--child",
+                   "--holdings", str(holdings),
+                   "--endpoints", ",".join(args.endpoints),
+                   "--requests", str(args.requests),
+                   "--concurrency", str(args.concurrency),
+                   "--quote-latency", str(args.quote_latency),
+                   "--llm-latency", str(args.llm_latency),
+                   "--job-timeout", str(args.job_timeout)]
+        if args.cold:
+            command.append("--cold")
+        completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise RuntimeError(f"Benchmark for {holdings} holdings failed:\n{completed.stderr}")
+        # The app prints progress and errors to stdout; the result is the last line
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Stockly endpoints with stubbed market data and LLM calls.")
+    parser.add_argument("--sizes", default="10,1000,10000", help="Comma-separated portfolio sizes (default: 10,1000,10000)")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="Comma-separated endpoints to benchmark")
+    parser.add_argument("--requests", type=int, default=20, help="Timed requests per endpoint and size (default: 20)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent clients (default: 1)")
+    parser.add_argument("--quote-latency", type=float, default=50.0, help="Injected ms per market data batch (default: 50)")
+    parser.add_argument("--llm-latency", type=float, default=500.0, help="Injected ms per LLM call (default: 500)")
+    parser.add_argument("--cold", action="store_true", help="Clear quote, insight and recommendation caches before every request")
+    parser.add_argument("--job-timeout", type=float, default=300.0, help="Seconds to wait for a queued job (default: 300)")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--holdings", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.endpoints = [endpoint for endpoint in args.endpoints.split(",") if endpoint]
+    args.concurrency = max(1, min(args.concurrency, args.requests))
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        print(json.dumps(run_size(args)))
+        return
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    report = {
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "quote_latency_ms": args.quote_latency,
+            "llm_latency_ms": args.llm_latency,
+            "cold_caches": args.cold,
+            "python": sys.version.split()[0],
+        },
+        "results": [],
+    }
+    for holdings in sizes:
+        print(f"Benchmarking {holdings} holdings...", file=sys.stderr)
+        report["results"].append(spawn_size(holdings, args))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Shared fixtures: the app runs against a throwaway database and directories, and market
+data comes from local files or in-memory providers instead of the network."""
+import os
+import sys
+import tempfile
+
+import pytest
+
+_workdir = tempfile.mkdtemp(prefix="stockly-tests-")
+os.environ.update(
+    DATABASE_FILE=os.path.join(_workdir, "stockly.db"),
+    PRICE_HISTORY_DIR=os.path.join(_workdir, "price_history"),
+    METRICS_DIR=os.path.join(_workdir, "metrics"),
+    JOB_RESULTS_DIR=os.path.join(_workdir, "job_results"),
+    MARKET_DATA_PROVIDER="local",
+    MARKET_DATA_PATH=os.path.join(_workdir, "market_data"),
+    OPENAI_API_KEY="test",
+    ALERT_CHECK_INTERVAL="0",
+    USER_PARTITIONING="0",
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as stockly  # noqa: E402
+
+TABLES = [stockly.Holding, stockly.Lot, stockly.Notification, stockly.Preference, stockly.Counter,
+          stockly.AlertReference, stockly.AlertLog, stockly.RecommendationCache, stockly.InsightCache,
+          stockly.Job]
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    """The app module with empty tables, caches and price history."""
+    monkeypatch.setattr(stockly, "PRICE_HISTORY_DIR", str(tmp_path / "price_history"))
+    for model in TABLES:
+        model.delete().execute()
+    stockly.clear_quote_cache()
+    stockly._history_next_refresh.clear()
+    stockly._returns_matrix_cache.clear()
+    yield stockly
+    stockly._quote_refresh_executor.submit(lambda: None).result()
+
+@pytest.fixture
+def today(app_module):
+    return app_module._today_day_number()
+
+@pytest.fixture
+def market_data(app_module, tmp_path):
+    """Write {ticker: [(day number, close), ...]} to a local CSV and serve it with LocalFileProvider."""
+    path = tmp_path / "closes.csv"
+
+    def write(series):
+        import numpy as np
+        lines = ["date,ticker,close"]
+        for ticker, rows in series.items():
+            for day, close in rows:
+                lines.append(f"{np.datetime64(int(day), 'D')},{ticker},{close}")
+        path.write_text("\n".join(lines) + "\n")
+        app_module.set_market_data_provider(app_module.LocalFileProvider(str(path)))
+
+    return write
+
+class ScriptedProvider(stockly.MarketDataProvider):
+    """Quotes and history from dicts, counting calls, that can be switched to failing."""
+    name = "scripted"
+
+    def __init__(self, quotes=None, history=None):
+        self.quotes = dict(quotes or {})
+        self.history = dict(history or {})
+        self.failing = False
+        self.quote_calls = []
+        self.history_calls = []
+
+    def get_quotes(self, tickers):
+        self.quote_calls.append(list(tickers))
+        if self.failing:
+            raise ConnectionError("upstream unavailable")
+        return {ticker: self.quotes[ticker] for ticker in tickers if ticker in self.quotes}
+
+    def get_history(self, tickers, start_day=None):
+        self.history_calls.append((list(tickers), start_day))
+        if self.failing:
+            raise ConnectionError("upstream unavailable")
+        history = {}
+        for ticker in tickers:
+            if ticker in self.history:
+                days, closes = self.history[ticker]
+                keep = [i for i, day in enumerate(days) if start_day is None or day >= start_day]
+                history[ticker] = ([days[i] for i in keep], [closes[i] for i in keep])
+        return history
+
+@pytest.fixture
+def scripted(app_module):
+    """Install a ScriptedProvider as the market data provider."""
+    provider = ScriptedProvider()
+    app_module.set_market_data_provider(provider)
+    return provider
@@ -0,0 +1,52 @@
+import pytest
+
+def _reference(app_module, ticker):
+    return app_module.AlertReference.get(app_module.AlertReference.ticker == app_module._partition_key(ticker)).price
+
+def _check(app_module, **prices):
+    return app_module._check_partition_alerts(list(prices), 5.0, prices)
+
+def test_first_sight_sets_the_reference_without_alerting(app_module):
+    assert _check(app_module, AAPL=100.0) == []
+    assert _reference(app_module, "AAPL") == pytest.approx(100.0)
+
+def test_moves_below_the_threshold_keep_the_reference(app_module):
+    _check(app_module, AAPL=100.0)
+
+    assert _check(app_module, AAPL=103.0) == []
+    assert _check(app_module, AAPL=104.0) == []
+    assert [alert["ticker"] for alert in _check(app_module, AAPL=105.0)] == ["AAPL"]
+
+def test_duplicate_alerts_are_suppressed_without_moving_the_reference(app_module):
+    _check(app_module, AAPL=100.0)
+
+    alerts = _check(app_module, AAPL=110.0)
+    assert [alert["message"] for alert in alerts] == ["AAPL rose 10.0%, now at $110.00"]
+    assert _reference(app_module, "AAPL") == pytest.approx(110.0)
+
+    # A second rise on the same day is deduplicated and still measured from the alerted price
+    assert _check(app_module, AAPL=120.0) == []
+    assert _reference(app_module, "AAPL") == pytest.approx(110.0)
+
+    alerts = _check(app_module, AAPL=104.0)
+    assert [alert["message"] for alert in alerts] == ["AAPL dropped 5.5%, now at $104.00"]
+    assert _reference(app_module, "AAPL") == pytest.approx(104.0)
+
+def test_alerts_are_not_repeated(app_module):
+    _check(app_module, AAPL=100.0, MSFT=200.0)
+
+    assert len(_check(app_module, AAPL=110.0, MSFT=220.0)) == 2
+    assert _check(app_module, AAPL=110.0, MSFT=220.0) == []
+    assert app_module.Notification.select().count() == 2
+
+def test_alert_cycle_checks_holdings(app_module, scripted):
+    scripted.quotes = {"AAPL": 100.0}
+    app_module.add_lot("AAPL", 1, 90.0, "2024-01-01")
+    assert app_module.check_price_alerts(force=True) == []
+
+    scripted.quotes = {"AAPL": 90.0}
+    app_module.clear_quote_cache()
+    alerts = app_module.check_price_alerts(force=True)
+
+    assert [(alert["ticker"], alert["priority"]) for alert in alerts] == [("AAPL", "high")]
+    assert app_module.check_price_alerts() == []
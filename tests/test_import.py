@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+
+def _frame(*rows):
+    return pd.DataFrame.from_records(rows, columns=["ticker", "shares", "purchase_price", "date_added"])
+
+def test_rows_are_checked_individually(app_module, scripted):
+    scripted.quotes = {"AAPL": 190.0, "MSFT": 410.0}
+    df = _frame(
+        ("aapl", "10", "150", "2024-01-15"),
+        ("MSFT", "abc", "300", None),
+        ("MSFT", "-1", "300", None),
+        ("BAD TICKER", "1", "1", None),
+        ("MSFT", "2", "0", None),
+        ("ZZZZ", "1", "1", None),
+    )
+
+    valid, errors = app_module.validate_holdings_frame(df)
+
+    assert valid["ticker"].tolist() == ["AAPL"]
+    assert valid["date_added"].tolist() == ["2024-01-15T00:00:00"]
+    assert [(error["row"], error["error"]) for error in errors] == [
+        (2, "Shares must be a number"),
+        (3, "Shares must be greater than 0"),
+        (4, "Invalid ticker symbol"),
+        (5, "Purchase price must be greater than 0"),
+        (6, "Unknown ticker or no price available"),
+    ]
+
+def test_missing_columns_are_rejected(app_module, scripted):
+    with pytest.raises(ValueError, match="purchase_price"):
+        app_module.validate_holdings_frame(pd.DataFrame({"ticker": ["AAPL"], "shares": ["1"]}))
+
+def test_tickers_are_checked_in_one_batch(app_module, scripted):
+    scripted.quotes = {"AAPL": 190.0, "MSFT": 410.0}
+
+    app_module.validate_holdings_frame(_frame(("AAPL", "1", "1", None), ("MSFT", "1", "1", None), ("AAPL", "2", "1", None)))
+
+    assert scripted.quote_calls == [["AAPL", "MSFT"]]
+
+def test_upstream_failure_is_not_reported_as_unknown_tickers(app_module, scripted):
+    scripted.failing = True
+
+    with pytest.raises(app_module.MarketDataUnavailable):
+        app_module.validate_holdings_frame(_frame(("AAPL", "1", "1", None)))
+
+def test_import_route_records_lots(app_module, scripted):
+    scripted.quotes = {"AAPL": 190.0}
+    client = app_module.app.test_client()
+
+    response = client.post("/portfolio/import", json=[
+        {"ticker": "AAPL", "shares": 2, "purchase_price": 150},
+        {"ticker": "AAPL", "shares": 1, "purchase_price": 180},
+        {"ticker": "NOPE", "shares": 1, "purchase_price": 1},
+    ])
+
+    assert response.status_code == 200
+    assert response.get_json()["imported"] == 2
+    assert [error["ticker"] for error in response.get_json()["errors"]] == ["NOPE"]
+    assert app_module.load_holding("AAPL")["shares"] == pytest.approx(3)
+    assert len(app_module.load_lots("AAPL")) == 2
+
+def test_import_route_asks_for_a_retry_when_upstream_fails(app_module, scripted):
+    scripted.failing = True
+    client = app_module.app.test_client()
+
+    response = client.post("/portfolio/import", json=[{"ticker": "AAPL", "shares": 2, "purchase_price": 150}])
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "30"
+    assert response.get_json()["retryable"] is True
+    assert app_module.load_holding("AAPL") is None
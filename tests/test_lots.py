@@ -0,0 +1,43 @@
+import pytest
+
+def test_sale_consumes_oldest_lots_first(app_module):
+    app_module.add_lot("AAPL", 10, 100.0, "2024-03-01")
+    app_module.add_lot("AAPL", 10, 120.0, "2024-01-01")
+    app_module.add_lot("AAPL", 10, 150.0, "2024-06-01")
+
+    sold_cost = app_module.sell_shares("AAPL", 15)
+
+    assert sold_cost == pytest.approx(10 * 120.0 + 5 * 100.0)
+    lots = app_module.load_lots("AAPL")
+    assert [(lot["date"], lot["remaining"]) for lot in lots] == [
+        ("2024-01-01", 0.0), ("2024-03-01", 5.0), ("2024-06-01", 10.0)
+    ]
+    holding = app_module.load_holding("AAPL")
+    assert holding["shares"] == pytest.approx(15)
+    assert holding["cost_basis"] == pytest.approx(5 * 100.0 + 10 * 150.0)
+    assert holding["purchase_price"] == pytest.approx((5 * 100.0 + 10 * 150.0) / 15)
+    assert holding["lot_count"] == 2
+
+def test_selling_everything_removes_the_holding(app_module):
+    app_module.add_lot("MSFT", 3, 200.0, "2024-01-01")
+    app_module.add_lot("MSFT", 2, 300.0, "2024-02-01")
+
+    assert app_module.sell_shares("MSFT", 5) == pytest.approx(3 * 200.0 + 2 * 300.0)
+    assert app_module.load_holding("MSFT") is None
+
+def test_overselling_raises_and_changes_nothing(app_module):
+    app_module.add_lot("NVDA", 4, 50.0, "2024-01-01")
+
+    with pytest.raises(ValueError):
+        app_module.sell_shares("NVDA", 5)
+    assert app_module.load_holding("NVDA")["shares"] == pytest.approx(4)
+    assert app_module.load_lots("NVDA")[0]["remaining"] == pytest.approx(4)
+
+def test_positions_aggregate_lots(app_module):
+    app_module.add_lots([("VTI", 2, 100.0, "2024-01-01"), ("VTI", 2, 200.0, "2024-02-01"), ("BND", 1, 70.0, None)])
+
+    portfolio = app_module.load_portfolio_data()
+    assert set(portfolio) == {"VTI", "BND"}
+    assert portfolio["VTI"]["shares"] == pytest.approx(4)
+    assert portfolio["VTI"]["purchase_price"] == pytest.approx(150.0)
+    assert portfolio["VTI"]["date_added"] == "2024-01-01"
@@ -0,0 +1,94 @@
+import numpy as np
+
+def _closes(first_day, last_day, start=100.0):
+    return [(day, start + day - first_day) for day in range(first_day, last_day + 1)]
+
+def test_new_tickers_are_stored_without_todays_bar(app_module, market_data, today):
+    market_data({"AAPL": _closes(today - 10, today)})
+
+    app_module.refresh_price_history(["AAPL"])
+
+    dates, closes = app_module.load_price_history("AAPL")
+    assert dates.tolist() == list(range(today - 10, today))
+    assert closes.tolist() == [100.0 + i for i in range(10)]
+
+def test_stale_history_is_extended_with_missing_bars_only(app_module, scripted, today):
+    days = list(range(today - 10, today))
+    scripted.history = {"AAPL": (days, [100.0 + i for i in range(10)])}
+    app_module._append_price_history("AAPL", np.array(days[:5]), np.array([100.0, 101.0, 102.0, 103.0, 104.0]))
+
+    app_module.refresh_price_history(["AAPL"])
+
+    assert scripted.history_calls == [(["AAPL"], days[4] + 1)]
+    dates, closes = app_module.load_price_history("AAPL")
+    assert dates.tolist() == days
+    assert closes.tolist() == [100.0 + i for i in range(10)]
+
+def test_current_history_is_not_downloaded_again(app_module, scripted, today):
+    app_module._append_price_history("AAPL", np.array([today - 1]), np.array([100.0]))
+
+    app_module.refresh_price_history(["AAPL"])
+    app_module.refresh_price_history(["AAPL"], force=True)
+
+    assert scripted.history_calls == []
+
+def test_refreshes_are_spaced_by_the_refresh_interval(app_module, scripted, today):
+    scripted.history = {"AAPL": ([today - 2], [100.0])}
+
+    app_module.refresh_price_history(["AAPL"])
+    scripted.history = {"AAPL": ([today - 2, today - 1], [100.0, 101.0])}
+    app_module.refresh_price_history(["AAPL"])
+
+    assert len(scripted.history_calls) == 1
+    assert app_module.load_price_history("AAPL")[0].tolist() == [today - 2]
+
+def test_failed_downloads_are_retried_after_the_retry_interval(app_module, scripted, today, monkeypatch):
+    monkeypatch.setattr(app_module, "PRICE_HISTORY_RETRY_INTERVAL", 0)
+    scripted.failing = True
+
+    app_module.refresh_price_history(["AAPL"])
+    assert len(app_module.load_price_history("AAPL")[0]) == 0
+
+    scripted.failing = False
+    scripted.history = {"AAPL": ([today - 2, today - 1], [100.0, 101.0])}
+    app_module.refresh_price_history(["AAPL"])
+    assert app_module.load_price_history("AAPL")[0].tolist() == [today - 2, today - 1]
+
+def test_failed_downloads_wait_for_the_retry_interval(app_module, scripted, today):
+    scripted.failing = True
+    app_module.refresh_price_history(["AAPL"])
+
+    scripted.failing = False
+    scripted.history = {"AAPL": ([today - 1], [100.0])}
+    app_module.refresh_price_history(["AAPL"])
+
+    assert len(scripted.history_calls) == 1
+    assert (app_module._history_next_refresh["AAPL"] - app_module.time.monotonic()
+            <= app_module.PRICE_HISTORY_RETRY_INTERVAL)
+
+def test_tickers_without_data_are_retried(app_module, scripted, today, monkeypatch):
+    monkeypatch.setattr(app_module, "PRICE_HISTORY_RETRY_INTERVAL", 0)
+
+    app_module.refresh_price_history(["NEW"])
+    scripted.history = {"NEW": ([today - 1], [10.0])}
+    app_module.refresh_price_history(["NEW"])
+
+    assert app_module.load_price_history("NEW")[0].tolist() == [today - 1]
+
+def test_recorded_sessions_replay_the_same_history(app_module, scripted, today, tmp_path):
+    recording = str(tmp_path / "session.jsonl")
+    scripted.quotes = {"AAPL": 190.0}
+    scripted.history = {"AAPL": ([today - 2, today - 1], [100.0, 101.0])}
+    app_module.set_market_data_provider(app_module.RecordingProvider(scripted, recording))
+    app_module.get_stock_prices(["AAPL"])
+    app_module.refresh_price_history(["AAPL"])
+    recorded = app_module.load_price_history("AAPL")[1].tolist()
+
+    app_module.set_market_data_provider(app_module.ReplayProvider(recording))
+    app_module._history_next_refresh.clear()
+    for column in ("dates", "close"):
+        (tmp_path / "price_history" / f"AAPL.{column}").unlink()
+    app_module.refresh_price_history(["AAPL"])
+
+    assert app_module.load_price_history("AAPL")[1].tolist() == recorded == [100.0, 101.0]
+    assert app_module.get_stock_prices(["AAPL"]) == {"AAPL": 190.0}
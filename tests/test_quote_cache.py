@@ -0,0 +1,95 @@
+import time
+
+import pandas as pd
+
+def _age(app_module, ticker, price, seconds):
+    """Put a quote fetched seconds ago into the cache."""
+    with app_module._quote_cache_lock:
+        app_module._quote_cache[ticker] = (price, time.monotonic() - seconds)
+
+def _finish_background_refresh(app_module):
+    app_module._quote_refresh_executor.submit(lambda: None).result()
+
+def test_fresh_quotes_are_served_from_the_cache(app_module, scripted):
+    scripted.quotes = {"AAPL": 190.0, "MSFT": 410.0}
+
+    assert app_module.get_stock_prices(["AAPL", "MSFT"]) == {"AAPL": 190.0, "MSFT": 410.0}
+    scripted.quotes = {"AAPL": 1.0, "MSFT": 1.0}
+    assert app_module.get_stock_prices(["MSFT", "AAPL"]) == {"AAPL": 190.0, "MSFT": 410.0}
+    assert len(scripted.quote_calls) == 1
+
+def test_expired_quotes_are_served_stale_and_refreshed_once(app_module, scripted):
+    scripted.quotes = {"AAPL": 200.0}
+    _age(app_module, "AAPL", 190.0, app_module.QUOTE_CACHE_TTL + 60)
+
+    stale = set()
+    assert app_module.get_stock_prices(["AAPL"], stale=stale) == {"AAPL": 190.0}
+    assert stale == {"AAPL"}
+    _finish_background_refresh(app_module)
+
+    stale = set()
+    assert app_module.get_stock_prices(["AAPL"], stale=stale) == {"AAPL": 200.0}
+    assert stale == set()
+    assert scripted.quote_calls == [["AAPL"]]
+
+def test_quotes_past_the_stale_limit_are_fetched_inline(app_module, scripted):
+    scripted.quotes = {"AAPL": 200.0}
+    _age(app_module, "AAPL", 190.0, app_module.QUOTE_STALE_TTL + 60)
+
+    stale = set()
+    assert app_module.get_stock_prices(["AAPL"], stale=stale) == {"AAPL": 200.0}
+    assert stale == set()
+
+def test_failed_refresh_keeps_serving_the_stale_quote(app_module, scripted):
+    scripted.failing = True
+    _age(app_module, "AAPL", 190.0, app_module.QUOTE_CACHE_TTL + 60)
+
+    assert app_module.get_stock_prices(["AAPL"]) == {"AAPL": 190.0}
+    _finish_background_refresh(app_module)
+    assert app_module.get_stock_prices(["AAPL"]) == {"AAPL": 190.0}
+
+def test_missing_tickers_are_left_out(app_module, scripted):
+    scripted.quotes = {"AAPL": 190.0}
+
+    assert app_module.get_stock_prices(["AAPL", "NOPE"]) == {"AAPL": 190.0}
+
+def test_breaker_opens_after_upstream_failures(app_module, scripted, monkeypatch):
+    monkeypatch.setattr(app_module, "MARKET_DATA_RETRIES", 0)
+    monkeypatch.setattr(app_module, "MARKET_DATA_FAILURE_THRESHOLD", 2)
+    provider = app_module.ResilientProvider(scripted)
+    app_module.set_market_data_provider(provider)
+    scripted.failing = True
+
+    assert app_module.get_stock_prices(["AAPL"]) == {}
+    assert app_module.get_stock_prices(["MSFT"]) == {}
+    assert provider.breaker.state == "open"
+
+    # While open, requests fail fast without reaching the upstream
+    scripted.failing = False
+    scripted.quotes = {"AAPL": 190.0}
+    assert app_module.get_stock_prices(["AAPL"]) == {}
+    assert len(scripted.quote_calls) == 2
+
+def test_unknown_tickers_do_not_open_the_breaker(app_module, monkeypatch):
+    class FakeTicker:
+        def __init__(self, ticker):
+            self.ticker = ticker
+
+        def history(self, period):
+            if self.ticker == "AAPL":
+                return pd.DataFrame({"Close": [190.0]})
+            return pd.DataFrame()
+
+    class FakeYFinance:
+        Ticker = FakeTicker
+
+    monkeypatch.setattr(app_module, "yf", FakeYFinance)
+    monkeypatch.setattr(app_module, "MARKET_DATA_RETRIES", 0)
+    monkeypatch.setattr(app_module, "MARKET_DATA_RATE_LIMIT", 0)
+    provider = app_module.ResilientProvider(app_module.YFinanceProvider())
+    app_module.set_market_data_provider(provider)
+
+    for i in range(app_module.MARKET_DATA_FAILURE_THRESHOLD * 2):
+        assert app_module.get_stock_prices([f"BAD{i}"]) == {}
+    assert provider.breaker.state == "closed"
+    assert app_module.get_stock_prices(["AAPL"]) == {"AAPL": 190.0}
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+def _day(day):
+    return str(np.datetime64(int(day), 'D'))
+
+def _series(app_module):
+    dates, values = app_module.get_portfolio_value_series(app_module.load_portfolio_data(), period="max")
+    return dates.tolist(), values.tolist()
+
+def test_series_runs_to_the_latest_close_carrying_stale_holdings(app_module, market_data, today):
+    market_data({
+        "AAPL": [(today - 3, 10.0), (today - 2, 11.0), (today - 1, 12.0)],
+        "MSFT": [(today - 3, 100.0)],
+    })
+    app_module.add_lots([("AAPL", 2, 10.0, _day(today - 30)), ("MSFT", 1, 100.0, _day(today - 30))])
+
+    dates, values = _series(app_module)
+
+    assert dates == [today - 3, today - 2, today - 1]
+    assert values == pytest.approx([120.0, 122.0, 124.0])
+
+def test_lots_count_from_their_purchase_date(app_module, market_data, today):
+    market_data({"AAPL": [(day, 10.0) for day in range(today - 5, today)]})
+    app_module.add_lots([("AAPL", 1, 10.0, _day(today - 5)), ("AAPL", 2, 10.0, _day(today - 3))])
+
+    dates, values = _series(app_module)
+
+    assert dates == list(range(today - 5, today))
+    assert values == pytest.approx([10.0, 10.0, 30.0, 30.0, 30.0])
+
+def test_late_closes_replace_carried_values(app_module, market_data, today, monkeypatch):
+    monkeypatch.setattr(app_module, "PRICE_HISTORY_REFRESH_INTERVAL", 0)
+    aapl = [(today - 3, 10.0), (today - 2, 11.0), (today - 1, 12.0)]
+    market_data({"AAPL": aapl, "MSFT": [(today - 3, 100.0)]})
+    app_module.add_lots([("AAPL", 1, 10.0, _day(today - 30)), ("MSFT", 1, 100.0, _day(today - 30))])
+    _series(app_module)
+
+    market_data({"AAPL": aapl, "MSFT": [(today - 3, 100.0), (today - 2, 105.0), (today - 1, 90.0)]})
+    dates, values = _series(app_module)
+
+    assert dates == [today - 3, today - 2, today - 1]
+    assert values == pytest.approx([110.0, 116.0, 102.0])
+    schedules = app_module._position_schedules(app_module.load_portfolio_data())
+    full_days, full_values, _ = app_module._compute_portfolio_values(schedules)
+    assert dates == full_days.tolist()
+    assert values == pytest.approx(full_values.tolist())
+
+def test_selling_rebuilds_the_series(app_module, market_data, today):
+    market_data({"AAPL": [(today - 2, 10.0), (today - 1, 20.0)]})
+    app_module.add_lots([("AAPL", 3, 10.0, _day(today - 30))])
+    assert _series(app_module)[1] == pytest.approx([30.0, 60.0])
+
+    app_module.sell_shares("AAPL", 2)
+
+    assert _series(app_module)[1] == pytest.approx([10.0, 20.0])
+
+def test_empty_portfolio_has_no_series(app_module, market_data, today):
+    market_data({"AAPL": [(today - 1, 10.0)]})
+
+    assert _series(app_module) == ([], [])